@@ -1,8 +1,10 @@
 
 import os
 import json
+import time
 import requests
 from typing import Optional, Dict, Any
+import llm_calllog
 
 # 環境変数からのデフォルト
 DEFAULT_API_TOKEN = os.getenv("HF_TOKEN")  # export HF_TOKEN=... を想定
@@ -73,19 +75,35 @@ def call_llm(
         # ユーザーの追加指定で上書き・追加
         payload.update(extra_payload)
 
+    # 呼び出しごとにモデル・レイテンシ・トークン数などを llm_calllog に追記する
+    record = llm_calllog.new_record("hf", model_name, system_instruction, user_content, attempts=1)
+    t_start = time.perf_counter()
     try:
-        resp = requests.post(url, headers=DEFAULT_HEADERS(token), data=json.dumps(payload), timeout=timeout)
-    except requests.exceptions.RequestException as e:
-        raise RuntimeError(f"HTTPリクエストに失敗しました: {e}")
-
-    if resp.status_code != 200:
-        # デバッグしやすいように本文も含める
-        raise RuntimeError(f"APIエラー (status={resp.status_code}): {resp.text}")
-
-    try:
-        data = resp.json()
-    except ValueError as e:
-        raise RuntimeError(f"レスポンスのJSON解析に失敗しました: {e}\nraw={resp.text[:500]}")
+        try:
+            resp = requests.post(url, headers=DEFAULT_HEADERS(token), data=json.dumps(payload), timeout=timeout)
+        except requests.exceptions.RequestException as e:
+            record['statuses'].append(None)
+            raise RuntimeError(f"HTTPリクエストに失敗しました: {e}")
+
+        record['statuses'].append(resp.status_code)
+        record['status'] = resp.status_code
+        record['ttfb'] = resp.elapsed.total_seconds()
+        if resp.status_code != 200:
+            # デバッグしやすいように本文も含める
+            raise RuntimeError(f"APIエラー (status={resp.status_code}): {resp.text}")
+
+        try:
+            data = resp.json()
+        except ValueError as e:
+            raise RuntimeError(f"レスポンスのJSON解析に失敗しました: {e}\nraw={resp.text[:500]}")
+        llm_calllog.record_usage(record, data)
+        record['ok'] = True
+    except RuntimeError as e:
+        record['error'] = str(e)[:500]
+        raise
+    finally:
+        record['latency'] = time.perf_counter() - t_start
+        llm_calllog.log_call(record)
 
     # OpenAI/HF Router 互換フォーマット: choices[0].message.content
     try:
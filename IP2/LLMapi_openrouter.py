@@ -4,7 +4,9 @@ import os
 import json
 import requests
 import time
-from typing import Optional, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List
+import llm_calllog
 
 # ===== OpenRouter 設定 =====
 # 環境変数: export OPENROUTER_API_KEY=...
@@ -33,37 +35,8 @@ def default_headers(token: str,
     return headers
 
 
-def call_llm(
-    user_content: str,
-    system_instruction: str = "あなたは強化学習の専門家です。報酬設計をしてください。",
-    *,
-    model: Optional[str] = None,
-    api_token: Optional[str] = None,
-    api_url: Optional[str] = None,
-    max_tokens: int = 800,
-    temperature: float = 0.7,
-    top_p: float = 0.95,
-    extra_payload: Optional[Dict[str, Any]] = None,
-    timeout: int = 120,
-    http_referer: Optional[str] = None,
-    x_title: Optional[str] = None,
-    # ▼ 追加：デバッグと簡易リトライ
-    debug: bool = False,
-    retries: int = 2,
-    backoff_sec: float = 1.0,
-) -> str:
-    """
-    OpenRouter でチャット補完を行うラッパ。
-    成功時: モデル出力テキスト（str）を返す。
-    失敗時: RuntimeError を送出。
-    """
-    token = api_token or DEFAULT_API_TOKEN
-    if not token:
-        raise RuntimeError("環境変数 OPENROUTER_API_KEY が未設定です。api_token で渡すか、環境変数を設定してください。")
-
-    url = api_url or DEFAULT_API_URL
-    model_name = model or DEFAULT_MODEL
-
+def _build_payload(model_name: str, system_instruction: str, user_content: str, max_tokens: int,
+                   temperature: float, top_p: float, extra_payload: Optional[Dict[str, Any]]) -> Dict[str, Any]:
     payload: Dict[str, Any] = {
         "model": model_name,
         "messages": [
@@ -77,16 +50,36 @@ def call_llm(
     }
     if extra_payload:
         payload.update(extra_payload)
+    return payload
+
 
+def _post_chat(url: str, headers: Dict[str, str], payload: Dict[str, Any], *,
+               timeout: int, debug: bool, retries: int, backoff_sec: float,
+               record: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    /chat/completions に POST してレスポンスJSONを返す（429/5xx・通信エラーはリトライ）。
+    record（llm_calllog.new_record）を渡すと試行回数・HTTPステータス・TTFB・usage を書き込む。
+    失敗時: RuntimeError を送出。
+    """
+    record = record if record is not None else {'statuses': []}
     last_err: Optional[Exception] = None
     for attempt in range(retries + 1):
+        record['attempts'] = attempt + 1
         try:
-            resp = requests.post(
-                url,
-                headers=default_headers(token, referer=http_referer, title=x_title),
-                data=json.dumps(payload),
-                timeout=timeout,
-            )
+            try:
+                resp = requests.post(
+                    url,
+                    headers=headers,
+                    data=json.dumps(payload),
+                    timeout=timeout,
+                )
+            except requests.exceptions.RequestException:
+                record['statuses'].append(None)
+                record['status'] = None
+                raise
+            record['statuses'].append(resp.status_code)
+            record['status'] = resp.status_code
+            record['ttfb'] = resp.elapsed.total_seconds() # リクエスト送信からレスポンスヘッダ受信まで
             if resp.status_code != 200:
                 # 429/5xx はリトライ
                 if resp.status_code in (429, 500, 502, 503, 504) and attempt < retries:
@@ -103,36 +96,8 @@ def call_llm(
 
             if debug:
                 print("[DEBUG] raw response:", json.dumps(data, ensure_ascii=False)[:3000])
-
-            # ===== 出力取り出し（フォールバック付き）=====
-            msg = None
-            try:
-                msg = data["choices"][0]["message"]
-            except Exception:
-                msg = None
-
-            content: Optional[str] = None
-            if isinstance(msg, dict):
-                # 1) 通常の content
-                c = msg.get("content")
-                if isinstance(c, str) and c.strip():
-                    content = c
-                else:
-                    # 2) content が空/None → reasoning をフォールバック
-                    r = msg.get("reasoning")
-                    if isinstance(r, str) and r.strip():
-                        content = r
-                    else:
-                        # 3) 拒否理由の可能性
-                        ref = msg.get("refusal")
-                        if isinstance(ref, str) and ref.strip():
-                            content = ref
-
-            # 4) それでも空なら生JSONを返す（デバッグ用）
-            if not content or not content.strip():
-                content = json.dumps(data, ensure_ascii=False)
-
-            return content
+            llm_calllog.record_usage(record, data)
+            return data
 
         except (requests.exceptions.RequestException, RuntimeError) as e:
             last_err = e
@@ -147,6 +112,161 @@ def call_llm(
     raise RuntimeError(f"不明なエラー: {last_err}")
 
 
+def _logged_post(url: str, headers: Dict[str, str], payload: Dict[str, Any],
+                 system_instruction: str, user_content: str, **kwargs: Any) -> Dict[str, Any]:
+    """_post_chat を呼び、モデル・レイテンシ・トークン数などの記録を llm_calllog に追記する"""
+    record = llm_calllog.new_record("openrouter", payload["model"], system_instruction, user_content,
+                                    n=payload.get("n", 1))
+    t_start = time.perf_counter()
+    try:
+        data = _post_chat(url, headers, payload, record=record, **kwargs)
+        record['ok'] = True
+        return data
+    except RuntimeError as e:
+        record['error'] = str(e)[:500]
+        raise
+    finally:
+        record['latency'] = time.perf_counter() - t_start
+        llm_calllog.log_call(record)
+
+
+def _choice_content(choice: Any) -> Optional[str]:
+    """choices[i] から出力テキストを取り出す（content → reasoning → refusal の順にフォールバック）"""
+    msg = choice.get("message") if isinstance(choice, dict) else None
+    if not isinstance(msg, dict):
+        return None
+    # 1) 通常の content
+    c = msg.get("content")
+    if isinstance(c, str) and c.strip():
+        return c
+    # 2) content が空/None → reasoning をフォールバック
+    r = msg.get("reasoning")
+    if isinstance(r, str) and r.strip():
+        return r
+    # 3) 拒否理由の可能性
+    ref = msg.get("refusal")
+    if isinstance(ref, str) and ref.strip():
+        return ref
+    return None
+
+
+def call_llm(
+    user_content: str,
+    system_instruction: str = "あなたは強化学習の専門家です。報酬設計をしてください。",
+    *,
+    model: Optional[str] = None,
+    api_token: Optional[str] = None,
+    api_url: Optional[str] = None,
+    max_tokens: int = 800,
+    temperature: float = 0.7,
+    top_p: float = 0.95,
+    extra_payload: Optional[Dict[str, Any]] = None,
+    timeout: int = 120,
+    http_referer: Optional[str] = None,
+    x_title: Optional[str] = None,
+    # ▼ 追加：デバッグと簡易リトライ
+    debug: bool = False,
+    retries: int = 2,
+    backoff_sec: float = 1.0,
+) -> str:
+    """
+    OpenRouter でチャット補完を行うラッパ。
+    成功時: モデル出力テキスト（str）を返す。
+    失敗時: RuntimeError を送出。
+    """
+    token = api_token or DEFAULT_API_TOKEN
+    if not token:
+        raise RuntimeError("環境変数 OPENROUTER_API_KEY が未設定です。api_token で渡すか、環境変数を設定してください。")
+
+    payload = _build_payload(model or DEFAULT_MODEL, system_instruction, user_content,
+                             max_tokens, temperature, top_p, extra_payload)
+    data = _logged_post(api_url or DEFAULT_API_URL, default_headers(token, referer=http_referer, title=x_title),
+                        payload, system_instruction, user_content,
+                        timeout=timeout, debug=debug, retries=retries, backoff_sec=backoff_sec)
+
+    # ===== 出力取り出し（フォールバック付き）=====
+    choices = data.get("choices") if isinstance(data, dict) else None
+    content = _choice_content(choices[0]) if choices else None
+
+    # 4) それでも空なら生JSONを返す（デバッグ用）
+    if not content or not content.strip():
+        content = json.dumps(data, ensure_ascii=False)
+
+    return content
+
+
+def call_llm_samples(
+    user_content: str,
+    system_instruction: str = "あなたは強化学習の専門家です。報酬設計をしてください。",
+    *,
+    n: int = 1,
+    model: Optional[str] = None,
+    api_token: Optional[str] = None,
+    api_url: Optional[str] = None,
+    max_tokens: int = 800,
+    temperature: float = 0.7,
+    top_p: float = 0.95,
+    extra_payload: Optional[Dict[str, Any]] = None,
+    timeout: int = 120,
+    http_referer: Optional[str] = None,
+    x_title: Optional[str] = None,
+    debug: bool = False,
+    retries: int = 2,
+    backoff_sec: float = 1.0,
+    max_workers: int = 4,
+) -> List[str]:
+    """
+    同じプロンプトで n 個の補完を取る。
+    まず API の n パラメータで1回のリクエストにまとめ、返ってきた choices が足りなければ
+    （n に対応していないプロバイダなど）残りを call_llm の並列呼び出しで補う。
+    成功時: 出力テキストのリスト（最大 n 個。一部の並列呼び出しが失敗した分は含まない）。
+    失敗時: 1つも取れなければ RuntimeError を送出。
+    """
+    token = api_token or DEFAULT_API_TOKEN
+    if not token:
+        raise RuntimeError("環境変数 OPENROUTER_API_KEY が未設定です。api_token で渡すか、環境変数を設定してください。")
+
+    common = dict(
+        model=model, api_token=token, api_url=api_url, max_tokens=max_tokens, temperature=temperature,
+        top_p=top_p, timeout=timeout, http_referer=http_referer, x_title=x_title,
+        debug=debug, retries=retries, backoff_sec=backoff_sec,
+    )
+    if n <= 1:
+        return [call_llm(user_content, system_instruction, extra_payload=extra_payload, **common)]
+
+    contents: List[str] = []
+    errors: List[Exception] = []
+    payload = _build_payload(model or DEFAULT_MODEL, system_instruction, user_content,
+                             max_tokens, temperature, top_p, dict(extra_payload or {}, n=n))
+    try:
+        data = _logged_post(api_url or DEFAULT_API_URL, default_headers(token, referer=http_referer, title=x_title),
+                            payload, system_instruction, user_content,
+                            timeout=timeout, debug=debug, retries=retries, backoff_sec=backoff_sec)
+        for choice in (data.get("choices") or [])[:n]:
+            content = _choice_content(choice)
+            if content:
+                contents.append(content)
+    except RuntimeError as e:
+        errors.append(e)
+
+    missing = n - len(contents)
+    if missing > 0:
+        if debug:
+            print(f"[DEBUG] got {len(contents)}/{n} choices with n={n}; {missing} parallel calls")
+        with ThreadPoolExecutor(max_workers=min(max_workers, missing)) as pool:
+            futures = [pool.submit(call_llm, user_content, system_instruction, extra_payload=extra_payload, **common)
+                       for _ in range(missing)]
+            for future in futures:
+                try:
+                    contents.append(future.result())
+                except RuntimeError as e:
+                    errors.append(e)
+
+    if not contents:
+        raise RuntimeError(f"HTTP/API呼び出しに失敗しました: {errors[-1] if errors else 'no choices'}")
+    return contents
+
+
 def main():
     token = DEFAULT_API_TOKEN
     if not token:
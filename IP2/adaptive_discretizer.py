@@ -0,0 +1,254 @@
+# adaptive_discretizer.py
+import os
+import json
+import argparse
+import numpy as np
+
+
+class AdaptiveDiscretizer:
+    """
+    記録したロールアウトの観測から次元ごとの区切り（cuts）を決めた離散化器。
+    手で決めた np.linspace の bins と違い、データの多いところを細かく、少ないところを粗く切る。
+
+    状態番号は cuts[d] の中で obs[d] 以下の区切りの数（np.digitize と同じ向き）なので、
+    次元 d のビン数は len(cuts[d]) + 1。他の離散化器と同じく __call__ と shape を持つ。
+    """
+    def __init__(self, cuts, method=None):
+        self.cuts = [np.asarray(c, dtype=np.float64) for c in cuts]
+        self.method = method
+        self.shape = tuple(len(c) + 1 for c in self.cuts)
+
+    def __call__(self, obs):
+        return tuple(int(np.searchsorted(c, obs[i], side='right')) for i, c in enumerate(self.cuts))
+
+    def batch(self, obs_batch):
+        """観測の配列 (N, 次元) を状態インデックスの配列 (N, 次元) にまとめて変換する"""
+        obs_batch = np.asarray(obs_batch)
+        return np.stack([np.searchsorted(c, obs_batch[:, i], side='right') for i, c in enumerate(self.cuts)],
+                        axis=1)
+
+    @property
+    def num_states(self):
+        return int(np.prod(self.shape))
+
+    def to_dict(self):
+        return {'method': self.method, 'cuts': [c.tolist() for c in self.cuts]}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['cuts'], method=data.get('method'))
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+    def __repr__(self):
+        return f"AdaptiveDiscretizer(shape={self.shape}, method={self.method})"
+
+
+def quantile_cuts(values, n_bins):
+    """
+    各ビンに同じ数のサンプルが入るように区切る。
+    同じ値が大量にある次元（例: ほとんど 0 のセンサー）は区切りが重なるので、ビン数は n_bins より少なくなる。
+    """
+    x = np.sort(np.asarray(values, dtype=np.float64))
+    if n_bins <= 1 or x[0] == x[-1]:
+        return np.empty(0)
+    q = x[(np.arange(1, n_bins) * len(x)) // n_bins]
+    # 区切りは分位点の値とその次の異なる値の中点に置く（同じ値は必ず同じビンに入る）
+    upper = np.searchsorted(x, q, side='right')
+    valid = upper < len(x)
+    cuts = (q[valid] + x[upper[valid]]) / 2
+    return np.unique(cuts)
+
+
+def variance_cuts(values, n_bins, iters=50):
+    """
+    ビン内の分散の合計が小さくなるように区切る（1次元の k-means。初期値は quantile_cuts）。
+    値がまとまって分布している次元では、等頻度より塊の境目に区切りが来る。
+    """
+    x = np.sort(np.asarray(values, dtype=np.float64))
+    cuts = quantile_cuts(x, n_bins)
+    for _ in range(iters):
+        idx = np.searchsorted(cuts, x, side='right')
+        counts = np.bincount(idx, minlength=len(cuts) + 1)
+        sums = np.bincount(idx, weights=x, minlength=len(cuts) + 1)
+        centers = sums[counts > 0] / counts[counts > 0]
+        new_cuts = (centers[:-1] + centers[1:]) / 2
+        if len(new_cuts) == len(cuts) and np.allclose(new_cuts, cuts):
+            break
+        cuts = new_cuts
+    return cuts
+
+
+def uniform_cuts(values, n_bins):
+    """観測の最小値から最大値までを等間隔に区切る（比較用）"""
+    x = np.asarray(values, dtype=np.float64)
+    if n_bins <= 1 or x.min() == x.max():
+        return np.empty(0)
+    return np.linspace(x.min(), x.max(), n_bins + 1)[1:-1]
+
+
+CUT_METHODS = {
+    'quantile': quantile_cuts,
+    'variance': variance_cuts,
+    'uniform': uniform_cuts,
+}
+
+
+def quantization_error(values, cuts):
+    """ビン内の分散の合計 / 全体の分散（0: 区切りで値を完全に表せる, 1: 1ビンと同じ）"""
+    x = np.asarray(values, dtype=np.float64)
+    total = x.var() * len(x)
+    if total == 0:
+        return 0.0
+    idx = np.searchsorted(cuts, x, side='right')
+    counts = np.bincount(idx, minlength=len(cuts) + 1)
+    sums = np.bincount(idx, weights=x, minlength=len(cuts) + 1)
+    sq = np.bincount(idx, weights=x * x, minlength=len(cuts) + 1)
+    nz = counts > 0
+    within = np.sum(sq[nz] - sums[nz] ** 2 / counts[nz])
+    return float(max(within, 0.0) / total)
+
+
+def _allocate_bins(options, state_budget):
+    """
+    次元ごとの候補 { ビン数: (誤差, cuts) } から、状態数の積が state_budget 以下になるように
+    「状態数の増加率あたりの誤差の減り」が大きい次元から順にビンを増やす。
+    """
+    chosen = [1] * len(options)
+    sizes = [sorted(opts) for opts in options]
+    while True:
+        total = int(np.prod(chosen))
+        best, best_score = None, 0.0
+        for d, opts in enumerate(options):
+            larger = [n for n in sizes[d] if n > chosen[d]]
+            if not larger:
+                continue
+            n_next = larger[0]
+            if total // chosen[d] * n_next > state_budget:
+                continue
+            gain = opts[chosen[d]][0] - opts[n_next][0]
+            score = gain / np.log(n_next / chosen[d])
+            if score > best_score:
+                best, best_score = (d, n_next), score
+        if best is None:
+            return chosen
+        chosen[best[0]] = best[1]
+
+
+def fit_discretizer(obs, n_bins=6, state_budget=None, method='quantile', max_bins=16):
+    """
+    観測の配列から AdaptiveDiscretizer を作る。
+
+    Args:
+        obs: 観測の配列 (N, 次元)。ランダム方策の軌跡でも、学習済み方策の軌跡でもよい
+        n_bins: 次元ごとのビン数（int または次元ごとのリスト）。state_budget を指定したときは使わない
+        state_budget: 状態数の上限。次元ごとのビン数は誤差の減り方を見て自動で配分する
+        method: 'quantile'（等頻度）/ 'variance'（ビン内分散最小）/ 'uniform'（等間隔）
+        max_bins: state_budget 指定時の1次元あたりのビン数の上限
+    """
+    if method not in CUT_METHODS:
+        raise ValueError(f"Unknown method: {method} (available: {', '.join(CUT_METHODS)})")
+    cut_fn = CUT_METHODS[method]
+    obs = np.asarray(obs, dtype=np.float64)
+    dims = obs.shape[1]
+
+    if state_budget is None:
+        bins = [n_bins] * dims if np.isscalar(n_bins) else list(n_bins)
+        if len(bins) != dims:
+            raise ValueError(f"n_bins has {len(bins)} entries but obs has {dims} dimensions")
+        return AdaptiveDiscretizer([cut_fn(obs[:, d], bins[d]) for d in range(dims)], method=method)
+
+    # 次元ごとにビン数を変えて切ってみて、実際のビン数（重なりで減ることがある）ごとに一番良い区切りを残す
+    options = []
+    for d in range(dims):
+        opts = {1: (quantization_error(obs[:, d], np.empty(0)), np.empty(0))}
+        for k in range(2, max_bins + 1):
+            cuts = cut_fn(obs[:, d], k)
+            err = quantization_error(obs[:, d], cuts)
+            n = len(cuts) + 1
+            if n not in opts or err < opts[n][0]:
+                opts[n] = (err, cuts)
+        options.append(opts)
+    chosen = _allocate_bins(options, state_budget)
+    return AdaptiveDiscretizer([options[d][n][1] for d, n in enumerate(chosen)], method=method)
+
+
+def rollout_observations(trajectories):
+    """TrajectorySet から、各ステップの観測と各エピソードの最後の観測を集める"""
+    last = trajectories.next_obs[trajectories.terminated | trajectories.truncated]
+    return np.concatenate([trajectories.obs, last])
+
+
+def occupancy_report(discretizer, obs):
+    """
+    観測の配列を離散化したときの状態の使われ方を集計する（どの離散化器でも使える）。
+
+    Returns:
+        { 'states': 全状態数, 'visited': 1回以上訪れた状態数, 'visited_frac',
+          'effective_states': 訪問分布のエントロピーから見た実効状態数 exp(H),
+          'max_share': 一番多い状態の割合, 'median_visits': 訪れた状態の訪問数の中央値,
+          'dim_counts': 次元ごとのビン別サンプル数のリスト }
+    """
+    obs = np.asarray(obs)
+    shape = tuple(discretizer.shape)
+    if hasattr(discretizer, 'batch'):
+        idx = discretizer.batch(obs)
+    else:
+        idx = np.array([discretizer(o) for o in obs])
+    flat = np.ravel_multi_index(idx.T, shape)
+    counts = np.bincount(flat, minlength=int(np.prod(shape)))
+    visited = counts[counts > 0]
+    p = visited / visited.sum()
+    return {
+        'states': int(np.prod(shape)),
+        'visited': int(len(visited)),
+        'visited_frac': float(len(visited) / np.prod(shape)),
+        'effective_states': float(np.exp(-np.sum(p * np.log(p)))),
+        'max_share': float(p.max()),
+        'median_visits': float(np.median(visited)),
+        'dim_counts': [np.bincount(idx[:, d], minlength=shape[d]).tolist() for d in range(len(shape))],
+    }
+
+
+def print_occupancy(report, title="Discretizer"):
+    print(f"[Discretizer] {title}: {report['visited']}/{report['states']} states visited "
+          f"({report['visited_frac']:.1%}), effective {report['effective_states']:.1f}, "
+          f"max share {report['max_share']:.1%}, median visits {report['median_visits']:.0f}")
+    for d, counts in enumerate(report['dim_counts']):
+        print(f"  dim {d}: {counts}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="記録したロールアウトから離散化の区切りを決め、状態の使われ方を比べる")
+    parser.add_argument("task", help="タスク名 (cooling / gridworld / cartpole)")
+    parser.add_argument("--method", default="quantile", choices=sorted(CUT_METHODS))
+    parser.add_argument("--bins", type=int, default=6, help="次元ごとのビン数（--budget 指定時は無視）")
+    parser.add_argument("--budget", type=int, default=None, help="状態数の上限")
+    parser.add_argument("--episodes", type=int, default=30, help="軌跡がなければ記録するエピソード数")
+    parser.add_argument("--out", default=None, help="区切りを保存する JSON ファイル")
+    args = parser.parse_args()
+
+    from tasks import get_task
+    from reward_screening import load_or_record_trajectories
+
+    task = get_task(args.task)
+    path = os.path.splitext(task.cache_file)[0] + "_trajectories.pkl"
+    obs = rollout_observations(load_or_record_trajectories(path, task.env_factory, episodes=args.episodes))
+    print_occupancy(occupancy_report(task.discretizer, obs), title=f"{args.task} (hand-picked)")
+
+    discretizer = fit_discretizer(obs, n_bins=args.bins, state_budget=args.budget, method=args.method)
+    print_occupancy(occupancy_report(discretizer, obs), title=f"{args.task} ({args.method}, shape={discretizer.shape})")
+    if args.out:
+        discretizer.save(args.out)
+        print(f"[Discretizer] Saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+# distributed.py
+# 複数マシンに学習ジョブを配るコーディネータ／ワーカー。
+#
+#   コーディネータ: python distributed.py coordinator sweep_config.json --port 6000
+#   ワーカー      : python distributed.py worker --host <coordinator> --port 6000
+#   ローカル検証  : python distributed.py local sweep_config.json --workers 4
+#
+# ジョブは sweep.py と同じ仕様（タスク名・報酬コード・seed・エピソード数・hparams）で、
+# ワーカーは tasks.get_task で env_factory / discretizer / metric_fn を組み立てて学習し、
+# エピソードごとの指標配列だけを送り返す。保存とキューの更新はコーディネータが行う。
+#
+# multiprocessing.connection は受け取ったメッセージを unpickle し、ワーカーは受け取った報酬コードを exec するので、
+# 認証キーは既定値を持たない。コーディネータ・ワーカーとも環境変数 SWEEP_AUTHKEY を設定して起動する
+# （local モードは起動ごとにランダムなキーを作る）。コーディネータは既定で 127.0.0.1 だけで待ち受ける。
+#
+# メッセージ (multiprocessing.connection, authkey で認証):
+#   worker -> ('get', worker_id)                     : ('job', job) / ('wait', 秒) / ('stop',)
+#   worker -> ('heartbeat', worker_id, job_id)       : ('ok',) / ('cancel',)
+#   worker -> ('result', worker_id, job_id, result)  : ('ok',)
+# ハートビートが lease_timeout 秒途切れたジョブは、別のワーカーへ再配布する。
+import os
+import sys
+import time
+import socket
+import secrets
+import argparse
+import threading
+import traceback
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import Listener, Client
+
+import numpy as np
+from results_store import ResultsStore
+from sweep import JobQueue, expand_jobs, train_job, save_job_result, PENDING, RUNNING, DONE, FAILED
+
+DEFAULT_PORT = 6000
+AUTHKEY_ENV = "SWEEP_AUTHKEY"
+
+
+def load_authkey():
+    """環境変数 SWEEP_AUTHKEY から認証キーを読む。未設定なら起動しない"""
+    key = os.getenv(AUTHKEY_ENV)
+    if not key:
+        raise RuntimeError(f"{AUTHKEY_ENV} is not set. Set the same secret on the coordinator and every worker "
+                           f"(e.g. export {AUTHKEY_ENV}=$(python -c 'import secrets; print(secrets.token_hex(32))'))")
+    return key.encode("utf-8")
+
+
+class Coordinator:
+    """ジョブを配り、ハートビートを監視し、結果をストアとキューに書き込む"""
+    def __init__(self, queue, store, address=('127.0.0.1', DEFAULT_PORT), authkey=None,
+                 lease_timeout=30.0, max_attempts=3):
+        self.queue = queue
+        self.store = store
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.listener = Listener(address, authkey=authkey or load_authkey())
+        self.address = self.listener.address
+
+        self._lock = threading.Lock()
+        self._all_done = threading.Event()
+        self._pending = deque()
+        self._leases = {} # job_id -> { 'job', 'worker_id', 'heartbeat' }
+        self._stopping = False
+
+        for job in queue.jobs():
+            if job['status'] in (PENDING, RUNNING):
+                self._pending.append(job)
+        if not self._pending:
+            self._all_done.set()
+
+    # ---- 公開API ----
+    def serve(self, poll=1.0):
+        """すべてのジョブが終わるまでブロックする"""
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        threading.Thread(target=self._reaper_loop, args=(poll,), daemon=True).start()
+        print(f"[Coordinator] Listening on {self.address} ({len(self._pending)} jobs)")
+        t_start = time.time()
+        self._all_done.wait()
+        # 待機中のワーカーが stop を受け取れるよう少し待ってから閉じる
+        self._stopping = True
+        time.sleep(poll)
+        self.listener.close()
+        print(f"[Coordinator] Finished in {time.time() - t_start:.1f}s ({self.queue.summary()})")
+        return self.queue
+
+    # ---- 内部処理 ----
+    def _accept_loop(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except (OSError, EOFError):
+                return # listener が閉じられた
+            except Exception as e:
+                print(f"[Coordinator] Rejected connection: {e}")
+                continue
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        worker_id = None
+        try:
+            while True:
+                msg = conn.recv()
+                kind, worker_id = msg[0], msg[1]
+                if kind == 'get':
+                    conn.send(self._next_job(worker_id))
+                elif kind == 'heartbeat':
+                    conn.send(self._heartbeat(worker_id, msg[2]))
+                elif kind == 'result':
+                    self._finish(worker_id, msg[2], msg[3])
+                    conn.send(('ok',))
+                else:
+                    conn.send(('error', f"unknown message {kind!r}"))
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def _next_job(self, worker_id):
+        with self._lock:
+            if self._all_done.is_set() or self._stopping:
+                return ('stop',)
+            if not self._pending:
+                return ('wait', 1.0) # 他のワーカーのジョブが落ちれば再配布されるので待たせる
+            job = self._pending.popleft()
+            job['attempts'] = job.get('attempts', 0) + 1
+            self.queue.update(job, status=RUNNING, worker=worker_id, started_at=time.time())
+            self._leases[job['job_id']] = {'job': job, 'worker_id': worker_id, 'heartbeat': time.time()}
+        print(f"[Coordinator] {job['job_id']} -> {worker_id}")
+        return ('job', job)
+
+    def _heartbeat(self, worker_id, job_id):
+        with self._lock:
+            lease = self._leases.get(job_id)
+            if lease is None or lease['worker_id'] != worker_id:
+                return ('cancel',) # 期限切れで他のワーカーに移った
+            lease['heartbeat'] = time.time()
+        return ('ok',)
+
+    def _finish(self, worker_id, job_id, result):
+        with self._lock:
+            lease = self._leases.get(job_id)
+            if lease is None or lease['worker_id'] != worker_id:
+                print(f"[Coordinator] Ignoring stale result for {job_id} from {worker_id}")
+                return
+            del self._leases[job_id]
+            job = lease['job']
+
+        if result['status'] == DONE:
+            train_info = {
+                'total_reward': result['total_reward'],
+                'length': result['length'],
+                'episode_time': result['episode_time'],
+                'hparams': result['hparams'],
+            }
+            record = save_job_result(self.store, job, result['metric'], train_info, result['wall_time'])
+            record['worker'] = worker_id
+            print(f"[Coordinator] {job_id} done by {worker_id} -> {record['final_score']:.4f}")
+        else:
+            record = {'status': FAILED, 'error': result['error'], 'worker': worker_id}
+            print(f"[Coordinator] {job_id} FAILED on {worker_id}: {result['error'].strip().splitlines()[-1]}")
+
+        with self._lock:
+            self.queue.update(job, finished_at=time.time(), **record)
+            self._check_done()
+
+    def _reaper_loop(self, poll):
+        while not self._all_done.is_set():
+            time.sleep(poll)
+            now = time.time()
+            with self._lock:
+                for job_id, lease in list(self._leases.items()):
+                    if now - lease['heartbeat'] <= self.lease_timeout:
+                        continue
+                    del self._leases[job_id]
+                    job = lease['job']
+                    if job['attempts'] >= self.max_attempts:
+                        self.queue.update(job, status=FAILED, error=f"lost {job['attempts']} times (last worker {lease['worker_id']})")
+                        print(f"[Coordinator] {job_id} lost too many times. Marked failed.")
+                    else:
+                        self.queue.update(job, status=PENDING)
+                        self._pending.append(job)
+                        print(f"[Coordinator] {job_id} lost by {lease['worker_id']}. Re-queued.")
+                self._check_done()
+
+    def _check_done(self):
+        if not self._pending and not self._leases:
+            self._all_done.set()
+
+
+class _Heartbeat(threading.Thread):
+    """学習中にコーディネータへハートビートを送る（学習用とは別の接続を使う）"""
+    def __init__(self, address, authkey, worker_id, job_id, interval):
+        super().__init__(daemon=True)
+        self.address = address
+        self.authkey = authkey
+        self.worker_id = worker_id
+        self.job_id = job_id
+        self.interval = interval
+        self.cancelled = False
+        self._stop_event = threading.Event()
+
+    def run(self):
+        try:
+            conn = Client(self.address, authkey=self.authkey)
+        except OSError:
+            return
+        with conn:
+            while not self._stop_event.wait(self.interval):
+                try:
+                    conn.send(('heartbeat', self.worker_id, self.job_id))
+                    if conn.recv()[0] == 'cancel':
+                        self.cancelled = True
+                        return
+                except (EOFError, OSError):
+                    return
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def run_worker(address, authkey=None, worker_id=None, heartbeat_interval=5.0, connect_retries=30):
+    """
+    コーディネータからジョブを取り出して学習し、結果を返すループ。
+    コーディネータが 'stop' を返すか、接続できなくなったら終了する。authkey を省略すると SWEEP_AUTHKEY を使う。
+    """
+    authkey = authkey or load_authkey()
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    conn = None
+    for _ in range(connect_retries):
+        try:
+            conn = Client(address, authkey=authkey)
+            break
+        except ConnectionRefusedError:
+            time.sleep(1.0)
+    if conn is None:
+        print(f"[Worker {worker_id}] Could not connect to {address}")
+        return 0
+
+    n_jobs = 0
+    with conn:
+        while True:
+            try:
+                conn.send(('get', worker_id))
+                reply = conn.recv()
+            except (EOFError, OSError):
+                break
+            if reply[0] == 'stop':
+                break
+            if reply[0] == 'wait':
+                time.sleep(reply[1])
+                continue
+
+            job = reply[1]
+            heartbeat = _Heartbeat(address, authkey, worker_id, job['job_id'], heartbeat_interval)
+            heartbeat.start()
+            try:
+                history, train_info, wall_time = train_job(job)
+                result = {
+                    'status': DONE,
+                    'metric': np.asarray(history, dtype=np.float32),
+                    'total_reward': train_info['total_reward'].astype(np.float32),
+                    'length': train_info['length'],
+                    'episode_time': train_info['episode_time'].astype(np.float32),
+                    'hparams': train_info['hparams'],
+                    'wall_time': wall_time,
+                }
+            except Exception:
+                result = {'status': FAILED, 'error': traceback.format_exc()}
+            finally:
+                heartbeat.stop()
+
+            if heartbeat.cancelled:
+                continue # 期限切れで他のワーカーに再配布済み
+            try:
+                conn.send(('result', worker_id, job['job_id'], result))
+                conn.recv()
+            except (EOFError, OSError):
+                break
+            n_jobs += 1
+
+    print(f"[Worker {worker_id}] Stopped after {n_jobs} jobs")
+    return n_jobs
+
+
+def _load_config(path):
+    import json
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def prepare_queue(config):
+    """sweep.py と同じ設定からキューを作る（完了済みのジョブはそのまま）"""
+    queue = JobQueue(config.get('queue', "sweep_queue"))
+    for job in expand_jobs(config):
+        queue.add(job)
+    return queue
+
+
+def run_local(config, workers=2, port=0, lease_timeout=30.0):
+    """コーディネータと複数のワーカープロセスを localhost 上で動かす（動作確認用）"""
+    queue = prepare_queue(config)
+    authkey = secrets.token_bytes(32)
+    coordinator = Coordinator(queue, ResultsStore(config.get('store', "results")),
+                              address=('127.0.0.1', port), authkey=authkey, lease_timeout=lease_timeout)
+    procs = [multiprocessing.Process(target=run_worker, args=(coordinator.address, authkey),
+                                     kwargs={'worker_id': f"local-{i}"})
+             for i in range(workers)]
+    for p in procs:
+        p.start()
+    try:
+        coordinator.serve()
+    finally:
+        for p in procs:
+            p.join(timeout=10)
+            if p.is_alive():
+                p.terminate()
+    return queue
+
+
+def main():
+    parser = argparse.ArgumentParser(description="学習ジョブを複数マシンに分散する")
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    p_coord = sub.add_parser("coordinator", help="ジョブを配る")
+    p_coord.add_argument("config")
+    p_coord.add_argument("--host", default="127.0.0.1",
+                         help="待ち受けるアドレス（他のマシンから繋ぐときは 0.0.0.0 などを明示する）")
+    p_coord.add_argument("--port", type=int, default=DEFAULT_PORT)
+    p_coord.add_argument("--lease-timeout", type=float, default=30.0)
+
+    p_worker = sub.add_parser("worker", help="ジョブを取りに行って学習する")
+    p_worker.add_argument("--host", default="127.0.0.1")
+    p_worker.add_argument("--port", type=int, default=DEFAULT_PORT)
+    p_worker.add_argument("--processes", type=int, default=1, help="このマシンで動かすワーカー数")
+
+    p_local = sub.add_parser("local", help="localhost でコーディネータとワーカーを動かす")
+    p_local.add_argument("config")
+    p_local.add_argument("--workers", type=int, default=2)
+
+    args = parser.parse_args()
+    if args.mode in ("coordinator", "worker"):
+        try:
+            load_authkey()
+        except RuntimeError as e:
+            parser.error(str(e))
+
+    if args.mode == "coordinator":
+        config = _load_config(args.config)
+        coordinator = Coordinator(prepare_queue(config), ResultsStore(config.get('store', "results")),
+                                  address=(args.host, args.port), lease_timeout=args.lease_timeout)
+        queue = coordinator.serve()
+        sys.exit(1 if queue.summary()[FAILED] else 0)
+    elif args.mode == "worker":
+        address = (args.host, args.port)
+        if args.processes == 1:
+            run_worker(address)
+        else:
+            procs = [multiprocessing.Process(target=run_worker, args=(address,)) for _ in range(args.processes)]
+            for p in procs:
+                p.start()
+            for p in procs:
+                p.join()
+    else:
+        queue = run_local(_load_config(args.config), workers=args.workers)
+        sys.exit(1 if queue.summary()[FAILED] else 0)
+
+
+if __name__ == "__main__":
+    main()
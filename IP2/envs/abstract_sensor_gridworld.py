@@ -3,12 +3,19 @@
 import gymnasium as gym
 from gymnasium import spaces
 import numpy as np
-import matplotlib.pyplot as plt
+from envs.records import info_record_class
+
+# inplace モードで返す info（固定フィールド）
+GridInfo = info_record_class('GridInfo', ('position', 'step'))
 
 class AbstractSensorGridWorld(gym.Env):
+    """
+    inplace=True（または obs_buffer を渡す）と低アロケーションモードになり、
+    観測は同じバッファに書き込んで返し、info は再利用の InfoRecord を返す。
+    """
     metadata = {'render_modes': ['human', 'rgb_array']}
 
-    def __init__(self, grid_size=5, max_steps=30):
+    def __init__(self, grid_size=5, max_steps=30, inplace=False, obs_buffer=None):
         super().__init__()
         self.grid_size = grid_size
         self.max_steps = max_steps
@@ -24,6 +31,11 @@ class AbstractSensorGridWorld(gym.Env):
         self.agent_pos = None
         self.step_count = 0
 
+        self.inplace = inplace or obs_buffer is not None
+        if self.inplace:
+            self._obs = obs_buffer if obs_buffer is not None else np.zeros(4, dtype=np.float32)
+            self._info = GridInfo()
+
     def _define_layout(self):
         self.grid = np.zeros((self.grid_size, self.grid_size), dtype=int)
         self.grid[0, :] = 1
@@ -42,8 +54,9 @@ class AbstractSensorGridWorld(gym.Env):
                 if self.grid[r, c] == 0:
                     self.grid[r, c] = 2
 
-        np.random.seed(42)
-        self.danger_map = np.random.uniform(0, 0.3, (self.grid_size, self.grid_size))
+        # レイアウトは固定。グローバルRNGを汚さないようローカルの生成器を使う（値は従来の seed(42) と同じ）
+        layout_rng = np.random.RandomState(42)
+        self.danger_map = layout_rng.uniform(0, 0.3, (self.grid_size, self.grid_size))
         for trap in self.traps:
             for dr in [-1, 0, 1]:
                 for dc in [-1, 0, 1]:
@@ -54,6 +67,43 @@ class AbstractSensorGridWorld(gym.Env):
 
         # 到達可能性チェック（必要ならログ）
         self._check_reachability()
+        self._precompute_sensors()
+
+    def _precompute_sensors(self):
+        """レイアウトは固定なので、センサー値のノイズ以外の部分をセルごとに前計算しておく"""
+        size = self.grid_size
+        self._wall_dist = np.zeros((size, size))
+        self._trap_smell = np.zeros((size, size))
+        self._goal_dir = np.zeros((size, size))
+        alpha = 1.5
+        for r in range(size):
+            for c in range(size):
+                # s1: 壁距離（最短距離/正規化）
+                wall_distances = []
+                for dr, dc in [(-1,0),(1,0),(0,-1),(0,1)]:
+                    dist = 0
+                    nr, nc = r, c
+                    while 0 <= nr < size and 0 <= nc < size:
+                        if self.grid[nr, nc] == 1:
+                            break
+                        dist += 1
+                        nr += dr; nc += dc
+                    wall_distances.append(dist)
+                self._wall_dist[r, c] = min(wall_distances) / size
+
+                # s2: トラップ匂い（ノイズ前）
+                smell = 0.0
+                for trap in self.traps:
+                    dist = abs(r - trap[0]) + abs(c - trap[1])
+                    smell += np.exp(-alpha * dist)
+                self._trap_smell[r, c] = smell
+
+                # s3: ゴール方向（ノイズ前）
+                goal_vec = np.array([self.goal[0] - r, self.goal[1] - c])
+                if np.linalg.norm(goal_vec) > 0:
+                    self._goal_dir[r, c] = np.dot(goal_vec, [1, 1]) / (np.linalg.norm(goal_vec) * np.sqrt(2))
+                else:
+                    self._goal_dir[r, c] = 1.0
 
     def _check_reachability(self):
         from collections import deque
@@ -88,7 +138,7 @@ class AbstractSensorGridWorld(gym.Env):
     def reset(self, seed=None, options=None):
         super().reset(seed=seed)
         valid_positions = self._get_valid_start_positions()
-        self.agent_pos = valid_positions[np.random.randint(len(valid_positions))]
+        self.agent_pos = valid_positions[self.np_random.integers(len(valid_positions))]
         self.step_count = 0
         observation = self._get_observation()
         return observation, {}
@@ -96,38 +146,22 @@ class AbstractSensorGridWorld(gym.Env):
     def _get_observation(self) -> np.ndarray:
         r, c = self.agent_pos
         # s1: 壁距離（最短距離/正規化）
-        wall_distances = []
-        for dr, dc in [(-1,0),(1,0),(0,-1),(0,1)]:
-            dist = 0
-            nr, nc = r, c
-            while 0 <= nr < self.grid_size and 0 <= nc < self.grid_size:
-                if self.grid[nr, nc] == 1:
-                    break
-                dist += 1
-                nr += dr; nc += dc
-            wall_distances.append(dist)
-        s1 = min(wall_distances) / self.grid_size
+        s1 = self._wall_dist[r, c]
 
         # s2: トラップ匂い
-        s2 = 0.0
-        alpha = 1.5
-        for trap in self.traps:
-            dist = abs(r - trap[0]) + abs(c - trap[1])
-            s2 += np.exp(-alpha * dist)
-        s2 += np.random.normal(0, 0.05)
+        s2 = self._trap_smell[r, c] + self.np_random.normal(0, 0.05)
         s2 = max(0, s2)
 
         # s3: ゴール方向（ノイズ低減）
-        goal_vec = np.array([self.goal[0] - r, self.goal[1] - c])
-        if np.linalg.norm(goal_vec) > 0:
-            goal_direction = np.dot(goal_vec, [1, 1]) / (np.linalg.norm(goal_vec) * np.sqrt(2))
-        else:
-            goal_direction = 1.0
-        s3 = np.clip(goal_direction + np.random.normal(0, 0.1), -1, 1)
+        s3 = min(max(self._goal_dir[r, c] + self.np_random.normal(0, 0.1), -1), 1)
 
         # s4: 静的危険度
         s4 = self.danger_map[r, c]
 
+        if self.inplace:
+            obs = self._obs
+            obs[0] = s1; obs[1] = s2; obs[2] = s3; obs[3] = s4
+            return obs
         return np.array([s1, s2, s3, s4], dtype=np.float32)
 
     def step(self, action):
@@ -167,10 +201,17 @@ class AbstractSensorGridWorld(gym.Env):
 
         truncated = self.step_count >= self.max_steps
         observation = self._get_observation()
-        info = {'position': self.agent_pos, 'step': self.step_count}
+        if self.inplace:
+            info = self._info
+            info.position = self.agent_pos
+            info.step = self.step_count
+        else:
+            info = {'position': self.agent_pos, 'step': self.step_count}
         return observation, reward, terminated, truncated, info
 
     def render(self):
+        import matplotlib.pyplot as plt # 描画するときだけ読み込む
+
         grid_display = self.grid.copy().astype(float)
         grid_display[self.agent_pos] = 4
 
@@ -1,15 +1,28 @@
 import gymnasium as gym
 import numpy as np
+from envs.records import info_record_class
+
+# inplace モードで返す info（固定フィールド）
+TrackingInfo = info_record_class('TrackingInfo', ('target_x', 'real_x', 'x_error', 'theta', 'action'))
 
 class SinusoidTrackingWrapper(gym.Wrapper):
     """
     CartPoleのカート位置が正弦波(sin)を追いかけるようにするラッパー
+
+    inplace=True（または obs_buffer を渡す）と低アロケーションモードになり、
+    観測は obs.copy() せず同じバッファに書き込み、info は再利用の InfoRecord を返す
+    （内側の環境の info は使わない）。
     """
-    def __init__(self, env):
+    def __init__(self, env, inplace=False, obs_buffer=None):
         super().__init__(env)
         self.t = 0
         self.frequency = 0.1 
 
+        self.inplace = inplace or obs_buffer is not None
+        if self.inplace:
+            self._obs = obs_buffer if obs_buffer is not None else np.zeros(env.observation_space.shape, dtype=np.float32)
+            self._info = TrackingInfo()
+
     def reset(self, seed=None, options=None):
         self.t = 0
         obs, info = self.env.reset(seed=seed, options=options)
@@ -25,11 +38,19 @@ class SinusoidTrackingWrapper(gym.Wrapper):
         modified_obs = self._modify_obs(obs, target_x)
         
         # LLM報酬計算用に生データとターゲットをinfoに入れる
-        info["target_x"] = target_x
-        info["real_x"] = obs[0]
-        info["x_error"] = obs[0] - target_x
-        info["theta"] = obs[2]
-        info["action"] = action # ラッパー対策
+        if self.inplace:
+            info = self._info
+            info.target_x = target_x
+            info.real_x = obs[0]
+            info.x_error = obs[0] - target_x
+            info.theta = obs[2]
+            info.action = action
+        else:
+            info["target_x"] = target_x
+            info["real_x"] = obs[0]
+            info["x_error"] = obs[0] - target_x
+            info["theta"] = obs[2]
+            info["action"] = action # ラッパー対策
         
         base_reward = 1.0 - abs(obs[0] - target_x)
         if terminated:
@@ -38,6 +59,10 @@ class SinusoidTrackingWrapper(gym.Wrapper):
         return modified_obs, base_reward, terminated, truncated, info
 
     def _modify_obs(self, obs, target_x=0.0):
+        if self.inplace:
+            np.copyto(self._obs, obs)
+            self._obs[0] = obs[0] - target_x
+            return self._obs
         modified_obs = obs.copy()
         modified_obs[0] = obs[0] - target_x 
         return modified_obs
\ No newline at end of file
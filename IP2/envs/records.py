@@ -0,0 +1,124 @@
+# envs/records.py
+import numpy as np
+
+
+class InfoRecord:
+    """
+    固定フィールドの再利用可能な info（低アロケーションモード用）。
+    環境は step ごとに属性を書き換えて同じオブジェクトを返すので、毎ステップ dict を作らない。
+    読み出しは dict と同じく info['temp'] / info.get('temp') / dict(info) が使える。
+
+    フィールドは info_record_class で作るサブクラスの __slots__ で固定する。
+    注意: 同じオブジェクトが毎ステップ上書きされるので、後で参照するなら InfoLog に追加するか
+    to_dict() でコピーすること。
+    """
+    __slots__ = ()
+    fields = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.fields
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.fields else default
+
+    def keys(self):
+        return self.fields
+
+    def items(self):
+        return [(k, getattr(self, k, None)) for k in self.fields]
+
+    def to_dict(self):
+        return {k: getattr(self, k, None) for k in self.fields}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()})"
+
+
+def info_record_class(name, fields):
+    """フィールド名のタプルから InfoRecord のサブクラスを作る"""
+    fields = tuple(fields)
+    return type(name, (InfoRecord,), {'__slots__': fields, 'fields': fields})
+
+
+class InfoLog:
+    """
+    1エピソード分の InfoRecord をフィールドごとの事前確保した列に書き写すログ。
+    append は参照のコピーだけで dict やタプルを作らない。
+    metric_fn からは list と同じく len / 反復 / infos[-1] で読めるほか、
+    column('temp') で列をまとめて numpy 配列として取り出せる。
+    """
+    def __init__(self, fields, capacity=256):
+        self.fields = tuple(fields)
+        self._capacity = capacity
+        self._cols = {k: [None] * capacity for k in self.fields}
+        self._n = 0
+
+    def clear(self):
+        self._n = 0
+        return self
+
+    def append(self, record):
+        n = self._n
+        if n == self._capacity:
+            for col in self._cols.values():
+                col.extend([None] * self._capacity)
+            self._capacity *= 2
+        for k, col in self._cols.items():
+            col[n] = getattr(record, k)
+        self._n = n + 1
+
+    def column(self, name):
+        return np.asarray(self._cols[name][:self._n])
+
+    def __len__(self):
+        return self._n
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield _LogRow(self, i)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [_LogRow(self, i) for i in range(*index.indices(self._n))]
+        if index < 0:
+            index += self._n
+        if not 0 <= index < self._n:
+            raise IndexError("InfoLog index out of range")
+        return _LogRow(self, index)
+
+
+class _LogRow:
+    """InfoLog の1行を dict のように読むためのビュー"""
+    __slots__ = ('_log', '_i')
+
+    def __init__(self, log, i):
+        self._log = log
+        self._i = i
+
+    def __getitem__(self, key):
+        return self._log._cols[key][self._i]
+
+    def __contains__(self, key):
+        return key in self._log._cols
+
+    def get(self, key, default=None):
+        col = self._log._cols.get(key)
+        return default if col is None else col[self._i]
+
+    def keys(self):
+        return self._log.fields
+
+    def to_dict(self):
+        return {k: self[k] for k in self._log.fields}
+
+    def __repr__(self):
+        return f"InfoLogRow({self.to_dict()})"
@@ -1,14 +1,21 @@
 import gymnasium as gym
 import numpy as np
 from gymnasium import spaces
+from envs.records import info_record_class
+
+# inplace モードで返す info（固定フィールド）
+CoolingInfo = info_record_class('CoolingInfo', ('temp', 'load', 'action'))
 
 class ServerCoolingEnv(gym.Env):
     """
     データセンターのサーバー冷却環境
     State: [温度(20-100), 負荷(0-100)]
     Action: 0(停止) ~ 4(強風)
+
+    inplace=True（または obs_buffer を渡す）と低アロケーションモードになり、
+    観測は同じバッファに書き込んで返し、info は再利用の InfoRecord を返す。
     """
-    def __init__(self):
+    def __init__(self, inplace=False, obs_buffer=None):
         super(ServerCoolingEnv, self).__init__()
         
         self.observation_space = spaces.Box(
@@ -21,38 +28,59 @@ class ServerCoolingEnv(gym.Env):
         self.target_temp_low = 50.0
         self.target_temp_high = 60.0
         self.ambient_temp = 25.0
+        # ダイナミクスのパラメータ（モデルベースの参照解もこの値を使う）
+        self.heat_coef = 0.05       # 負荷による発熱
+        self.heat_noise_std = 0.5   # 発熱のノイズ
+        self.cooling_coef = 1.5     # 行動1段あたりの冷却量
+        self.decay_coef = 0.05      # 外気への自然放熱
+        self.max_load_change = 10   # 1ステップの負荷変動幅（一様整数）
+        self.fail_temp_high = 95.0
+        self.fail_temp_low = 20.0
         self.state = None
         self.steps = 0
         self.max_steps = 200
 
+        self.inplace = inplace or obs_buffer is not None
+        if self.inplace:
+            self._obs = obs_buffer if obs_buffer is not None else np.zeros(2, dtype=np.float32)
+            self._info = CoolingInfo()
+
     def reset(self, seed=None, options=None):
         super().reset(seed=seed)
-        self.state = np.array([
-            np.random.uniform(40, 70),
-            np.random.uniform(20, 80)
-        ], dtype=np.float32)
+        temp = self.np_random.uniform(40, 70)
+        load = self.np_random.uniform(20, 80)
+        if self.inplace:
+            self._obs[0] = temp
+            self._obs[1] = load
+            self.state = self._obs
+        else:
+            self.state = np.array([temp, load], dtype=np.float32)
         self.steps = 0
         return self.state, {}
 
     def step(self, action):
         temp, load = self.state
         
-        heat_gain = 0.05 * load + np.random.normal(0, 0.5)
-        cooling_power = 1.5 * action 
-        natural_decay = 0.05 * (temp - self.ambient_temp)
+        heat_gain = self.heat_coef * load + self.np_random.normal(0, self.heat_noise_std)
+        cooling_power = self.cooling_coef * action 
+        natural_decay = self.decay_coef * (temp - self.ambient_temp)
         
         next_temp = np.clip(temp + heat_gain - cooling_power - natural_decay, 20, 100)
         
-        load_change = np.random.randint(-10, 11)
+        load_change = self.np_random.integers(-self.max_load_change, self.max_load_change + 1)
         next_load = np.clip(load + load_change, 0, 100)
         
-        self.state = np.array([next_temp, next_load], dtype=np.float32)
+        if self.inplace:
+            self._obs[0] = next_temp
+            self._obs[1] = next_load
+        else:
+            self.state = np.array([next_temp, next_load], dtype=np.float32)
         self.steps += 1
         
         terminated = False
         truncated = (self.steps >= self.max_steps)
         
-        if next_temp >= 95.0 or next_temp <= 20.0:
+        if next_temp >= self.fail_temp_high or next_temp <= self.fail_temp_low:
             terminated = True
             
         # デフォルト報酬
@@ -65,6 +93,13 @@ class ServerCoolingEnv(gym.Env):
             reward = -100.0
 
         # wrappers.py が action を引数に取らないため、info に action を入れて渡す
+        if self.inplace:
+            info = self._info
+            info.temp = next_temp
+            info.load = next_load
+            info.action = action
+            return self.state, reward, terminated, truncated, info
+
         info = {
             'temp': next_temp, 
             'load': next_load, 
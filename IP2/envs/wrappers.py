@@ -1,30 +1,117 @@
 
 # envs/wrappers.py
+import traceback
 import gymnasium as gym
 
+def compile_reward_fn(llm_code_string):
+    """
+    生成コードを exec して compute_reward を取り出す。
+    失敗時（構文エラー・関数なし）は None を返す。
+    """
+    local_scope = {}
+    try:
+        exec(llm_code_string, {}, local_scope)
+    except Exception as e:
+        print(f"Code compilation failed: {e}")
+        return None
+    reward_fn = local_scope.get("compute_reward")
+    if not callable(reward_fn):
+        print("Warning: compute_reward function not found.")
+        return None
+    return reward_fn
+
+
+class RewardFunctionError(RuntimeError):
+    """
+    報酬関数のエラーが許容範囲を超えた（その候補の学習を打ち切る）。
+    first_traceback に最初のエラーのトレースバックを持つ。
+    AsyncVectorEnv は例外を exctype(value) で作り直すので、自分自身を1引数で受け取れるようにしてある。
+    """
+    def __init__(self, message, first_traceback=None, errors=0, calls=0):
+        if isinstance(message, RewardFunctionError):
+            message, first_traceback, errors, calls = message.args[0], message.first_traceback, message.errors, message.calls
+        super().__init__(message)
+        self.first_traceback = first_traceback
+        self.errors = errors
+        self.calls = calls
+
+    def __reduce__(self):
+        return (type(self), (self.args[0], self.first_traceback, self.errors, self.calls))
+
+
 class LLMRewardWrapper(gym.Wrapper):
-    """LLMが生成した報酬関数でデフォルト報酬を上書き"""
-    def __init__(self, env, llm_code_string):
+    """
+    LLMが生成した報酬関数でデフォルト報酬を上書き。
+    報酬関数が例外を出したステップはデフォルト報酬を使うが、エラーが max_errors 回、
+    または min_calls 回以上呼んだ時点でエラー率が max_error_rate を超えたら RewardFunctionError を投げる
+    （どちらも None で無効）。エラーの表示は最初の1回だけ。
+    """
+    def __init__(self, env, llm_code_string, max_errors=50, max_error_rate=0.01, min_calls=100):
         super().__init__(env)
-        local_scope = {}
-        try:
-            exec(llm_code_string, {}, local_scope)
-            self.reward_fn = local_scope.get("compute_reward")
-            if not callable(self.reward_fn):
-                print("Warning: compute_reward function not found.")
-                self.reward_fn = None
-        except Exception as e:
-            print(f"Code compilation failed: {e}")
-            self.reward_fn = None
+        self.reward_fn = compile_reward_fn(llm_code_string)
+        self.max_errors = max_errors
+        self.max_error_rate = max_error_rate
+        self.min_calls = min_calls
+        self.calls = 0
+        self.errors = 0
+        self.first_traceback = None
 
     def step(self, action):
         obs, original_reward, terminated, truncated, info = self.env.step(action)
         if self.reward_fn:
+            self.calls += 1
             try:
                 new_reward = self.reward_fn(obs, terminated, truncated, info)
             except Exception as e:
-                print(f"Reward function error: {e}")
+                self._on_error(e)
                 new_reward = original_reward
         else:
             new_reward = original_reward
         return obs, new_reward, terminated, truncated, info
+
+    def _on_error(self, e):
+        self.errors += 1
+        if self.first_traceback is None:
+            self.first_traceback = traceback.format_exc()
+            print(f"Reward function error: {e!r} (further errors are counted, not printed)")
+
+        too_many = self.max_errors is not None and self.errors >= self.max_errors
+        too_often = (self.max_error_rate is not None and self.calls >= self.min_calls
+                     and self.errors / self.calls > self.max_error_rate)
+        if too_many or too_often:
+            first = self.first_traceback.strip().splitlines()[-1]
+            raise RewardFunctionError(
+                f"compute_reward failed {self.errors} times in {self.calls} calls (first error: {first})",
+                first_traceback=self.first_traceback, errors=self.errors, calls=self.calls,
+            ) from e
+
+
+class ActionRepeatWrapper(gym.Wrapper):
+    """
+    同じ行動を repeat ステップ続けて、1回の step として返す（マクロステップ）。
+    途中で終了したらそこで打ち切る。報酬は内側のステップの合計。
+
+    info は最後のステップの info に、内側の全ステップの info ('repeat_infos') と
+    実際に進めたステップ数 ('repeat_steps') を加えたもの。
+    学習ループは repeat_infos をエピソードのログに展開するので、metric_fn は全ステップの値で計算される。
+    """
+    def __init__(self, env, repeat):
+        super().__init__(env)
+        if repeat < 1:
+            raise ValueError(f"repeat must be >= 1 (got {repeat})")
+        self.repeat = repeat
+
+    def step(self, action):
+        total_reward = 0.0
+        infos = []
+        for _ in range(self.repeat):
+            obs, reward, terminated, truncated, info = self.env.step(action)
+            total_reward += reward
+            # 再利用される InfoRecord もあるので、ステップごとに dict にコピーしておく
+            infos.append(info.to_dict() if hasattr(info, 'to_dict') else dict(info))
+            if terminated or truncated:
+                break
+        info = dict(infos[-1])
+        info['repeat_infos'] = infos
+        info['repeat_steps'] = len(infos)
+        return obs, total_reward, terminated, truncated, info
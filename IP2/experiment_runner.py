@@ -3,14 +3,124 @@ import os
 import json
 import time
 import numpy as np
-import matplotlib.pyplot as plt
-from envs.wrappers import LLMRewardWrapper
+from envs.wrappers import LLMRewardWrapper, ActionRepeatWrapper, RewardFunctionError, compile_reward_fn
 from training.q_learning import train_q_learning
-from LLMapi_openrouter import call_llm
+from training.hogwild import train_q_learning_hogwild
+from training.evaluation import run_policy_episodes, evaluate_q_table
+from results_store import ResultsStore, code_hash, smooth, default_window, plot_runs
+from reward_screening import load_or_record_trajectories, screen_reward
+from offline_ranking import TransitionDataset, rank_rewards_offline
+from reward_dedup import reward_fingerprint, find_duplicates
+from adaptive_discretizer import AdaptiveDiscretizer, fit_discretizer, rollout_observations, occupancy_report, print_occupancy
 import re
+import ast
+import functools
+import traceback
+
+
+def extract_code(text):
+    """LLMの出力から ```python ... ``` の中身を取り出す（なければ全体）"""
+    m = re.search(r"```(?:python)?\s*([\s\S]*?)```", text, flags=re.IGNORECASE)
+    return m.group(1).strip() if m else text.strip()
+
+
+# 1回のリクエストで K 個の報酬関数を書かせるときにタスクのプロンプトの後ろに付ける指示
+BATCH_INSTRUCTION = """
+Instead of a single function, write {k} DISTINCT variants of compute_reward that use different shaping ideas
+(different terms, weights or terminal handling), not just renamed copies.
+Label each one with a line "Variant <number>:" (1 to {k}) followed by its own ```python ... ``` block.
+Each block must contain one complete, self-contained compute_reward with the exact signature above.
+"""
+
+
+def batch_prompt(prompt, k):
+    """タスクのプロンプトを K 個のバリアントを書かせるプロンプトにする"""
+    return prompt.rstrip() + "\n" + BATCH_INSTRUCTION.format(k=k)
+
+
+def extract_code_blocks(text):
+    """LLMの出力から ```python ... ``` のブロックをすべて順に取り出す"""
+    return [m.strip() for m in re.findall(r"```(?:python)?\s*([\s\S]*?)```", text, flags=re.IGNORECASE)]
+
+
+def validate_reward_code(code):
+    """
+    実行せずに構文と compute_reward(obs, terminated, truncated, info) の定義を確かめる。
+    問題なければ None、あれば理由の文字列を返す。
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        return f"syntax error: {e.msg} (line {e.lineno})"
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name == "compute_reward":
+            if len(node.args.args) != 4:
+                return f"compute_reward takes {len(node.args.args)} arguments (expected 4)"
+            return None
+    return "'def compute_reward' not found"
+
+
+def make_candidate_env(env_factory, code, num_envs=1, asynchronous=True, action_repeat=1, max_reward_errors=50,
+                       max_reward_error_rate=0.01):
+    """
+    報酬コードを適用した環境を作る（code が None/空ならデフォルト報酬の環境）。
+    コードがコンパイルできなければ None を返す。
+
+    num_envs > 1 なら、同じ環境を num_envs 個並べた gymnasium のベクトル環境を返す
+    (asynchronous=True: サブプロセスの AsyncVectorEnv, False: 同一プロセスの SyncVectorEnv)。
+    action_repeat > 1 なら報酬を差し替えた環境の外側を ActionRepeatWrapper で包む
+    （ベクトル環境ではサブ環境ごとに包むので、繰り返しの内側のステップは各サブ環境の中で回る）。
+    max_reward_errors / max_reward_error_rate は LLMRewardWrapper の max_errors / max_error_rate
+    （報酬関数のエラーで学習を打ち切る予算。None で無効。ベクトル環境ではサブ環境ごとに数える）。
+    """
+    if num_envs > 1:
+        if code and compile_reward_fn(code) is None:
+            return None
+        import gymnasium as gym
+        env_fns = [lambda: make_candidate_env(env_factory, code, action_repeat=action_repeat,
+                                              max_reward_errors=max_reward_errors,
+                                              max_reward_error_rate=max_reward_error_rate)
+                   for _ in range(num_envs)]
+        if asynchronous:
+            return gym.vector.AsyncVectorEnv(env_fns)
+        return gym.vector.SyncVectorEnv(env_fns)
+
+    env = env_factory()
+    if code:
+        env = LLMRewardWrapper(env, code, max_errors=max_reward_errors, max_error_rate=max_reward_error_rate)
+        if env.reward_fn is None:
+            env.close()
+            return None
+    if action_repeat > 1:
+        env = ActionRepeatWrapper(env, action_repeat)
+    return env
+
+
+def save_training_run(store, experiment, name, code, history, train_info, episodes, seed, wall_time, **meta):
+    """train_q_learning(return_info=True) の結果を ResultsStore に保存して run_id を返す"""
+    columns = {
+        'metric': np.asarray(history, dtype=np.float64),
+        'total_reward': train_info['total_reward'],
+        'length': train_info['length'],
+        'episode_time': train_info['episode_time'],
+    }
+    if 'q_table' in train_info:
+        columns['q_table'] = train_info['q_table']
+    record = {
+        'status': 'ok',
+        'seed': seed,
+        'episodes': episodes,
+        'reward_code_hash': code_hash(code),
+        'hparams': train_info['hparams'],
+        'wall_time': wall_time,
+    }
+    record.update(meta)
+    return store.save_run(experiment, name, columns, record)
+
 
 class ExperimentRunner:
-    def __init__(self, env_factory, discretizer, metric_fn, experiment_name="Experiment", cache_file="reward_cache.json"):
+    def __init__(self, env_factory, discretizer, metric_fn, experiment_name="Experiment", cache_file="reward_cache.json",
+                 store=None, seed=None):
         """
         Args:
             env_factory: () -> gym.Env を返す関数
@@ -18,20 +128,38 @@ class ExperimentRunner:
             metric_fn: infoリストを受け取り評価値を返す関数
             experiment_name: グラフ描画用のタイトル
             cache_file: 生成されたコードを保存するパス
+            store: 学習結果の保存先 (ResultsStore またはディレクトリのパス)。Noneなら保存しない
+            seed: 学習に使う乱数シード
         """
         self.env_factory = env_factory
         self.discretizer = discretizer
         self.metric_fn = metric_fn
         self.name = experiment_name
         self.cache_file = cache_file
+        self.store = ResultsStore(store) if isinstance(store, str) else store
+        self.seed = seed
         
         # { "ModelName": "def compute_reward... code" }
         self.reward_codes = {}
         self.results = {}
+        self.run_ids = {} # { "ModelName": ResultsStore の run_id }
+        self.q_tables = {} # { "ModelName": 学習後のQテーブル }
+        self.action_repeats = {} # { "ModelName": 学習時の action_repeat }
+        self.evaluations = {} # { "ModelName": evaluate_q_table の結果 }
+        self.screening = {} # { "ModelName": screen_reward のレポート }
+        self.rejected = set() # 事前スクリーニングで不合格になった報酬名
+        self.failures = {} # { "ModelName": { 'error', 'traceback' } } 学習中に打ち切った候補
+        self.offline_ranking = [] # rank_rewards_offline の結果（良い順）
+        self.duplicates = {} # { "重複した報酬名": "残した報酬名" }（AST正規化して同じコード）
         
         # キャッシュがあれば読み込む
         self.load_cache()
 
+    @property
+    def duplicates_file(self):
+        """生成時に重複として捨てた候補の記録（キャッシュの隣。キャッシュ本体は { 名前: コード } のまま）"""
+        return os.path.splitext(self.cache_file)[0] + "_duplicates.json"
+
     def load_cache(self):
         if os.path.exists(self.cache_file):
             try:
@@ -40,11 +168,20 @@ class ExperimentRunner:
                 print(f"[Init] Loaded {len(self.reward_codes)} reward codes from {self.cache_file}")
             except Exception as e:
                 print(f"[Init] Failed to load cache: {e}")
+        if os.path.exists(self.duplicates_file):
+            try:
+                with open(self.duplicates_file, 'r', encoding='utf-8') as f:
+                    self.duplicates.update(json.load(f))
+            except Exception as e:
+                print(f"[Init] Failed to load duplicates: {e}")
 
     def save_cache(self):
         try:
             with open(self.cache_file, 'w', encoding='utf-8') as f:
                 json.dump(self.reward_codes, f, indent=2, ensure_ascii=False)
+            if self.duplicates:
+                with open(self.duplicates_file, 'w', encoding='utf-8') as f:
+                    json.dump(self.duplicates, f, indent=2, ensure_ascii=False)
             print(f"[Save] Cache saved to {self.cache_file}")
         except Exception as e:
             print(f"[Save] Failed to save cache: {e}")
@@ -53,97 +190,508 @@ class ExperimentRunner:
         """手動で報酬関数を追加"""
         self.reward_codes[name] = code
 
-    def generate_llm_rewards(self, prompt, models, force_regenerate=False):
+    def generate_llm_rewards(self, prompt, models, force_regenerate=False, n_samples=1, temperature=0.5,
+                             variants_per_call=1):
         """
         指定されたモデルリストを使ってLLMにコードを書かせる。
         既にキャッシュにある場合はスキップする（force_regenerate=Trueで強制上書き）。
+
+        n_samples > 1 ならモデルごとに n_samples 個のサンプルを取り、LLM_<model>#1, #2, ... として保存する。
+        variants_per_call=K > 1 なら1回のリクエストで K 個のラベル付きバリアントを別々のコードブロックで書かせ、
+        それぞれを LLM_<model>_v1, _v2, ...（n_samples > 1 なら LLM_<model>#1_v1, ...）として保存する
+        （HTTP の往復が 1/K になる）。
+        AST正規化で既存の候補と同じになったコードは追加せず self.duplicates に記録し、
+        キャッシュの隣の *_duplicates.json に保存する（全サンプルが重複だったモデルも次回は生成済みとして飛ばす）。
         """
+        # LLMクライアント(requests)は生成時にだけ読み込む（学習だけのワーカーの起動を軽くする）
+        from LLMapi_openrouter import call_llm_samples
+        import llm_calllog
+        t_invoked = time.time()
+
+        batched = variants_per_call > 1
+        request_prompt = batch_prompt(prompt, variants_per_call) if batched else prompt
+
+        fingerprints = {}
+        for name, code in self.reward_codes.items():
+            fp = reward_fingerprint(code)
+            if fp is not None:
+                fingerprints.setdefault(fp, name)
+
         for model in models:
             # 短い名前を作成 (例: openai/gpt-4o-mini -> gpt-4o-mini)
             short_name = model.split('/')[-1]
-            key = f"LLM_{short_name}"
+            if n_samples > 1:
+                prefixes = [f"LLM_{short_name}#{k+1}" for k in range(n_samples)]
+            else:
+                prefixes = [f"LLM_{short_name}"]
+            if batched:
+                keys = [f"{p}_v{v+1}" for p in prefixes for v in range(variants_per_call)]
+            else:
+                keys = prefixes
 
-            if key in self.reward_codes and not force_regenerate:
-                print(f"[Skip] {key} already exists in cache.")
+            # 重複で捨てたサンプルは duplicates にだけ残るので、どちらかに1つでもあれば生成済みとみなす
+            if any(k in self.reward_codes or k in self.duplicates for k in keys) and not force_regenerate:
+                print(f"[Skip] LLM_{short_name} already exists in cache.")
                 continue
 
-            print(f"[Gen] Requesting to {model} ...")
+            print(f"[Gen] Requesting {n_samples} sample(s)" + (f" x {variants_per_call} variants" if batched else "")
+                  + f" to {model} ...")
             try:
-                # API呼び出し
-                raw_text = call_llm(prompt, model=model, temperature=0.5)
-                code = self._strip_code(raw_text)
-                
-                # 簡易バリデーション
-                if "def compute_reward" in code:
-                    self.reward_codes[key] = code
-                    print(f"  -> Success. Code length: {len(code)}")
-                else:
-                    print(f"  -> Failed. 'def compute_reward' not found.")
+                # API呼び出し（n に対応していなければ並列呼び出しで補う）
+                raw_texts = call_llm_samples(request_prompt, n=n_samples, model=model, temperature=temperature,
+                                             max_tokens=800 * variants_per_call)
             except Exception as e:
                 print(f"  -> API Error: {e}")
+                raw_texts = []
+
+            if force_regenerate and raw_texts:
+                # 前回の生成分を消してから入れ直す（今回返らなかった _v<k> が古いまま残らないように）
+                for key in keys:
+                    self.reward_codes.pop(key, None)
+                    self.duplicates.pop(key, None)
+                for fp in [fp for fp, name in fingerprints.items() if name in keys]:
+                    del fingerprints[fp]
+
+            for prefix, raw_text in zip(prefixes, raw_texts):
+                if not batched:
+                    code = self._strip_code(raw_text)
+                    # 簡易バリデーション
+                    if "def compute_reward" not in code:
+                        print(f"  -> {prefix}: Failed. 'def compute_reward' not found.")
+                        continue
+                    self._add_generated(prefix, code, fingerprints)
+                    continue
+
+                variants = self._strip_code(raw_text, variants=variants_per_call)
+                if len(variants) < variants_per_call:
+                    print(f"  -> {prefix}: Got {len(variants)} of {variants_per_call} variants.")
+                for v, code, error in variants:
+                    key = f"{prefix}_v{v}"
+                    if error:
+                        print(f"  -> {key}: Failed. {error}.")
+                        continue
+                    self._add_generated(key, code, fingerprints)
             
             # APIレート制限への配慮
             time.sleep(1)
+
+        if self.duplicates:
+            print(f"[Gen] {len(self.duplicates)} duplicate candidates skipped")
+        # この呼び出しで行ったLLM呼び出しの速度・トークン・リトライの集計
+        llm_calllog.print_summary(llm_calllog.read_calls(since=t_invoked, pid=os.getpid()),
+                                  title="generate_llm_rewards")
         
         # 生成が終わったら保存
         self.save_cache()
 
-    def _strip_code(self, text):
-        m = re.search(r"```(?:python)?\s*([\s\S]*?)```", text, flags=re.IGNORECASE)
-        return m.group(1).strip() if m else text.strip()
+    def _add_generated(self, key, code, fingerprints):
+        """生成したコードを候補に加える（既存の候補と AST正規化で同じなら self.duplicates に記録するだけ）"""
+        fp = reward_fingerprint(code)
+        kept = fingerprints.get(fp)
+        if kept is not None and kept != key:
+            self.duplicates[key] = kept
+            self.reward_codes.pop(key, None)
+            print(f"  -> {key}: Duplicate of {kept}. Not added.")
+            return
+        fingerprints[fp] = key
+        self.duplicates.pop(key, None)
+        self.reward_codes[key] = code
+        print(f"  -> {key}: Success. Code length: {len(code)}")
+
+    def find_duplicate_rewards(self):
+        """
+        キャッシュ内の報酬候補のうち、AST正規化して同じコードのものを self.duplicates に記録する。
+        重複は学習しても同じ結果になるだけなので run_experiments で飛ばす。
+        """
+        self.duplicates.update(find_duplicates(self.reward_codes))
+        for name, kept in self.duplicates.items():
+            if name in self.reward_codes:
+                print(f"[Dedup] {name} is a duplicate of {kept}")
+        return self.duplicates
+
+    def _strip_code(self, text, variants=None):
+        """
+        variants=None なら最初のコードブロックを返す。
+        variants=K ならバッチ生成の出力を最大 K 個のブロックに分けて検証し、
+        [(バリアント番号, code または None, エラー理由 または None), ...] を返す（番号は出力中の順に 1 から）。
+        """
+        if variants is None:
+            return extract_code(text)
+        blocks = extract_code_blocks(text)
+        if len(blocks) > variants:
+            print(f"  [Warning] Got {len(blocks)} code blocks for {variants} variants. Using the first {variants}.")
+        results = []
+        for i, code in enumerate(blocks[:variants], 1):
+            error = validate_reward_code(code)
+            results.append((i, None if error else code, error))
+        return results
+
+    def fit_discretizer(self, n_bins=6, state_budget=None, method='quantile', episodes=30, seed=0,
+                        trajectory_file=None, apply=True):
+        """
+        記録済みの軌跡から次元ごとの区切りを決めた AdaptiveDiscretizer を作り、
+        今の離散化器と状態の使われ方（訪問率・実効状態数）を並べて表示する。
+        軌跡は screen_rewards と同じファイルを使う。
+
+        Args:
+            n_bins, state_budget, method: adaptive_discretizer.fit_discretizer に渡す
+            apply: True なら以降の学習・評価でこの離散化器を使う（run_experiments より前に呼ぶこと）
+        Returns:
+            AdaptiveDiscretizer
+        """
+        if trajectory_file is None:
+            trajectory_file = os.path.splitext(self.cache_file)[0] + "_trajectories.pkl"
+        trajectories = load_or_record_trajectories(trajectory_file, self.env_factory, episodes=episodes, seed=seed)
+        obs = rollout_observations(trajectories)
+
+        discretizer = fit_discretizer(obs, n_bins=n_bins, state_budget=state_budget, method=method)
+        print_occupancy(occupancy_report(self.discretizer, obs), title=f"current, shape={tuple(self.discretizer.shape)}")
+        print_occupancy(occupancy_report(discretizer, obs), title=f"{method}, shape={discretizer.shape}")
+        if apply:
+            self.discretizer = discretizer
+        return discretizer
+
+    def screen_rewards(self, episodes=30, seed=0, trajectory_file=None, **criteria):
+        """
+        記録済みの固定軌跡の上で各報酬候補を評価し、不良候補を学習前に除外する。
+        軌跡は trajectory_file（省略時は cache_file の隣）に保存され、次回以降は再利用される。
+
+        Args:
+            episodes: 軌跡を記録するエピソード数（ランダム方策）
+            seed: 軌跡記録用のシード
+            criteria: screen_reward に渡す判定条件 (metric_sign, terminal_sign, min_corr など)
+        """
+        if trajectory_file is None:
+            trajectory_file = os.path.splitext(self.cache_file)[0] + "_trajectories.pkl"
+        trajectories = load_or_record_trajectories(trajectory_file, self.env_factory, episodes=episodes, seed=seed)
+        print(f"\n[Screen] {len(trajectories)} transitions / {trajectories.num_episodes} episodes")
 
-    def run_experiments(self, episodes=1000):
-        print(f"\n{'='*20} Starting Experiments: {self.name} {'='*20}")
-        
         for name, code in self.reward_codes.items():
+            if not code:
+                continue # デフォルト報酬は対象外
+            report = screen_reward(code, trajectories, metric_fn=self.metric_fn, **criteria)
+            self.screening[name] = report
+            if report['passed']:
+                self.rejected.discard(name)
+                print(f"  [Pass] {name}")
+            else:
+                self.rejected.add(name)
+                print(f"  [Reject] {name}: {'; '.join(report['reasons'])}")
+        return self.screening
+
+    def rank_rewards_offline(self, episodes=200, seed=0, dataset_file=None, metric_sign=-1, eval_episodes=20, gamma=0.95):
+        """
+        共有の遷移データ（環境ごとに1回だけ収集）でバッチQ反復を行い、報酬候補を大まかに順位付けする。
+        上位の候補だけを run_experiments(names=...) でオンライン学習して確認する想定。
+
+        Returns:
+            良い順の報酬名リスト
+        """
+        if dataset_file is None:
+            dataset_file = os.path.splitext(self.cache_file)[0] + "_transitions.pkl"
+        trajectories = load_or_record_trajectories(dataset_file, self.env_factory, episodes=episodes, seed=seed)
+
+        env = self.env_factory()
+        n_actions = env.action_space.n
+        env.close()
+        dataset = TransitionDataset(trajectories, self.discretizer, n_actions)
+        print(f"\n[Offline] {len(dataset)} transitions, ranking {len(self.reward_codes)} candidates")
+
+        candidates = {k: v for k, v in self.reward_codes.items() if k not in self.rejected}
+        self.offline_ranking = rank_rewards_offline(
+            candidates, dataset, self.env_factory, self.discretizer,
+            metric_fn=self.metric_fn, metric_sign=metric_sign,
+            gamma=gamma, eval_episodes=eval_episodes, seed=seed
+        )
+        for i, r in enumerate(self.offline_ranking):
+            score = f"{r['score']:.4f}" if r['score'] is not None else f"failed ({r['error']})"
+            print(f"  {i+1:2d}. {r['name']:40s} score={score}  coverage={r['coverage']:.1%}")
+        return [r['name'] for r in self.offline_ranking if r['score'] is not None]
+
+    def run_experiments(self, episodes=1000, names=None, hparams=None, num_envs=1, asynchronous=True,
+                        hogwild_workers=1, action_repeat=1, warm_start=None, warm_start_epsilon=0.2, hparam_preset=None,
+                        start_method=None, max_reward_errors=50, max_reward_error_rate=0.01):
+        """
+        Args:
+            episodes: 候補ごとの学習エピソード数
+            names: 学習する報酬名のリスト（省略時はすべて）
+            hparams: train_q_learning のハイパーパラメータの上書き
+            num_envs: 2以上ならベクトル環境で num_envs 個のサブ環境を並列に動かして学習する
+            asynchronous: ベクトル環境をサブプロセス(AsyncVectorEnv)で動かすか
+            hogwild_workers: 2以上なら1つの候補を複数プロセスで共有Qテーブルに書き込みながら学習する
+                (training.hogwild。num_envs とは併用しない)
+            start_method: hogwild のワーカーの開始方法（'fork' / 'spawn' / 'forkserver'。省略時はOSのデフォルト）
+            max_reward_errors: 報酬関数の例外がこの回数に達したら候補の学習を打ち切る（None で無効）
+            max_reward_error_rate: 100回以上呼んだ時点でエラー率がこれを超えたら打ち切る（None で無効）
+            action_repeat: 2以上なら同じ行動を action_repeat ステップ続けるマクロステップで学習する
+                （metric は全ステップの info で計算する。evaluate_greedy も同じ設定で評価する）
+            warm_start: 報酬名（例: "Default"）。他の候補をその学習済みQテーブルから始める。
+                このセッションで学習するならそれを先に学習し、なければストアの最新 run から読み込む
+            warm_start_epsilon: ウォームスタートした候補の開始 epsilon（hparams の epsilon を置き換える）
+            hparam_preset: タスク名。hparam_search で保存した候補ごと（なければタスク全体）のプリセットを使う
+                （hparams で指定した項目はそちらが優先）
+        """
+        print(f"\n{'='*20} Starting Experiments: {self.name} {'='*20}")
+        self.find_duplicate_rewards()
+        stored = self.store.latest_runs(self.name) if warm_start and self.store is not None else {}
+        if hparam_preset:
+            from hparam_search import load_preset # hparam_search は experiment_runner を import するので遅延させる
+
+        items = list(self.reward_codes.items())
+        if warm_start in self.reward_codes:
+            # ウォームスタート元を先に学習する
+            items.sort(key=lambda item: item[0] != warm_start)
+
+        for name, code in items:
+            if names is not None and name not in names:
+                continue
+            if name in self.duplicates:
+                print(f"--> Skipping: {name} (duplicate of {self.duplicates[name]})")
+                continue
+            if name in self.rejected:
+                print(f"--> Skipping: {name} (rejected by screening)")
+                continue
             print(f"--> Testing: {name}")
+
+            q_init, run_meta, run_hparams = None, {}, hparams
+            preset = load_preset(hparam_preset, name) if hparam_preset else None
+            if preset:
+                run_hparams = dict(preset, **(hparams or {}))
+                run_meta['hparam_preset'] = hparam_preset
+                print(f"    [Preset] {hparam_preset}: {run_hparams}")
+            if warm_start and name != warm_start:
+                q_init, source = self._warm_start_table(warm_start, warm_start_epsilon, action_repeat, stored)
+                if q_init is not None:
+                    run_meta['warm_start'] = source
+                    run_hparams = dict(run_hparams or {}, epsilon=warm_start_epsilon)
             
-            # 環境作成
-            base_env = self.env_factory()
-            
-            # ラッパー適用（コードがNoneならデフォルト環境のまま）
-            if code:
-                env = LLMRewardWrapper(base_env, code)
-                # LLMコードが壊れていてコンパイルできなかった場合のチェック
-                if env.reward_fn is None:
+            if hogwild_workers > 1:
+                # ワーカーごとに環境を作るので、ここではコンパイルできるかだけ確認する
+                if code and compile_reward_fn(code) is None:
                     print(f"  [Warning] Reward function compilation failed for {name}. Skipping.")
-                    env.close()
                     continue
-            else:
-                env = base_env
+                t_start = time.time()
+                try:
+                    history, train_info = train_q_learning_hogwild(
+                        functools.partial(make_candidate_env, self.env_factory, code, action_repeat=action_repeat,
+                                          max_reward_errors=max_reward_errors,
+                                          max_reward_error_rate=max_reward_error_rate),
+                        self.discretizer,
+                        episodes=episodes,
+                        workers=hogwild_workers,
+                        metric_fn=self.metric_fn,
+                        verbose=False,
+                        seed=self.seed,
+                        return_info=True,
+                        hparams=run_hparams,
+                        action_repeat=action_repeat,
+                        q_init=q_init,
+                        start_method=start_method
+                    )
+                except Exception as e:
+                    self._record_failure(name, code, e, episodes, time.time() - t_start, hogwild_workers=hogwild_workers,
+                                         max_reward_errors=max_reward_errors,
+                                         max_reward_error_rate=max_reward_error_rate, **run_meta)
+                    continue
+                wall_time = time.time() - t_start
+                self.q_tables[name] = train_info['q_table']
+                self.action_repeats[name] = action_repeat
+                self._record_result(name, code, history, train_info, episodes, wall_time,
+                                    hogwild_workers=hogwild_workers, action_repeat=action_repeat, **run_meta)
+                continue
+
+            # 環境作成（コードがNoneならデフォルト環境のまま）
+            env = make_candidate_env(self.env_factory, code, num_envs=num_envs, asynchronous=asynchronous,
+                                     action_repeat=action_repeat, max_reward_errors=max_reward_errors,
+                                     max_reward_error_rate=max_reward_error_rate)
+            if env is None:
+                # LLMコードが壊れていてコンパイルできなかった場合
+                print(f"  [Warning] Reward function compilation failed for {name}. Skipping.")
+                continue
 
             # 学習実行 (汎用Q学習関数を使用)
+            t_start = time.time()
             try:
-                history = train_q_learning(
+                history, train_info = train_q_learning(
                     env, 
                     self.discretizer, 
                     episodes=episodes, 
                     metric_fn=self.metric_fn,
-                    verbose=False
+                    verbose=False,
+                    seed=self.seed,
+                    return_info=True,
+                    hparams=run_hparams,
+                    action_repeat=action_repeat,
+                    q_init=q_init
                 )
             except Exception as e:
-                print(f"  [Error] Training failed for {name}: {e}")
                 env.close()
+                self._record_failure(name, code, e, episodes, time.time() - t_start, num_envs=num_envs,
+                                     max_reward_errors=max_reward_errors, max_reward_error_rate=max_reward_error_rate,
+                                     **run_meta)
                 continue
+            wall_time = time.time() - t_start
             
             env.close()
+            self.q_tables[name] = train_info['q_table']
+            self.action_repeats[name] = action_repeat
             
-            # 結果の平滑化
-            window = max(5, int(episodes * 0.05)) # エピソード数の5%で移動平均
-            if len(history) >= window:
-                smoothed = np.convolve(history, np.ones(window)/window, mode='valid')
-            else:
-                smoothed = history
-            
-            self.results[name] = smoothed
-            # 最終スコアを表示
-            print(f"    Final Score (Last {window} avg): {np.mean(history[-window:]):.4f}")
+            self._record_result(name, code, history, train_info, episodes, wall_time, num_envs=num_envs,
+                                action_repeat=action_repeat, **run_meta)
+
+    def _record_result(self, name, code, history, train_info, episodes, wall_time, **meta):
+        """学習結果を平滑化して self.results に入れ、ストアがあれば保存する"""
+        # 結果の平滑化
+        window = default_window(episodes) # エピソード数の5%で移動平均
+        self.results[name] = smooth(history, window)
+        self.failures.pop(name, None) # 前に打ち切った候補を学習し直して成功した場合
+        # 最終スコアを表示
+        print(f"    Final Score (Last {window} avg): {np.mean(history[-window:]):.4f}")
+
+        if hasattr(self.discretizer, 'to_dict'):
+            meta['discretizer'] = self.discretizer.to_dict() # データから決めた区切りは評価時に復元できるよう残す
+        if self.store is not None:
+            self.run_ids[name] = save_training_run(self.store, self.name, name, code, history, train_info,
+                                                   episodes, self.seed, wall_time, **meta)
+            print(f"    [Store] Saved as {self.run_ids[name]}")
+
+    def _record_failure(self, name, code, error, episodes, wall_time, **meta):
+        """
+        学習を打ち切った候補を self.failures に入れ、ストアがあれば status='failed' の run として残す。
+        報酬関数のエラー（RewardFunctionError）なら最初のエラーのトレースバックを記録する。
+        """
+        tb = getattr(error, 'first_traceback', None) or traceback.format_exc()
+        self.failures[name] = {'error': str(error), 'traceback': tb}
+        self.results.pop(name, None)
+        self.q_tables.pop(name, None)
+        print(f"  [Error] Training failed for {name}: {str(error).strip().splitlines()[-1]}")
+
+        if self.store is not None:
+            record = {'status': 'failed', 'seed': self.seed, 'episodes': episodes,
+                      'reward_code_hash': code_hash(code), 'wall_time': wall_time,
+                      'error': str(error), 'traceback': tb}
+            record.update(meta)
+            self.run_ids[name] = self.store.save_run(self.name, name, {}, record)
 
-    def plot_results(self, filename="experiment_result.png"):
+    def _find_q_table(self, name, stored):
+        """
+        学習済みQテーブルを探す（このセッションのもの、なければストアの最新 run）。
+        Returns:
+            (q_table, run_id, action_repeat, discretizer) または None
+        """
+        if name in self.q_tables:
+            return self.q_tables[name], self.run_ids.get(name), self.action_repeats.get(name, 1), self.discretizer
+        run = stored.get(name)
+        if run is None or 'q_table' not in run.columns:
+            return None
+        discretizer = self.discretizer
+        if 'discretizer' in run.meta:
+            discretizer = AdaptiveDiscretizer.from_dict(run.meta['discretizer'])
+        return np.asarray(run['q_table']), run.run_id, run.meta.get('action_repeat', 1), discretizer
+
+    def _warm_start_table(self, source, epsilon, action_repeat, stored):
+        """
+        ウォームスタート元 source の学習済みQテーブルと、run に残すメタデータを返す。
+        見つからない・離散化や action_repeat が違う場合は (None, None)（ゼロから学習する）。
+        """
+        found = self._find_q_table(source, stored)
+        if found is None:
+            print(f"  [Warning] Warm start source {source} has no trained Q-table. Training from scratch.")
+            return None, None
+        q_table, run_id, source_repeat, discretizer = found
+        same_bins = discretizer is self.discretizer or (
+            hasattr(self.discretizer, 'to_dict') and discretizer.to_dict() == self.discretizer.to_dict())
+        if not same_bins or q_table.shape[:-1] != tuple(self.discretizer.shape) or source_repeat != action_repeat:
+            print(f"  [Warning] Warm start source {source} was trained with a different discretizer or "
+                  f"action_repeat. Training from scratch.")
+            return None, None
+        print(f"    [Warm Start] from {source}" + (f" ({run_id})" if run_id else "") + f", epsilon={epsilon}")
+        return q_table, {'source': source, 'run_id': run_id, 'epsilon': epsilon}
+
+    def evaluate_greedy(self, episodes=1000, names=None, num_envs=16, asynchronous=False, seed=10_000):
+        """
+        学習済みQテーブルの貪欲方策を、シード固定の同じエピソード列で評価して比較する。
+        Qテーブルはこのセッションで学習したもの、なければストアの最新 run から読み込む。
+        結果は self.evaluations に入り、ストアがあれば元の run に eval_* 列と 'evaluation' として追記する。
+        評価は metric_fn だけを見るので、報酬関数のエラーで打ち切る予算は使わない（例外の出たステップはデフォルト報酬）。
+
+        Args:
+            episodes: 候補ごとの評価エピソード数
+            seed: 評価用のシード（学習の seed と別にしておく）
+        """
+        print(f"\n[Eval] Greedy evaluation: {episodes} episodes x {num_envs} envs, seed={seed}")
+        stored = self.store.latest_runs(self.name) if self.store is not None else {}
+
+        for name, code in self.reward_codes.items():
+            if names is not None and name not in names:
+                continue
+            found = self._find_q_table(name, stored)
+            if found is None:
+                continue
+            q_table, run_id, action_repeat, discretizer = found
+            if q_table.shape[:-1] != tuple(discretizer.shape):
+                print(f"  [Warning] {name}: Q-table shape {q_table.shape[:-1]} does not match the discretizer "
+                      f"{tuple(discretizer.shape)}. Skipping.")
+                continue
+
+            # 学習と同じマクロステップで評価する（Qテーブルの行動価値はその粒度のもの）
+            try:
+                report = evaluate_q_table(
+                    functools.partial(make_candidate_env, self.env_factory, code, action_repeat=action_repeat,
+                                      max_reward_errors=None, max_reward_error_rate=None),
+                    q_table, discretizer,
+                    episodes=episodes, metric_fn=self.metric_fn, seed=seed, num_envs=num_envs, asynchronous=asynchronous
+                )
+            except RewardFunctionError as e:
+                # 1つの候補の失敗で残りの評価を止めない
+                print(f"  [Error] {name}: evaluation failed: {e}")
+                continue
+            self.evaluations[name] = report
+            s = report['summary']
+            rate = f"  success={s['rate']:.1%}" if 'rate' in s else ""
+            print(f"  {name:40s} {s['mean']:.4f} ± {s['ci95']:.4f}  median={s['median']:.4f}  "
+                  f"p05-p95=[{s['p05']:.4f}, {s['p95']:.4f}]{rate}")
+
+            if self.store is not None and run_id is not None:
+                columns = {'eval_metric': report['metric'], 'eval_total_reward': report['total_reward'],
+                           'eval_length': report['length']}
+                evaluation = dict(s, seed=seed, num_envs=num_envs, action_repeat=action_repeat)
+                self.store.add_columns(run_id, columns, {'evaluation': evaluation})
+        return self.evaluations
+
+    def run_reference(self, policy, name="Optimal(VI)", episodes=1000):
+        """
+        学習なしの参照方策（例: training.value_iteration の解）を実行して結果に加える。
+        強化学習の結果と同じグラフ・ストアで比較できる上界として使う。
+        metric の上界にするには、metric_fn に対応する報酬（reward="metric"）で解いた方策を渡すこと
+        （環境のデフォルト報酬で解いた方策は、その報酬にとっての最適方策でしかない）。
+        """
+        print(f"--> Reference: {name}")
+        t_start = time.time()
+        history = run_policy_episodes(self.env_factory, policy, episodes=episodes,
+                                      metric_fn=self.metric_fn, seed=self.seed)
+        wall_time = time.time() - t_start
+
+        window = default_window(episodes)
+        self.results[name] = smooth(history, window)
+        print(f"    Final Score (Last {window} avg): {np.mean(history[-window:]):.4f}")
+
+        if self.store is not None:
+            columns = {'metric': np.asarray(history, dtype=np.float64)}
+            meta = {'status': 'ok', 'reference': True, 'seed': self.seed, 'episodes': episodes, 'wall_time': wall_time}
+            self.run_ids[name] = self.store.save_run(self.name, name, columns, meta)
+
+    def plot_results(self, filename="experiment_result.png", show=True):
         if not self.results:
-            print("No results to plot.")
+            # メモリ上に結果がなければストアから読み込んで描画（再学習しない）
+            if self.store is not None and filename:
+                plot_runs(self.store, self.name, filename)
+            else:
+                print("No results to plot.")
             return
 
+        import matplotlib.pyplot as plt # 描画するときだけ読み込む
+
         plt.figure(figsize=(12, 7))
         
         # 色を見やすくするためのカラーサイクル
@@ -165,4 +713,7 @@ class ExperimentRunner:
         if filename:
             plt.savefig(filename, dpi=150)
             print(f"\n[Plot] Saved to {filename}")
-        plt.show()
\ No newline at end of file
+        if show:
+            plt.show()
+        else:
+            plt.close()
\ No newline at end of file
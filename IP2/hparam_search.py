@@ -0,0 +1,259 @@
+# hparam_search.py
+# Q学習のハイパーパラメータ (lr, gamma, eps_decay, min_eps) をタスク・報酬候補ごとに
+# 合計エピソード数の予算内で並列に探索し、結果をタスクごとのプリセットとして保存する。
+#
+#   python hparam_search.py cooling --mode random --budget 20000 --trials 8
+#   python hparam_search.py gridworld --mode pbt --budget 20000 --population 4 --candidate Default
+#
+# 保存したプリセットは run_experiments(hparam_preset="cooling") や
+# スイープ設定の "hparams": "preset" で使える。
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from tasks import get_task
+from results_store import default_window
+from experiment_runner import make_candidate_env
+from training.q_learning import train_q_learning, resolve_hparams, epsilon_at
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+PRESET_FILE = os.path.join(_HERE, "hparam_presets.json")
+
+# 探索範囲: (下限, 上限, 対数スケールか)
+SEARCH_SPACE = {
+    'lr': (0.02, 0.5, True),
+    'gamma': (0.8, 0.995, False),
+    'eps_decay': (0.95, 0.999, False),
+    'min_eps': (0.001, 0.1, True),
+}
+
+
+def sample_hparams(rng, space=None):
+    """探索範囲から一様（対数スケールの項目は対数一様）に1組サンプルする"""
+    space = space or SEARCH_SPACE
+    hparams = {}
+    for key, (low, high, log) in space.items():
+        if log:
+            hparams[key] = float(np.exp(rng.uniform(np.log(low), np.log(high))))
+        else:
+            hparams[key] = float(rng.uniform(low, high))
+    return hparams
+
+
+def perturb_hparams(rng, hparams, space=None, factors=(0.8, 1.2)):
+    """PBT の explore: 各項目を factors のどちらかで掛けて範囲内に収める"""
+    space = space or SEARCH_SPACE
+    new = dict(hparams)
+    for key, (low, high, _) in space.items():
+        if key in new:
+            new[key] = float(np.clip(new[key] * rng.choice(factors), low, high))
+    return new
+
+
+def train_segment(task_name, code, hparams, episodes, seed, q_init=None, epsilon=None):
+    """
+    1候補を episodes エピソード学習する（ワーカープロセス内で呼ばれる）。
+    epsilon を渡すと、hparams の初期値の代わりにその値から q_init の続きとして学習する（PBT の区間学習）。
+    Returns:
+        (history, q_table, epsilon) : epsilon は区間の終わりの値（次の区間の開始値）
+    """
+    task = get_task(task_name)
+    segment_hparams = resolve_hparams(hparams)
+    if epsilon is not None:
+        segment_hparams['epsilon'] = epsilon
+    env = make_candidate_env(task.env_factory, code)
+    if env is None:
+        raise ValueError("reward function compilation failed")
+    try:
+        history, info = train_q_learning(env, task.discretizer, episodes=episodes, metric_fn=task.metric_fn,
+                                         verbose=False, seed=seed, return_info=True, hparams=segment_hparams,
+                                         q_init=q_init)
+    finally:
+        env.close()
+    return history, info['q_table'], epsilon_at(segment_hparams, episodes)
+
+
+def tail_score(history, metric_sign, tail=0.2):
+    """
+    最後の tail 割の区間の平均に metric_sign を掛けた値（大きいほど良い）。
+    成功率のような 0/1 の metric でも比べられるよう、学習曲線の 5% 窓より広めに取る。
+    """
+    window = max(int(len(history) * tail), default_window(len(history)))
+    return float(metric_sign * np.mean(history[-window:]))
+
+
+def random_search(task_name, code=None, budget=20000, trials=8, workers=None, seed=0, space=None):
+    """
+    ランダムサーチ: trials 組のハイパーパラメータを budget // trials エピソードずつ並列に学習して比べる。
+    どの試行も同じ seed で学習する（環境の乱数を揃えて、ハイパーパラメータの差だけを比べる）。
+    Returns:
+        { 'method', 'best': {hparams, score}, 'trials': [{hparams, score}, ...], 'budget', 'episodes_used' }
+    """
+    task = get_task(task_name)
+    rng = np.random.default_rng(seed)
+    episodes = budget // trials
+    if episodes < 1:
+        raise ValueError(f"budget {budget} is too small for {trials} trials")
+    candidates = [sample_hparams(rng, space) for _ in range(trials)]
+    print(f"[HSearch] {task_name}: random search, {trials} trials x {episodes} episodes")
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(train_segment, task_name, code, hp, episodes, seed) for hp in candidates]
+        for i, (hp, future) in enumerate(zip(candidates, futures)):
+            history, _, _ = future.result()
+            score = tail_score(history, task.metric_sign)
+            results.append({'hparams': hp, 'score': score})
+            print(f"  trial {i}: score {score:.4f}  {_format(hp)}")
+
+    return {'method': 'random', 'best': _pick_best(results), 'trials': results, 'budget': budget,
+            'episodes_used': episodes * trials}
+
+
+def population_based_training(task_name, code=None, budget=20000, population=4, interval=None, workers=None,
+                              seed=0, space=None):
+    """
+    PBT: population 個のメンバーを interval エピソードずつ並列に学習し、区間ごとに
+    下位 1/4 を上位 1/4 のQテーブル・ハイパーパラメータで置き換えて（exploit）、値を揺らす（explore）。
+    epsilon は各メンバーが区間の終わりの値を持ち越して減衰を続ける。exploit ではコピー元の
+    その時点の epsilon を引き継ぎ、explore で揺らした eps_decay はそこから先の減衰にだけ効く。
+
+    exploit / explore の判断は直近の区間の成績で行うが、最後に選ぶ 'best' は各メンバーの系譜
+    （exploit でコピー元の学習曲線も引き継ぐ）の通算の学習曲線の最後の 2 割で比べる。
+    1区間だけの短い窓だと、0/1 の metric では偶然の当たり外れで選ばれてしまうため。
+
+    Returns:
+        random_search と同じ形式。'best' はその系譜の最後のハイパーパラメータ（最後の区間で使った値）、
+        'trials' の 'score' は系譜の通算スコア、'events' に exploit の記録が入る
+    """
+    task = get_task(task_name)
+    rng = np.random.default_rng(seed)
+    interval = interval or max(budget // (population * 5), 1)
+    rounds = budget // (population * interval)
+    if rounds < 1:
+        raise ValueError(f"budget {budget} is too small for population {population} x interval {interval}")
+    members = [{'hparams': sample_hparams(rng, space), 'q_table': None, 'epsilon': None, 'score': None, 'history': []}
+               for _ in range(population)]
+    n_replace = max(population // 4, 1)
+    events = []
+    print(f"[HSearch] {task_name}: PBT, population {population}, {rounds} rounds x {interval} episodes")
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for r in range(rounds):
+            futures = [pool.submit(train_segment, task_name, code, m['hparams'], interval,
+                                   seed * 100_000 + r * population + i, m['q_table'], m['epsilon'])
+                       for i, m in enumerate(members)]
+            for m, future in zip(members, futures):
+                history, q_table, epsilon = future.result()
+                m['q_table'] = q_table
+                m['epsilon'] = epsilon
+                m['history'].extend(history)
+                m['score'] = tail_score(history, task.metric_sign, tail=0.5)
+
+            order = sorted(range(population), key=lambda i: members[i]['score'], reverse=True)
+            print(f"  round {r}: best {members[order[0]]['score']:.4f}, worst {members[order[-1]]['score']:.4f}")
+            if r == rounds - 1 or population < 2:
+                break
+            for loser in order[-n_replace:]:
+                winner = order[int(rng.integers(n_replace))]
+                src = members[winner]
+                members[loser] = {'hparams': perturb_hparams(rng, src['hparams'], space),
+                                  'q_table': src['q_table'].copy(), 'epsilon': src['epsilon'], 'score': None,
+                                  'history': list(src['history'])}
+                events.append({'round': r, 'replaced': loser, 'by': winner})
+
+    trials = [{'hparams': m['hparams'], 'score': tail_score(m['history'], task.metric_sign)} for m in members]
+    return {'method': 'pbt', 'best': _pick_best(trials), 'trials': trials,
+            'events': events, 'budget': budget, 'episodes_used': rounds * population * interval}
+
+
+def _pick_best(trials):
+    """スコアが有限の試行のうち一番良いもの（nan / inf のスコアはプリセットにしない）"""
+    finite = [t for t in trials if np.isfinite(t['score'])]
+    if not finite:
+        raise ValueError("no trial produced a finite score")
+    return max(finite, key=lambda t: t['score'])
+
+
+def _format(hparams):
+    return " ".join(f"{k}={v:.4g}" for k, v in hparams.items())
+
+
+# ---- プリセット ----
+
+def load_presets(path=None):
+    path = path or PRESET_FILE
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_preset(task_name, result, candidate=None, path=None):
+    """
+    探索結果をプリセットファイルに書き込む。candidate を省略するとタスク全体のプリセット ('*') になる。
+    """
+    path = path or PRESET_FILE
+    presets = load_presets(path)
+    presets.setdefault(task_name, {})[candidate or '*'] = {
+        'hparams': result['best']['hparams'],
+        'score': result['best']['score'],
+        'method': result['method'],
+        'budget': result['budget'],
+        'created_at': time.time(),
+    }
+    tmp = path + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(presets, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def load_preset(task_name, candidate=None, path=None):
+    """報酬候補のプリセット、なければタスク全体のプリセットの hparams を返す（どちらもなければ None）"""
+    task_presets = load_presets(path).get(task_name, {})
+    entry = task_presets.get(candidate) if candidate else None
+    entry = entry or task_presets.get('*')
+    return dict(entry['hparams']) if entry else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Q学習のハイパーパラメータを予算内で並列に探索し、プリセットとして保存する")
+    parser.add_argument("task", help="タスク名 (cooling / gridworld / cartpole)")
+    parser.add_argument("--mode", choices=["random", "pbt"], default="random")
+    parser.add_argument("--candidate", default=None, help="報酬候補名（省略時はデフォルト報酬で探索し、タスク全体のプリセットにする）")
+    parser.add_argument("--budget", type=int, default=20000, help="合計エピソード数")
+    parser.add_argument("--trials", type=int, default=8, help="ランダムサーチの試行数")
+    parser.add_argument("--population", type=int, default=4, help="PBT のメンバー数")
+    parser.add_argument("--interval", type=int, default=None, help="PBT の exploit/explore 間隔（エピソード）")
+    parser.add_argument("--workers", type=int, default=None, help="並列プロセス数（省略時は全コア）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-save", action="store_true", help="プリセットに保存しない")
+    args = parser.parse_args()
+
+    code = None
+    if args.candidate:
+        codes = get_task(args.task).load_reward_codes()
+        if args.candidate not in codes:
+            parser.error(f"candidate {args.candidate} not found for {args.task}")
+        code = codes[args.candidate]
+
+    t_start = time.time()
+    if args.mode == "random":
+        result = random_search(args.task, code, budget=args.budget, trials=args.trials, workers=args.workers,
+                               seed=args.seed)
+    else:
+        result = population_based_training(args.task, code, budget=args.budget, population=args.population,
+                                           interval=args.interval, workers=args.workers, seed=args.seed)
+    best = result['best']
+    print(f"[HSearch] best score {best['score']:.4f}  {_format(best['hparams'])}  "
+          f"({result['episodes_used']} episodes, {time.time() - t_start:.1f}s)")
+    if not args.no_save:
+        save_preset(args.task, result, candidate=args.candidate)
+        print(f"[HSearch] Saved preset for {args.task}/{args.candidate or '*'} to {PRESET_FILE}")
+
+
+if __name__ == "__main__":
+    main()
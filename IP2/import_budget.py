@@ -0,0 +1,75 @@
+# import_budget.py
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# 学習だけを行うワーカーが読み込むモジュールと、そのimport時間の予算（秒, 新しいプロセスでの計測）
+TRAINING_PATH_BUDGET = {
+    'training.q_learning': 0.15,
+    'envs.server_cooling': 0.25,
+    'envs.abstract_sensor_gridworld': 0.25,
+    'envs.cartpole_tracking': 0.25,
+    'experiment_runner': 0.3,  # 遅延importの前は約0.6秒
+}
+
+# 学習経路で読み込まれてはいけない重いモジュール（描画・LLMクライアント）
+FORBIDDEN_MODULES = ['matplotlib', 'requests']
+
+_PROBE = """
+import sys, time, json
+t = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t
+print(json.dumps({{'sec': elapsed, 'loaded': [m for m in {forbidden!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import(module, repeats=3):
+    """
+    新しいPythonプロセスで module をimportし、最短の所要時間と読み込まれた禁止モジュールを返す。
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    code = _PROBE.format(module=module, forbidden=FORBIDDEN_MODULES)
+    best = None
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, "-c", code], cwd=here, capture_output=True, text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        if best is None or result['sec'] < best['sec']:
+            best = result
+    return best
+
+
+def check_budget(budget=None, repeats=3):
+    """
+    Returns:
+        (ok, rows) : rows は [{ 'module', 'sec', 'budget', 'loaded' }, ...]
+    """
+    budget = budget or TRAINING_PATH_BUDGET
+    rows = []
+    ok = True
+    for module, limit in budget.items():
+        result = measure_import(module, repeats=repeats)
+        row = {'module': module, 'sec': result['sec'], 'budget': limit, 'loaded': result['loaded']}
+        if result['sec'] > limit or result['loaded']:
+            ok = False
+        rows.append(row)
+    return ok, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="学習経路のimport時間が予算内か確認する")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    ok, rows = check_budget(repeats=args.repeats)
+    for row in rows:
+        status = "OK  " if row['sec'] <= row['budget'] and not row['loaded'] else "FAIL"
+        extra = f"  loaded: {', '.join(row['loaded'])}" if row['loaded'] else ""
+        print(f"[{status}] {row['module']:35s} {row['sec']*1000:7.1f} ms (budget {row['budget']*1000:.0f} ms){extra}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
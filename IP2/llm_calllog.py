@@ -0,0 +1,151 @@
+# llm_calllog.py
+import os
+import json
+import time
+import hashlib
+import argparse
+import threading
+import numpy as np
+
+# LLM呼び出しの記録先（追記専用の JSON Lines）。環境変数 LLM_CALL_LOG で変更できる
+DEFAULT_LOG_PATH = os.getenv("LLM_CALL_LOG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_calls.jsonl"))
+
+_lock = threading.Lock()
+
+
+def prompt_hash(system_instruction, user_content):
+    return hashlib.sha256(f"{system_instruction}\0{user_content}".encode("utf-8")).hexdigest()[:16]
+
+
+def new_record(client, model, system_instruction, user_content, **fields):
+    """
+    1回の論理的な呼び出し（リトライを含む）の記録を作る。
+    呼び出し側が attempts / status / latency などを埋めてから log_call に渡す。
+    """
+    record = {
+        'time': time.time(),
+        'pid': os.getpid(),
+        'client': client,
+        'model': model,
+        'prompt_hash': prompt_hash(system_instruction, user_content),
+        'prompt_chars': len(system_instruction) + len(user_content),
+        'n': 1,
+        'attempts': 0,
+        'statuses': [],     # 試行ごとの HTTP ステータス（通信エラーは None）
+        'status': None,     # 最後の試行の HTTP ステータス
+        'ok': False,
+        'latency': None,    # 呼び出し全体の経過時間（リトライ・待機を含む, 秒）
+        'ttfb': None,       # 最後の試行でレスポンスヘッダが返るまでの時間（秒）
+        'prompt_tokens': None,
+        'completion_tokens': None,
+        'total_tokens': None,
+        'cost': None,
+        'error': None,
+    }
+    record.update(fields)
+    return record
+
+
+def record_usage(record, data):
+    """レスポンスJSONの usage ブロックを記録に写す"""
+    usage = data.get('usage') if isinstance(data, dict) else None
+    if not isinstance(usage, dict):
+        return
+    for key in ('prompt_tokens', 'completion_tokens', 'total_tokens', 'cost'):
+        if usage.get(key) is not None:
+            record[key] = usage[key]
+
+
+def log_call(record, path=None):
+    """記録を1行追記する（スレッド並列の呼び出しからも安全）。書き込みに失敗しても呼び出しは止めない"""
+    path = path or DEFAULT_LOG_PATH
+    line = json.dumps(record, ensure_ascii=False)
+    try:
+        with _lock, open(path, 'a', encoding='utf-8') as f:
+            f.write(line + "\n")
+    except OSError as e:
+        print(f"[LLMLog] Failed to write {path}: {e}")
+
+
+def read_calls(path=None, since=None, pid=None):
+    """記録を読み込む（since: この時刻以降, pid: このプロセスの呼び出しだけ）"""
+    path = path or DEFAULT_LOG_PATH
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue # 書き込み途中の行は読み飛ばす
+            if since is not None and record['time'] < since:
+                continue
+            if pid is not None and record.get('pid') != pid:
+                continue
+            records.append(record)
+    return records
+
+
+def summarize_calls(records):
+    """
+    モデルごとに集計する。
+    Returns:
+        { model: { 'calls', 'ok', 'failed', 'attempts', 'retries', 'throttled',
+                   'latency_p50', 'latency_p95', 'ttfb_p50', 'prompt_tokens', 'completion_tokens', 'cost' } }
+    """
+    summary = {}
+    for model in sorted({r['model'] for r in records}):
+        rows = [r for r in records if r['model'] == model]
+        latency = [r['latency'] for r in rows if r['ok'] and r['latency'] is not None]
+        ttfb = [r['ttfb'] for r in rows if r['ok'] and r['ttfb'] is not None]
+        summary[model] = {
+            'calls': len(rows),
+            'ok': sum(1 for r in rows if r['ok']),
+            'failed': sum(1 for r in rows if not r['ok']),
+            'attempts': sum(r['attempts'] for r in rows),
+            'retries': sum(max(r['attempts'] - 1, 0) for r in rows),
+            'throttled': sum(r['statuses'].count(429) for r in rows),
+            'latency_p50': float(np.percentile(latency, 50)) if latency else None,
+            'latency_p95': float(np.percentile(latency, 95)) if latency else None,
+            'ttfb_p50': float(np.percentile(ttfb, 50)) if ttfb else None,
+            'prompt_tokens': sum(r['prompt_tokens'] or 0 for r in rows),
+            'completion_tokens': sum(r['completion_tokens'] or 0 for r in rows),
+            'cost': sum(r['cost'] or 0 for r in rows),
+        }
+    return summary
+
+
+def print_summary(records, title="LLM calls"):
+    summary = summarize_calls(records)
+    if not summary:
+        print(f"[LLMLog] {title}: no calls")
+        return summary
+
+    def fmt(v):
+        return f"{v:6.2f}s" if v is not None else "    - "
+
+    print(f"[LLMLog] {title}: {len(records)} calls")
+    for model, s in summary.items():
+        print(f"  {model:40s} ok {s['ok']}/{s['calls']}  retries {s['retries']} (429: {s['throttled']})  "
+              f"latency p50 {fmt(s['latency_p50'])} p95 {fmt(s['latency_p95'])}  ttfb p50 {fmt(s['ttfb_p50'])}  "
+              f"tokens {s['prompt_tokens']}+{s['completion_tokens']}" + (f"  cost {s['cost']:.4f}" if s['cost'] else ""))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM呼び出しの記録（速度・トークン・リトライ）を集計する")
+    parser.add_argument("path", nargs="?", default=None, help="記録ファイル（省略時は llm_calls.jsonl）")
+    parser.add_argument("--hours", type=float, default=None, help="直近この時間の呼び出しだけ集計する")
+    args = parser.parse_args()
+
+    since = time.time() - args.hours * 3600 if args.hours else None
+    records = read_calls(args.path, since=since)
+    print_summary(records, title=args.path or DEFAULT_LOG_PATH)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# offline_ranking.py
+import numpy as np
+from envs.wrappers import compile_reward_fn
+from reward_screening import relabel_rewards
+from training.batch_q import discretize_transitions, batch_q_iteration
+from training.evaluation import greedy_policy, run_policy_episodes
+
+
+class TransitionDataset:
+    """
+    報酬候補の比較用に離散化済みの遷移列を保持する。
+    環境のステップは1回分だけ記録し、報酬列だけを候補ごとに差し替える。
+    """
+    def __init__(self, trajectories, discretizer, n_actions):
+        self.trajectories = trajectories
+        self.shape = tuple(discretizer.shape)
+        self.n_actions = n_actions
+        self.states = discretize_transitions(trajectories.obs, discretizer)
+        self.next_states = discretize_transitions(trajectories.next_obs, discretizer)
+        self.actions = np.asarray(trajectories.actions, dtype=np.int64)
+        self.terminated = trajectories.terminated
+        self.infos = trajectories.infos
+
+    def __len__(self):
+        return len(self.actions)
+
+    def relabel(self, code):
+        """候補の報酬で報酬列を作り直す（code=None なら環境のデフォルト報酬）"""
+        if not code:
+            return self.trajectories.rewards, []
+        reward_fn = compile_reward_fn(code)
+        if reward_fn is None:
+            return None, [(-1, "compile failed")]
+        return relabel_rewards(reward_fn, self.trajectories)
+
+    def fit(self, rewards, gamma=0.95, iterations=200):
+        return batch_q_iteration(self.states, self.actions, self.next_states, rewards, self.terminated,
+                                 self.shape, self.n_actions, gamma=gamma, iterations=iterations)
+
+
+def rank_rewards_offline(reward_codes, dataset, env_factory, discretizer, metric_fn=None, metric_sign=-1,
+                         gamma=0.95, eval_episodes=20, seed=0):
+    """
+    共有の遷移データ上で各報酬候補のQテーブルをバッチQ反復で求め、
+    その貪欲方策を短い評価エピソードで実行して候補を順位付けする。
+
+    Args:
+        reward_codes: { name: code }（code=None はデフォルト報酬）
+        dataset: TransitionDataset
+        metric_sign: +1 なら metric は高いほど良い、-1 なら低いほど良い
+        eval_episodes: 貪欲方策の評価エピソード数（1以上）。候補ごとに報酬のスケールが違うので、
+            Q値の大きさでは比べられず、順位は必ず評価エピソードの metric で付ける
+    Returns:
+        良い順に並んだ [{ 'name', 'score', 'coverage', 'error' }, ...]
+    """
+    if eval_episodes < 1:
+        raise ValueError(f"eval_episodes must be at least 1 to rank candidates (got {eval_episodes})")
+    ranking = []
+    for name, code in reward_codes.items():
+        rewards, errors = dataset.relabel(code)
+        if rewards is None or errors:
+            ranking.append({'name': name, 'score': None, 'coverage': 0.0, 'error': f"{len(errors)} reward errors"})
+            continue
+
+        q_table, counts = dataset.fit(rewards, gamma=gamma)
+        entry = {
+            'name': name,
+            'score': None,
+            'coverage': float(np.mean(counts.sum(axis=-1) > 0)),
+            'error': None,
+        }
+        history = run_policy_episodes(env_factory, greedy_policy(q_table, discretizer),
+                                      episodes=eval_episodes, metric_fn=metric_fn, seed=seed)
+        entry['score'] = float(np.mean(history))
+        ranking.append(entry)
+
+    # 評価できた候補を metric の良い順に、失敗した候補は末尾へ
+    scored = [r for r in ranking if r['score'] is not None]
+    failed = [r for r in ranking if r['score'] is None]
+    scored.sort(key=lambda r: r['score'], reverse=(metric_sign > 0))
+    return scored + failed
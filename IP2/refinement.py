@@ -0,0 +1,413 @@
+# refinement.py
+# Eureka 風の報酬の反復改良ループ。
+# 各候補の学習結果（最終 metric・学習曲線・報酬の各項の大きさ）をプロンプトに入れてLLMに改良版を書かせる。
+# LLM呼び出しはスレッド、学習はプロセスプールで並行に動かし、候補の学習が終わった時点で
+# その候補の改良リクエストを出す（ラウンドの全候補の学習完了を待たない）。
+# 世代・系譜・時刻は state ファイル(JSON)に逐次保存され、途中で止めても続きから再開できる。
+#
+# 使い方:
+#   python refinement.py cooling --models openai/gpt-4o-mini google/gemini-2.0-flash-001 --rounds 3
+import os
+import json
+import time
+import argparse
+import traceback
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+from tasks import get_task
+from results_store import ResultsStore, code_hash, default_window
+from reward_dedup import reward_fingerprint
+from reward_screening import load_or_record_trajectories, reward_term_stats
+from envs.wrappers import compile_reward_fn
+from experiment_runner import extract_code
+from sweep import make_job_id, train_job, save_job_result
+
+FEEDBACK_PROMPT = """
+{task_prompt}
+
+Below is a reward function you wrote earlier and the result of training a tabular Q-learning agent with it.
+
+```python
+{code}
+```
+
+Training result ({episodes} episodes x {n_seeds} seed(s)):
+- Task metric ({direction} is better): final {score:.4f} (best candidate so far: {best:.4f})
+- Learning curve (metric averaged over {n_segments} equal segments of training): {curve}
+- Mean episode length: {length:.1f}, mean episode return: {total_reward:.3f}
+- Magnitude of values computed inside compute_reward (mean |value| on sample transitions):
+{terms}
+
+Analyze which terms dominate the reward, which ones have no effect, and whether the curve is still improving.
+Then write an improved reward function.
+Function signature MUST stay:
+def compute_reward(obs, terminated, truncated, info):
+    return float_reward
+Return ONLY the function code inside ```python ... ```.
+"""
+
+GENERATING, TRAINING, DONE, FAILED, DUPLICATE, INVALID = "generating", "training", "done", "failed", "duplicate", "invalid"
+
+
+def _union_length(intervals):
+    """区間 [(start, end), ...] の和集合の長さ"""
+    total = 0.0
+    cur_start = cur_end = None
+    for start, end in sorted(intervals):
+        if cur_end is None or start > cur_end:
+            if cur_end is not None:
+                total += cur_end - cur_start
+            cur_start, cur_end = start, end
+        else:
+            cur_end = max(cur_end, end)
+    if cur_end is not None:
+        total += cur_end - cur_start
+    return total
+
+
+def _overlap_length(a, b):
+    """2つの区間集合が同時に動いていた時間"""
+    return _union_length(a) + _union_length(b) - _union_length(list(a) + list(b))
+
+
+def curve_segments(history, n_segments=5):
+    """学習曲線を n_segments 個の区間平均に要約する"""
+    history = np.asarray(history, dtype=np.float64)
+    return [float(np.mean(seg)) for seg in np.array_split(history, n_segments) if len(seg)]
+
+
+class RefinementLoop:
+    """
+    1タスク分の反復改良ループ。
+
+    Args:
+        task_name: tasks.TASKS のキー
+        models: 初期生成に使うモデルのリスト（改良は親と同じモデルで行う）
+        rounds: 改良の世代数（初期生成が第0世代）
+        samples: 第0世代でモデルごとに取るサンプル数
+        children: 1候補あたりの改良版の数
+        episodes, seeds, hparams: 候補ごとの学習設定（seed ごとに1ジョブ）
+        workers: 学習プロセス数（省略時は全コア）
+        llm_threads: 同時に投げるLLM呼び出しの数
+        state_file: 進捗の保存先（省略時は refinement_<task>.json）
+        store: 学習結果を保存する ResultsStore のディレクトリ
+        warm_start: True なら改良版を親の同じ seed の学習済みQテーブルから始める
+        warm_start_epsilon: ウォームスタートした改良版の開始 epsilon
+    """
+    def __init__(self, task_name, models, rounds=3, samples=2, children=1, episodes=500, seeds=(0,), hparams=None,
+                 workers=None, llm_threads=4, temperature=0.7, state_file=None, store="results", warm_start=False,
+                 warm_start_epsilon=0.2):
+        self.task = get_task(task_name)
+        self.models = list(models)
+        self.rounds = rounds
+        self.samples = samples
+        self.children = children
+        self.episodes = episodes
+        self.seeds = list(seeds)
+        self.hparams = hparams or {}
+        self.workers = workers or os.cpu_count()
+        self.llm_threads = llm_threads
+        self.temperature = temperature
+        self.state_file = state_file or f"refinement_{task_name}.json"
+        self.store = ResultsStore(store)
+        self.warm_start = warm_start
+        self.warm_start_epsilon = warm_start_epsilon
+        self.state = self._load_state()
+        self._trajectories = None
+
+    # ---- 状態の保存・読み込み ----
+
+    def _load_state(self):
+        if os.path.exists(self.state_file):
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            print(f"[Refine] Resuming from {self.state_file} ({len(state['candidates'])} candidates)")
+            return state
+        return {'task': self.task.name, 'created_at': time.time(), 'candidates': {}, 'llm_calls': [], 'sessions': []}
+
+    def save_state(self):
+        self.state['config'] = {
+            'models': self.models, 'rounds': self.rounds, 'samples': self.samples, 'children': self.children,
+            'episodes': self.episodes, 'seeds': self.seeds, 'hparams': self.hparams,
+            'warm_start': self.warm_start, 'warm_start_epsilon': self.warm_start_epsilon,
+        }
+        self.state['updated_at'] = time.time()
+        tmp = self.state_file + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, self.state_file)
+
+    @property
+    def candidates(self):
+        return self.state['candidates']
+
+    def ranking(self):
+        """学習済み候補を良い順に返す"""
+        done = [c for c in self.candidates.values() if c['status'] == DONE]
+        return sorted(done, key=lambda c: -self.task.metric_sign * c['score'])
+
+    # ---- LLM ----
+
+    def _feedback_prompt(self, cand):
+        stats = cand['stats']
+        terms = stats.get('terms') or {}
+        term_lines = "\n".join(f"  {name}: {v['mean_abs']:.4g} (std {v['std']:.3g})" for name, v in terms.items())
+        best = self.ranking()[0]['score']
+        return FEEDBACK_PROMPT.format(
+            task_prompt=self.task.prompt.strip(),
+            code=cand['code'],
+            episodes=stats['episodes'],
+            n_seeds=len(cand['runs']),
+            direction="higher" if self.task.metric_sign > 0 else "lower",
+            score=cand['score'],
+            best=best,
+            n_segments=len(stats['curve']),
+            curve=", ".join(f"{v:.4f}" for v in stats['curve']),
+            length=stats['length'],
+            total_reward=stats['total_reward'],
+            terms=term_lines or "  (no numeric intermediate values)",
+        )
+
+    def _submit_llm(self, llm_pool, pending, model, prompt, n, parent, generation):
+        from LLMapi_openrouter import call_llm_samples # 生成時にだけ読み込む
+
+        call = {'model': model, 'parent': parent, 'generation': generation, 'n': n,
+                'started_at': time.time(), 'finished_at': None, 'error': None}
+        future = llm_pool.submit(call_llm_samples, prompt, n=n, model=model, temperature=self.temperature)
+        pending[future] = ('llm', call)
+        print(f"[Refine] LLM request: {model} gen={generation} n={n}" + (f" (refining {parent})" if parent else ""))
+
+    def _handle_llm(self, future, call, train_pool, pending):
+        call['finished_at'] = time.time()
+        self.state['llm_calls'].append(call)
+        parent = self.candidates.get(call['parent']) if call['parent'] else None
+        try:
+            texts = future.result()
+        except Exception as e:
+            call['error'] = str(e)
+            print(f"  [LLM Error] {call['model']}: {e}")
+            texts = []
+        if not texts:
+            # 子候補が1つもできなかった改良は refined にせず、再開時に投げ直す
+            call['error'] = call['error'] or "LLM returned no samples"
+            if parent is not None:
+                parent['refine_error'] = call['error']
+            return
+        if parent is not None:
+            parent['refined'] = True
+            parent['refine_error'] = None
+
+        short = call['model'].split('/')[-1]
+        fingerprints = {c['fingerprint']: c['name'] for c in self.candidates.values() if c.get('fingerprint')}
+        for text in texts:
+            index = sum(1 for c in self.candidates.values()
+                        if c['model'] == call['model'] and c['generation'] == call['generation'])
+            name = f"Refine_{short}_g{call['generation']}#{index + 1}"
+            code = extract_code(text)
+            cand = {
+                'name': name, 'model': call['model'], 'generation': call['generation'], 'parent': call['parent'],
+                'code': code, 'code_hash': code_hash(code), 'fingerprint': None, 'status': GENERATING,
+                'llm_started_at': call['started_at'], 'llm_finished_at': call['finished_at'],
+                'runs': {}, 'score': None, 'stats': None, 'error': None, 'refined': False,
+            }
+            self.candidates[name] = cand
+
+            if "def compute_reward" not in code or compile_reward_fn(code) is None:
+                cand['status'] = INVALID
+                cand['error'] = "compute_reward not found or failed to compile"
+                print(f"  -> {name}: invalid code")
+                continue
+            cand['fingerprint'] = reward_fingerprint(code)
+            if cand['fingerprint'] in fingerprints:
+                cand['status'] = DUPLICATE
+                cand['duplicate_of'] = fingerprints[cand['fingerprint']]
+                print(f"  -> {name}: duplicate of {cand['duplicate_of']}")
+                continue
+            fingerprints[cand['fingerprint']] = name
+            self._submit_training(train_pool, pending, cand)
+
+    # ---- 学習 ----
+
+    def _job(self, cand, seed):
+        hparams, warm_start = self.hparams, None
+        parent = self.candidates.get(cand['parent']) if cand['parent'] else None
+        if self.warm_start and parent is not None and str(seed) in parent['runs']:
+            # 親と同じ環境・離散化なので、親の学習済みQテーブルから探索を減らして始める
+            hparams = dict(self.hparams, epsilon=self.warm_start_epsilon)
+            warm_start = {'source': parent['name'], 'run_id': parent['runs'][str(seed)]['run_id'],
+                          'epsilon': self.warm_start_epsilon}
+        return {
+            'job_id': make_job_id(self.task.name, cand['name'], cand['code'], seed, self.episodes, hparams),
+            'task': self.task.name,
+            'candidate': cand['name'],
+            'code': cand['code'],
+            'seed': seed,
+            'episodes': self.episodes,
+            'hparams': hparams,
+            'warm_start': warm_start,
+        }
+
+    def _submit_training(self, train_pool, pending, cand):
+        cand['status'] = TRAINING
+        cand['train_started_at'] = time.time()
+        for seed in self.seeds:
+            if str(seed) in cand['runs']:
+                continue
+            job = self._job(cand, seed)
+            pending[train_pool.submit(train_job, job, self.store.root)] = ('train', cand['name'], job)
+        print(f"  -> {cand['name']}: training ({len(self.seeds)} seed(s))")
+
+    def _handle_training(self, future, name, job, llm_pool, pending):
+        cand = self.candidates[name]
+        try:
+            history, train_info, wall_time = future.result()
+        except Exception:
+            cand['status'] = FAILED
+            cand['error'] = traceback.format_exc()
+            cand['train_finished_at'] = time.time()
+            print(f"  [Train Error] {name}: {cand['error'].strip().splitlines()[-1]}")
+            return
+        if cand['status'] == FAILED:
+            return # 他の seed が失敗済み
+
+        result = save_job_result(self.store, job, history, train_info, wall_time)
+        window = default_window(len(history))
+        cand['runs'][str(job['seed'])] = {
+            'run_id': result['run_id'],
+            'final_score': result['final_score'],
+            'wall_time': wall_time,
+            'curve': curve_segments(history),
+            'length': float(np.mean(train_info['length'][-window:])),
+            'total_reward': float(np.mean(train_info['total_reward'][-window:])),
+        }
+        if len(cand['runs']) < len(self.seeds):
+            return
+
+        # 全 seed の学習が終わったら統計をまとめて、改良リクエストを出す
+        runs = list(cand['runs'].values())
+        cand['train_finished_at'] = time.time()
+        cand['score'] = float(np.mean([r['final_score'] for r in runs]))
+        cand['stats'] = {
+            'curve': np.mean([r['curve'] for r in runs], axis=0).tolist(),
+            'length': float(np.mean([r['length'] for r in runs])),
+            'total_reward': float(np.mean([r['total_reward'] for r in runs])),
+            'terms': reward_term_stats(cand['code'], self._get_trajectories()),
+            'train_wall': float(sum(r['wall_time'] for r in runs)),
+            'episodes': self.episodes,
+        }
+        cand['status'] = DONE
+        print(f"  -> {name}: score {cand['score']:.4f} (gen {cand['generation']})")
+
+        if cand['generation'] < self.rounds:
+            self._submit_llm(llm_pool, pending, cand['model'], self._feedback_prompt(cand),
+                             self.children, name, cand['generation'] + 1)
+
+    def _get_trajectories(self):
+        if self._trajectories is None:
+            path = os.path.splitext(self.task.cache_file)[0] + "_trajectories.pkl"
+            self._trajectories = load_or_record_trajectories(path, self.task.env_factory, episodes=30, seed=0)
+        return self._trajectories
+
+    # ---- 実行 ----
+
+    def run(self):
+        """全世代が終わるまでLLM呼び出しと学習を並行に進める"""
+        session = {'started_at': time.time(), 'finished_at': None}
+        self.state['sessions'].append(session)
+        pending = {}
+
+        with ThreadPoolExecutor(max_workers=self.llm_threads) as llm_pool, \
+                ProcessPoolExecutor(max_workers=self.workers) as train_pool:
+            # 再開: 学習途中の候補と、改良リクエスト前に止まった候補を投げ直す
+            for cand in self.candidates.values():
+                if cand['status'] == TRAINING:
+                    self._submit_training(train_pool, pending, cand)
+                elif cand['status'] == DONE and not cand.get('refined') and cand['generation'] < self.rounds:
+                    self._submit_llm(llm_pool, pending, cand['model'], self._feedback_prompt(cand),
+                                     self.children, cand['name'], cand['generation'] + 1)
+            # 第0世代: まだ生成していないモデルだけ
+            started = {c['model'] for c in self.candidates.values() if c['generation'] == 0}
+            started |= {c['model'] for c in self.state['llm_calls'] if c['generation'] == 0 and not c['error']}
+            for model in self.models:
+                if model not in started:
+                    self._submit_llm(llm_pool, pending, model, self.task.prompt, self.samples, None, 0)
+            self.save_state()
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, *args = pending.pop(future)
+                    if kind == 'llm':
+                        self._handle_llm(future, args[0], train_pool, pending)
+                    else:
+                        self._handle_training(future, args[0], args[1], llm_pool, pending)
+                self.save_state()
+
+        session['finished_at'] = time.time()
+        session.update(self.timing_summary(session['started_at'], session['finished_at']))
+        self.save_state()
+        self.report(session)
+        return self.ranking()
+
+    def timing_summary(self, start, end):
+        """LLM呼び出しと学習がそれぞれ動いていた時間と、重なっていた時間"""
+        llm = [(c['started_at'], c['finished_at']) for c in self.state['llm_calls']
+               if c['finished_at'] and c['started_at'] >= start]
+        train = [(c['train_started_at'], c['train_finished_at']) for c in self.candidates.values()
+                 if c.get('train_finished_at') and c['train_started_at'] >= start]
+        return {
+            'elapsed': end - start,
+            'llm_active': _union_length(llm),
+            'train_active': _union_length(train),
+            'overlap': _overlap_length(llm, train),
+        }
+
+    def report(self, session=None):
+        print(f"\n[Refine] {self.task.name}: {len(self.candidates)} candidates")
+        for i, cand in enumerate(self.ranking()[:10]):
+            lineage = f" <- {cand['parent']}" if cand['parent'] else ""
+            print(f"  {i+1:2d}. {cand['name']:40s} score={cand['score']:.4f}{lineage}")
+        if session:
+            print(f"[Refine] elapsed {session['elapsed']:.1f}s, LLM active {session['llm_active']:.1f}s, "
+                  f"training active {session['train_active']:.1f}s, overlap {session['overlap']:.1f}s")
+
+    def export_top(self, k):
+        """上位 k 候補をタスクの報酬キャッシュに追加する（run_experiments / sweep で使えるように）"""
+        codes = self.task.load_reward_codes()
+        for cand in self.ranking()[:k]:
+            codes[cand['name']] = cand['code']
+        with open(self.task.cache_file, 'w', encoding='utf-8') as f:
+            json.dump(codes, f, indent=2, ensure_ascii=False)
+        print(f"[Refine] Exported top {k} candidates to {self.task.cache_file}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="学習結果をLLMにフィードバックして報酬関数を反復改良する")
+    parser.add_argument("task", help="タスク名 (cooling / gridworld / cartpole)")
+    parser.add_argument("--models", nargs="+", required=True, help="OpenRouter のモデルID")
+    parser.add_argument("--rounds", type=int, default=3, help="改良の世代数")
+    parser.add_argument("--samples", type=int, default=2, help="第0世代のモデルごとのサンプル数")
+    parser.add_argument("--children", type=int, default=1, help="1候補あたりの改良版の数")
+    parser.add_argument("--episodes", type=int, default=500)
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument("--workers", type=int, default=None, help="学習プロセス数（省略時は全コア）")
+    parser.add_argument("--llm-threads", type=int, default=4)
+    parser.add_argument("--state", default=None, help="進捗の保存先（省略時は refinement_<task>.json）")
+    parser.add_argument("--store", default="results")
+    parser.add_argument("--export-top", type=int, default=0, help="上位k候補を報酬キャッシュに追加する")
+    parser.add_argument("--warm-start", action="store_true", help="改良版を親の学習済みQテーブルから始める")
+    parser.add_argument("--warm-start-epsilon", type=float, default=0.2)
+    args = parser.parse_args()
+
+    loop = RefinementLoop(args.task, args.models, rounds=args.rounds, samples=args.samples, children=args.children,
+                          episodes=args.episodes, seeds=args.seeds, workers=args.workers,
+                          llm_threads=args.llm_threads, state_file=args.state, store=args.store,
+                          warm_start=args.warm_start, warm_start_epsilon=args.warm_start_epsilon)
+    loop.run()
+    if args.export_top:
+        loop.export_top(args.export_top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+# results_store.py
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import argparse
+import numpy as np
+
+
+def code_hash(code):
+    """報酬コードのハッシュ（Noneは環境のデフォルト報酬）"""
+    if code is None:
+        return "default"
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()[:16]
+
+
+def smooth(history, window):
+    """移動平均（履歴がwindowより短ければそのまま返す）"""
+    history = np.asarray(history, dtype=np.float64)
+    if window <= 1 or len(history) < window:
+        return history
+    return np.convolve(history, np.ones(window) / window, mode='valid')
+
+
+def default_window(episodes):
+    """ExperimentRunnerと同じ平滑化幅: エピソード数の5%（最低5）"""
+    return max(5, int(episodes * 0.05))
+
+
+class StoredRun:
+    """
+    ストア上の1回分の学習結果。
+    列(metric, total_reward, ...)はアクセスされた時点で np.load(mmap_mode='r') で読み込む。
+    """
+    def __init__(self, store, meta):
+        self.store = store
+        self.meta = meta
+        self.run_id = meta['run_id']
+
+    @property
+    def name(self):
+        return self.meta['name']
+
+    @property
+    def columns(self):
+        return list(self.meta.get('columns', []))
+
+    def __getitem__(self, column):
+        return self.store.load_column(self.run_id, column)
+
+    def __repr__(self):
+        return f"StoredRun({self.run_id!r}, name={self.name!r})"
+
+
+class ResultsStore:
+    """
+    学習結果の列指向ストア。
+
+    root/
+      <run_id>/
+        meta.json        : 実験名, 報酬名, seed, 報酬コードのハッシュ, hparams, 所要時間など
+        metric.npy       : エピソードごとの metric_fn の生値
+        total_reward.npy : エピソードごとの合計報酬
+        q_table.npy      : 学習後のQテーブル
+        eval_*.npy       : 貪欲方策の評価結果（add_columns で後から追加）
+        ...              : その他の列（1列 = 1ファイル、mmapで遅延読み込み可能）
+
+    1 run = 1 ディレクトリで、書き込みは一時ディレクトリからの rename で行うため
+    複数プロセスから同時に保存しても壊れない。
+    """
+    def __init__(self, root="results"):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    # ---- 書き込み ----
+    def save_run(self, experiment, name, columns, meta=None):
+        """
+        Args:
+            experiment: 実験名 (ExperimentRunner.name)
+            name: 報酬関数名 (reward_codes のキー)
+            columns: { 列名: 1次元配列 }
+            meta: 追加のメタデータ（JSONに変換可能なもの）
+        Returns:
+            run_id
+        """
+        run_id = self._new_run_id(experiment, name)
+        tmp_dir = os.path.join(self.root, f".tmp-{run_id}")
+        os.makedirs(tmp_dir)
+
+        saved_columns = []
+        for col, values in columns.items():
+            np.save(os.path.join(tmp_dir, f"{col}.npy"), np.asarray(values))
+            saved_columns.append(col)
+
+        record = dict(meta or {})
+        record.update({
+            'run_id': run_id,
+            'experiment': experiment,
+            'name': name,
+            'created_at': time.time(),
+            'columns': saved_columns,
+        })
+        with open(os.path.join(tmp_dir, "meta.json"), 'w', encoding='utf-8') as f:
+            json.dump(record, f, indent=2, ensure_ascii=False, default=_json_default)
+
+        os.replace(tmp_dir, os.path.join(self.root, run_id))
+        return run_id
+
+    def add_columns(self, run_id, columns, meta=None):
+        """
+        既存の run に列とメタデータを追加する（学習後の評価結果など）。
+        列ファイル・meta.json はそれぞれ一時ファイルからの os.replace で書き換える。
+        """
+        run_dir = os.path.join(self.root, run_id)
+        with open(os.path.join(run_dir, "meta.json"), 'r', encoding='utf-8') as f:
+            record = json.load(f)
+
+        for col, values in columns.items():
+            tmp = os.path.join(run_dir, f".tmp-{col}.npy")
+            np.save(tmp, np.asarray(values))
+            os.replace(tmp, os.path.join(run_dir, f"{col}.npy"))
+            if col not in record['columns']:
+                record['columns'].append(col)
+
+        record.update(meta or {})
+        tmp = os.path.join(run_dir, ".tmp-meta.json")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(record, f, indent=2, ensure_ascii=False, default=_json_default)
+        os.replace(tmp, os.path.join(run_dir, "meta.json"))
+        return StoredRun(self, record)
+
+    def delete_run(self, run_id):
+        shutil.rmtree(os.path.join(self.root, run_id), ignore_errors=True)
+
+    # ---- 読み込み ----
+    def list_runs(self, experiment=None, name=None, **filters):
+        """メタデータの一覧（作成順）。配列はここでは読み込まない"""
+        metas = []
+        if not os.path.isdir(self.root):
+            return metas
+        for entry in os.listdir(self.root):
+            if entry.startswith('.'):
+                continue
+            path = os.path.join(self.root, entry, "meta.json")
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if experiment is not None and meta.get('experiment') != experiment:
+                continue
+            if name is not None and meta.get('name') != name:
+                continue
+            if any(meta.get(k) != v for k, v in filters.items()):
+                continue
+            metas.append(meta)
+        metas.sort(key=lambda m: m.get('created_at', 0))
+        return metas
+
+    def get_run(self, run_id):
+        with open(os.path.join(self.root, run_id, "meta.json"), 'r', encoding='utf-8') as f:
+            return StoredRun(self, json.load(f))
+
+    def runs(self, experiment=None, name=None, **filters):
+        return [StoredRun(self, m) for m in self.list_runs(experiment, name, **filters)]
+
+    def latest_runs(self, experiment, status='ok'):
+        """
+        報酬名ごとに最新のrunを返す { name: StoredRun }。
+        既定では status='ok' のrunだけを見るので、後から失敗したrunが前の成功したrunを隠さない（None なら全状態）。
+        """
+        filters = {'status': status} if status is not None else {}
+        latest = {}
+        for meta in self.list_runs(experiment, **filters):
+            latest[meta['name']] = StoredRun(self, meta)
+        return latest
+
+    def load_column(self, run_id, column, mmap=True):
+        path = os.path.join(self.root, run_id, f"{column}.npy")
+        return np.load(path, mmap_mode='r' if mmap else None)
+
+    def experiments(self):
+        return sorted({m['experiment'] for m in self.list_runs()})
+
+    def _new_run_id(self, experiment, name):
+        slug = re.sub(r"[^0-9A-Za-z._-]+", "_", f"{experiment}__{name}").strip("_")
+        return f"{slug}__{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+def _json_default(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    return str(obj)
+
+
+# ---- ストアからの比較・描画（学習の再実行なし） ----
+
+def compare_runs(store, experiment, column='metric', runs=None):
+    """
+    報酬名ごとに最後の5%区間の平均を集計する（同じ名前のrunが複数あればseed間で平均）。
+    Returns:
+        [{ 'name', 'runs', 'final_mean', 'final_std' }, ...]
+    """
+    if runs is None:
+        runs = store.runs(experiment, status='ok')
+    grouped = {}
+    for run in runs:
+        if column not in run.columns:
+            continue
+        values = run[column]
+        window = default_window(len(values))
+        grouped.setdefault(run.name, []).append(float(np.mean(values[-window:])))
+
+    rows = []
+    for name, finals in grouped.items():
+        rows.append({
+            'name': name,
+            'runs': len(finals),
+            'final_mean': float(np.mean(finals)),
+            'final_std': float(np.std(finals)),
+        })
+    return rows
+
+
+def compare_evaluations(store, experiment, runs=None):
+    """
+    貪欲方策の評価結果（meta の 'evaluation'）を報酬名ごとに集計する。
+    Returns:
+        [{ 'name', 'runs', 'mean', 'ci95', 'median', 'rate' }, ...]
+    """
+    if runs is None:
+        runs = store.runs(experiment, status='ok')
+    grouped = {}
+    for run in runs:
+        evaluation = run.meta.get('evaluation')
+        if evaluation:
+            grouped.setdefault(run.name, []).append(evaluation)
+
+    rows = []
+    for name, evals in grouped.items():
+        rows.append({
+            'name': name,
+            'runs': len(evals),
+            'mean': float(np.mean([e['mean'] for e in evals])),
+            'ci95': float(np.mean([e['ci95'] for e in evals])),
+            'median': float(np.mean([e['median'] for e in evals])),
+            'rate': float(np.mean([e['rate'] for e in evals])) if all('rate' in e for e in evals) else None,
+        })
+    return rows
+
+
+def plot_runs(store, experiment, filename, column='metric', runs=None, ylabel='Metric (Smoothed)'):
+    """
+    ストアのrunを読み込んで平滑化した学習曲線を描画する。
+    pyplotを使わない(Figureを直接作る)ためディスプレイのない環境でも動く。
+    """
+    from matplotlib.figure import Figure
+
+    if runs is None:
+        runs = list(store.latest_runs(experiment).values())
+    runs = [r for r in runs if column in r.columns]
+    if not runs:
+        print(f"[Plot] No stored runs for {experiment}.")
+        return None
+
+    fig = Figure(figsize=(12, 7))
+    ax = fig.add_subplot(1, 1, 1)
+    for run in runs:
+        values = run[column]
+        ax.plot(smooth(values, default_window(len(values))), label=run.name, linewidth=2, alpha=0.9)
+
+    ax.set_xlabel('Episode')
+    ax.set_ylabel(ylabel)
+    ax.set_title(f'{experiment}: Performance Comparison')
+    ax.legend()
+    ax.grid(True, which='both', linestyle='--', alpha=0.3)
+    fig.tight_layout()
+    fig.savefig(filename, dpi=150)
+    print(f"[Plot] Saved to {filename}")
+    return filename
+
+
+def main():
+    parser = argparse.ArgumentParser(description="保存済みの学習結果を比較・描画する")
+    parser.add_argument("root", nargs="?", default="results", help="ResultsStore のディレクトリ")
+    parser.add_argument("--experiment", help="実験名（省略時は一覧表示）")
+    parser.add_argument("--column", default="metric")
+    parser.add_argument("--plot", help="描画先のファイル名")
+    parser.add_argument("--eval", action="store_true", help="学習曲線の代わりに貪欲方策の評価結果を比較する")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.root)
+    if not args.experiment:
+        for exp in store.experiments():
+            print(exp)
+        return
+
+    if args.eval:
+        for row in compare_evaluations(store, args.experiment):
+            rate = f"  success={row['rate']:.1%}" if row['rate'] is not None else ""
+            print(f"{row['name']:40s} runs={row['runs']:3d}  eval={row['mean']:.4f} ± {row['ci95']:.4f}"
+                  f"  median={row['median']:.4f}{rate}")
+        return
+
+    for row in compare_runs(store, args.experiment, column=args.column):
+        print(f"{row['name']:40s} runs={row['runs']:3d}  final={row['final_mean']:.4f} ± {row['final_std']:.4f}")
+    if args.plot:
+        plot_runs(store, args.experiment, args.plot, column=args.column)
+
+
+if __name__ == "__main__":
+    main()
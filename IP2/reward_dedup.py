@@ -0,0 +1,127 @@
+# reward_dedup.py
+import ast
+import re
+import hashlib
+import builtins
+
+_BUILTINS = set(dir(builtins))
+
+
+class _Canonicalizer(ast.NodeTransformer):
+    """
+    docstring を消し、コード内で束縛される名前（引数・変数・定数・補助関数）を出現順に v0, v1, ... に置き換える。
+    compute_reward の関数名、組み込み関数、コード外から来る名前（np など）、属性名・キーワード引数名・文字列はそのまま。
+    """
+    def __init__(self, bound_names, keep=('compute_reward',)):
+        self.bound = set(bound_names) - set(keep)
+        self.mapping = {}
+
+    def _rename(self, name):
+        if name not in self.bound:
+            return name
+        if name not in self.mapping:
+            self.mapping[name] = f"v{len(self.mapping)}"
+        return self.mapping[name]
+
+    def _strip_docstring(self, node):
+        body = node.body
+        if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) \
+                and isinstance(body[0].value.value, str):
+            node.body = body[1:] or [ast.Pass()]
+
+    def visit_Module(self, node):
+        self._strip_docstring(node)
+        return self.generic_visit(node)
+
+    def visit_FunctionDef(self, node):
+        self._strip_docstring(node)
+        node.name = self._rename(node.name)
+        return self.generic_visit(node)
+
+    def visit_Expr(self, node):
+        # 途中に書かれた文字列だけの文（コメント代わり）も消す
+        if isinstance(node.value, ast.Constant) and isinstance(node.value.value, str):
+            return None
+        return self.generic_visit(node)
+
+    def visit_arg(self, node):
+        node.arg = self._rename(node.arg)
+        node.annotation = None
+        return node
+
+    def visit_Name(self, node):
+        node.id = self._rename(node.id)
+        return node
+
+    def visit_alias(self, node):
+        if node.asname:
+            node.asname = self._rename(node.asname)
+        return node
+
+
+def _bound_names(tree):
+    """コード内で代入・定義される名前（組み込み名は除く）"""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(node.id)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.alias) and node.asname:
+            names.add(node.asname)
+    return names - _BUILTINS
+
+
+def normalize_reward_code(code):
+    """
+    報酬コードを比較用の正規形（ソース文字列）にする。
+    空白・コメント・docstring・変数名/定数名の違いは同じ正規形になる。
+    構文エラーのコードは空白だけ正規化した文字列を返す。
+    """
+    if not code:
+        return ""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return re.sub(r"\s+", " ", code).strip()
+    tree = _Canonicalizer(_bound_names(tree)).visit(tree)
+    ast.fix_missing_locations(tree)
+    return ast.unparse(tree)
+
+
+def reward_fingerprint(code):
+    """正規形のハッシュ（code が None/空なら None = デフォルト報酬）"""
+    if not code:
+        return None
+    return hashlib.sha1(normalize_reward_code(code).encode('utf-8')).hexdigest()[:16]
+
+
+def find_duplicates(reward_codes):
+    """
+    正規形が同じ報酬候補をまとめる。先に出てきた名前を残す。
+    Returns:
+        { duplicate_name: kept_name } （デフォルト報酬 None 同士はまとめない）
+    """
+    seen = {}
+    duplicates = {}
+    for name, code in reward_codes.items():
+        fp = reward_fingerprint(code)
+        if fp is None:
+            continue
+        if fp in seen:
+            duplicates[name] = seen[fp]
+        else:
+            seen[fp] = name
+    return duplicates
+
+
+def dedup_rewards(reward_codes):
+    """
+    Returns:
+        (unique, duplicates) : unique は重複を除いた { name: code }、duplicates は find_duplicates の結果
+    """
+    duplicates = find_duplicates(reward_codes)
+    unique = {k: v for k, v in reward_codes.items() if k not in duplicates}
+    return unique, duplicates
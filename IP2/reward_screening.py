@@ -0,0 +1,303 @@
+# reward_screening.py
+import os
+import sys
+import pickle
+import inspect
+import traceback
+import numpy as np
+from envs.wrappers import compile_reward_fn
+
+
+class TrajectorySet:
+    """
+    固定の遷移データ（1行 = 1ステップ）。
+    報酬候補はすべて同じデータの上で評価されるので、環境を動かすのは記録時の1回だけ。
+
+    列:
+        obs, actions, next_obs, rewards(環境のデフォルト報酬), terminated, truncated,
+        infos(dictのリスト), episode_ids
+    記録条件: episodes, seed（record_trajectories で記録したときのエピソード数とシード。不明なら None）
+    """
+    def __init__(self, obs, actions, next_obs, rewards, terminated, truncated, infos, episode_ids,
+                 episodes=None, seed=None):
+        self.obs = obs
+        self.actions = actions
+        self.next_obs = next_obs
+        self.rewards = rewards
+        self.terminated = terminated
+        self.truncated = truncated
+        self.infos = infos
+        self.episode_ids = episode_ids
+        self.episodes = episodes
+        self.seed = seed
+
+    def __len__(self):
+        return len(self.actions)
+
+    @property
+    def num_episodes(self):
+        return int(self.episode_ids[-1]) + 1 if len(self) else 0
+
+    def episode_slices(self):
+        """エピソードごとの slice を返す"""
+        bounds = np.flatnonzero(np.diff(self.episode_ids)) + 1
+        starts = np.concatenate([[0], bounds])
+        ends = np.concatenate([bounds, [len(self)]])
+        return [slice(int(s), int(e)) for s, e in zip(starts, ends)]
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self.__dict__, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        obj = cls.__new__(cls)
+        obj.__dict__.update(data)
+        return obj
+
+
+def record_trajectories(env_factory, episodes=50, seed=0, policy=None):
+    """
+    環境をランダム方策（または policy(obs) -> action）で動かして遷移を記録する。
+    """
+    env = env_factory()
+    env.action_space.seed(seed)
+
+    obs_list, actions, next_obs_list, rewards = [], [], [], []
+    terminated_list, truncated_list, infos, episode_ids = [], [], [], []
+
+    for ep in range(episodes):
+        obs, _ = env.reset(seed=seed if ep == 0 else None)
+        done = False
+        while not done:
+            action = policy(obs) if policy else env.action_space.sample()
+            next_obs, reward, terminated, truncated, info = env.step(action)
+            done = terminated or truncated
+
+            obs_list.append(np.array(obs, dtype=np.float32))
+            actions.append(action)
+            next_obs_list.append(np.array(next_obs, dtype=np.float32))
+            rewards.append(reward)
+            terminated_list.append(terminated)
+            truncated_list.append(truncated)
+            infos.append(dict(info))
+            episode_ids.append(ep)
+            obs = next_obs
+    env.close()
+
+    return TrajectorySet(
+        obs=np.stack(obs_list),
+        actions=np.asarray(actions),
+        next_obs=np.stack(next_obs_list),
+        rewards=np.asarray(rewards, dtype=np.float64),
+        terminated=np.asarray(terminated_list, dtype=bool),
+        truncated=np.asarray(truncated_list, dtype=bool),
+        infos=infos,
+        episode_ids=np.asarray(episode_ids, dtype=np.int32),
+        episodes=episodes,
+        seed=seed,
+    )
+
+
+def load_or_record_trajectories(path, env_factory, episodes=50, seed=0):
+    """
+    path にあれば読み込み、なければ記録して保存する。
+    保存済みの軌跡の記録条件 (episodes, seed) が違えば記録し直して上書きする。
+    """
+    if path and os.path.exists(path):
+        trajectories = TrajectorySet.load(path)
+        recorded = (getattr(trajectories, 'episodes', None), getattr(trajectories, 'seed', None))
+        if recorded == (episodes, seed):
+            return trajectories
+        print(f"[Trajectories] {path} was recorded with episodes={recorded[0]}, seed={recorded[1]}; "
+              f"re-recording with episodes={episodes}, seed={seed}")
+    trajectories = record_trajectories(env_factory, episodes=episodes, seed=seed)
+    if path:
+        trajectories.save(path)
+    return trajectories
+
+
+def relabel_rewards(reward_fn, trajectories, terminated=None):
+    """
+    記録済みの遷移すべてに reward_fn を適用して報酬列を作る。
+    Returns:
+        (rewards, errors) : rewards は float64 配列（例外が出た行は nan）、
+                            errors は [(行番号, traceback文字列), ...]
+    """
+    if terminated is None:
+        terminated = trajectories.terminated
+    rewards = np.empty(len(trajectories), dtype=np.float64)
+    errors = []
+    for i in range(len(trajectories)):
+        try:
+            rewards[i] = float(reward_fn(trajectories.next_obs[i], bool(terminated[i]),
+                                         bool(trajectories.truncated[i]), trajectories.infos[i]))
+        except Exception:
+            rewards[i] = np.nan
+            errors.append((i, traceback.format_exc()))
+    return rewards, errors
+
+
+def screen_reward(code, trajectories, metric_fn=None, metric_sign=None, terminal_sign=None,
+                  min_std=1e-8, max_error_rate=0.0, min_corr=None, check_terminated=True):
+    """
+    報酬候補を記録済み遷移の上で評価し、学習前に不良候補を弾く。
+
+    Args:
+        code: compute_reward のソースコード
+        trajectories: TrajectorySet
+        metric_fn: エピソードのinfoリスト -> 評価値。エピソード収益との相関を計算する
+        metric_sign: +1 なら metric は高いほど良い、-1 なら低いほど良い
+        terminal_sign: -1 なら終了(terminated)は失敗。終了時の報酬が非終了時より低いことを要求する
+        min_std: 報酬の標準偏差がこれ未満なら「定数報酬」として不合格
+        max_error_rate: 例外を出したステップの割合の上限
+        min_corr: (metric_sign * 相関) の下限。Noneなら相関は記録するだけ
+        check_terminated: terminated を反転して報酬が変わるかを stats['terminated_sensitive'] に記録する
+            （記録するだけ。info の値だけで報酬を決める候補も正しいので、終了時の扱いは 5) の符号で判定する）
+    Returns:
+        { 'passed': bool, 'reasons': [...], 'stats': {...}, 'first_traceback': str or None }
+    """
+    report = {'passed': False, 'reasons': [], 'stats': {}, 'first_traceback': None}
+    reasons = report['reasons']
+    stats = report['stats']
+
+    reward_fn = compile_reward_fn(code)
+    if reward_fn is None:
+        reasons.append("compile: compute_reward not found or code failed to execute")
+        return report
+
+    # 1) シグネチャ: compute_reward(obs, terminated, truncated, info)
+    try:
+        inspect.signature(reward_fn).bind(None, False, False, {})
+    except TypeError as e:
+        reasons.append(f"signature: {e}")
+        return report
+    except ValueError:
+        pass  # シグネチャを取得できない callable はそのまま評価する
+
+    # 2) 例外・非有限値
+    rewards, errors = relabel_rewards(reward_fn, trajectories)
+    error_rate = len(errors) / max(len(trajectories), 1)
+    stats['error_rate'] = error_rate
+    if errors:
+        report['first_traceback'] = errors[0][1]
+        if error_rate > max_error_rate:
+            last_line = errors[0][1].strip().splitlines()[-1]
+            reasons.append(f"exception: {error_rate:.1%} of steps raised ({last_line})")
+            return report
+
+    # 例外の行は nan で埋めてあるので除き、関数が返した nan / ±inf だけを数える
+    returned = np.ones(len(rewards), dtype=bool)
+    returned[[i for i, _ in errors]] = False
+    valid = rewards[np.isfinite(rewards)]
+    stats['nonfinite'] = int(np.count_nonzero(~np.isfinite(rewards[returned])))
+    if stats['nonfinite']:
+        reasons.append(f"nonfinite: {stats['nonfinite']} steps returned nan or inf")
+    if len(valid) == 0:
+        reasons.append("nonfinite: no finite reward values")
+        return report
+
+    # 3) 分散（定数報酬の検出）
+    stats['mean'] = float(np.mean(valid))
+    stats['std'] = float(np.std(valid))
+    stats['min'] = float(np.min(valid))
+    stats['max'] = float(np.max(valid))
+    if stats['std'] < min_std:
+        reasons.append(f"constant: reward std {stats['std']:.2e} < {min_std:.0e}")
+
+    # 4) terminated を読んでいるか（フラグを反転して比較。判定には使わない）
+    if check_terminated:
+        # 実際の終了ステップ（終了条件をinfoで再確認する報酬もある）＋ 等間隔の200ステップ
+        sample = np.union1d(np.flatnonzero(trajectories.terminated),
+                            np.linspace(0, len(trajectories) - 1, min(len(trajectories), 200)).astype(int))
+        flipped, _ = relabel_rewards(reward_fn, _Subset(trajectories, sample),
+                                     terminated=~trajectories.terminated[sample])
+        same = np.isclose(flipped, rewards[sample], equal_nan=True)
+        stats['terminated_sensitive'] = bool(not np.all(same))
+
+    # 5) 終了時の報酬の符号
+    term_mask = trajectories.terminated & np.isfinite(rewards)
+    cont_mask = ~trajectories.terminated & np.isfinite(rewards)
+    if term_mask.any() and cont_mask.any():
+        gap = float(np.mean(rewards[term_mask]) - np.mean(rewards[cont_mask]))
+        stats['terminal_gap'] = gap
+        if terminal_sign is not None and np.sign(gap) != np.sign(terminal_sign):
+            reasons.append(f"terminal sign: terminal reward gap {gap:+.3f} has the wrong sign")
+
+    # 6) エピソード収益と metric_fn の相関
+    if metric_fn is not None:
+        returns, metrics = [], []
+        for sl in trajectories.episode_slices():
+            ep_rewards = rewards[sl]
+            if not np.all(np.isfinite(ep_rewards)):
+                continue
+            returns.append(float(np.sum(ep_rewards)))
+            metrics.append(float(metric_fn(trajectories.infos[sl])))
+        if len(returns) >= 3 and np.std(returns) > 0 and np.std(metrics) > 0:
+            corr = float(np.corrcoef(returns, metrics)[0, 1])
+            stats['metric_corr'] = corr
+            if min_corr is not None and metric_sign is not None and corr * metric_sign < min_corr:
+                reasons.append(f"metric: correlation {corr:+.3f} with metric_fn is below {min_corr}")
+
+    report['passed'] = not reasons
+    return report
+
+
+def reward_term_stats(code, trajectories, max_rows=500):
+    """
+    記録済み遷移の上で compute_reward を実行し、関数内の数値ローカル変数（報酬の各項）の大きさを集計する。
+    どの項が報酬を支配しているかを改良プロンプトでLLMに返すのに使う。
+
+    Returns:
+        { 変数名: {'mean_abs', 'std'} } （'return' は報酬そのもの）。コンパイルできなければ {}
+    """
+    reward_fn = compile_reward_fn(code)
+    if reward_fn is None:
+        return {}
+    target = reward_fn.__code__
+    arg_names = set(target.co_varnames[:target.co_argcount])
+    samples = {'return': []}
+
+    def local_tracer(frame, event, arg):
+        if event == 'return':
+            for name, value in frame.f_locals.items():
+                if name in arg_names or isinstance(value, bool):
+                    continue
+                if isinstance(value, (int, float, np.number)):
+                    samples.setdefault(name, []).append(float(value))
+            if isinstance(arg, (int, float, np.number)) and not isinstance(arg, bool):
+                samples['return'].append(float(arg))
+        return local_tracer
+
+    def tracer(frame, event, arg):
+        return local_tracer if frame.f_code is target else None
+
+    rows = np.linspace(0, len(trajectories) - 1, min(len(trajectories), max_rows)).astype(int)
+    previous = sys.gettrace()
+    sys.settrace(tracer)
+    try:
+        relabel_rewards(reward_fn, _Subset(trajectories, rows))
+    finally:
+        sys.settrace(previous)
+
+    stats = {}
+    for name, values in samples.items():
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if len(values):
+            stats[name] = {'mean_abs': float(np.mean(np.abs(values))), 'std': float(np.std(values))}
+    return stats
+
+
+class _Subset:
+    """TrajectorySet の一部の行だけを relabel_rewards に渡すためのビュー"""
+    def __init__(self, trajectories, rows):
+        self.next_obs = trajectories.next_obs[rows]
+        self.truncated = trajectories.truncated[rows]
+        self.infos = [trajectories.infos[i] for i in rows]
+        self.terminated = trajectories.terminated[rows]
+
+    def __len__(self):
+        return len(self.infos)
@@ -31,13 +31,16 @@ def calculate_tracking_error(episode_infos):
     """
     if not episode_infos:
         return 0.0
+    if hasattr(episode_infos, 'column'):
+        # 低アロケーションモード(InfoLog)では列をそのまま使う
+        return np.mean(np.abs(episode_infos.column('x_error')))
     errors = [abs(i.get('x_error', 0)) for i in episode_infos]
     return np.mean(errors)
 
-def make_env():
-    """Wrapperを適用した環境を返すファクトリ関数"""
+def make_env(inplace=False):
+    """Wrapperを適用した環境を返すファクトリ関数（inplace=True で低アロケーションモード）"""
     base = gym.make("CartPole-v1")
-    return SinusoidTrackingWrapper(base)
+    return SinusoidTrackingWrapper(base, inplace=inplace)
 
 # --- 2. プロンプト定義 ---
 
@@ -68,7 +71,8 @@ if __name__ == "__main__":
         discretizer=CartPoleDiscretizer(),
         metric_fn=calculate_tracking_error,
         experiment_name="CartPole Tracking",
-        cache_file="cache_cartpole.json"
+        cache_file="cache_cartpole.json",
+        store="results"
     )
 
     # (A) ベースライン
@@ -93,5 +97,8 @@ def compute_reward(obs, terminated, truncated, info):
     # (C) 実行
     runner.run_experiments(episodes=1000)
 
+    # (C'') 貪欲方策の評価（探索なし・シード固定の同じエピソード列で最終スコアを比較）
+    runner.evaluate_greedy(episodes=1000)
+
     # (D) 結果描画 (誤差の推移)
     runner.plot_results("result_cartpole_error.png")
\ No newline at end of file
@@ -2,6 +2,7 @@
 import numpy as np
 from envs.abstract_sensor_gridworld import AbstractSensorGridWorld
 from experiment_runner import ExperimentRunner
+from training.value_iteration import solve_gridworld
 
 # --- 1. 環境固有の設定 ---
 
@@ -64,11 +65,12 @@ Return ONLY the function code inside ```python ... ```.
 
 if __name__ == "__main__":
     runner = ExperimentRunner(
-        env_factory=lambda: AbstractSensorGridWorld(),
+        env_factory=AbstractSensorGridWorld,
         discretizer=GridWorldDiscretizer(),
         metric_fn=calculate_success,
         experiment_name="GridWorld Navigation",
-        cache_file="cache_gridworld.json"
+        cache_file="cache_gridworld.json",
+        store="results"
     )
 
     # (A) ベースライン
@@ -94,5 +96,12 @@ def compute_reward(obs, terminated, truncated, info):
     # (C) 実行 (GridWorldは学習に時間がかかるのでエピソード数多め推奨)
     runner.run_experiments(episodes=3000)
 
+    # (C'') 貪欲方策の評価（探索なし・シード固定の同じエピソード列で最終スコアを比較）
+    runner.evaluate_greedy(episodes=1000)
+
+    # (C') モデルベースの参照解（位置を完全観測した価値反復）: 学習なしで得られる上界
+    runner.run_reference(solve_gridworld(AbstractSensorGridWorld(), reward="metric"),
+                         name="Optimal(VI, metric)", episodes=3000)
+
     # (D) 結果描画 (成功率の推移)
     runner.plot_results("result_gridworld_success.png")
\ No newline at end of file
@@ -0,0 +1,281 @@
+# sweep.py
+# 設定ファイル(JSON)から (タスク × 報酬候補 × seed × ハイパーパラメータ) をジョブに展開し、
+# ディスク上のキューに置いて全コアで実行する。完了済みのジョブは再起動時に飛ばす。
+#
+# 設定例 (sweep_config.json):
+# {
+#   "store": "results",          # ResultsStore のディレクトリ
+#   "queue": "sweep_queue",      # ジョブキューのディレクトリ
+#   "episodes": 1000,
+#   "seeds": [0, 1, 2],
+#   "hparams": {"lr": [0.1, 0.2]},          # 値のリストの直積に展開。"preset" なら hparam_search のプリセット
+#   "tasks": {
+#     "cooling": {},
+#     "gridworld": {"episodes": 3000},      # タスクごとに上書き可能
+#     "cartpole": {"candidates": ["Default", "LLM_gpt-4o-mini"]}
+#   }
+# }
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import itertools
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+from tasks import get_task
+from results_store import ResultsStore, code_hash, default_window
+from reward_dedup import find_duplicates
+from experiment_runner import make_candidate_env, save_training_run
+from training.q_learning import train_q_learning
+from hparam_search import load_preset
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+
+class JobQueue:
+    """
+    1ジョブ = 1 JSONファイルのキュー。状態の書き換えは親プロセスだけが行い、
+    一時ファイルからの os.replace で書き込むので途中で止まっても壊れない。
+    """
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, job_id):
+        return os.path.join(self.root, f"{job_id}.json")
+
+    def add(self, job):
+        """新しいジョブなら追加して True、既にあれば何もせず False"""
+        if os.path.exists(self._path(job['job_id'])):
+            return False
+        self.save(job)
+        return True
+
+    def save(self, job):
+        path = self._path(job['job_id'])
+        tmp = path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(job, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def update(self, job, **fields):
+        job.update(fields)
+        self.save(job)
+
+    def jobs(self, status=None):
+        result = []
+        for entry in sorted(os.listdir(self.root)):
+            if not entry.endswith(".json"):
+                continue
+            with open(os.path.join(self.root, entry), 'r', encoding='utf-8') as f:
+                job = json.load(f)
+            if status is None or job['status'] == status:
+                result.append(job)
+        return result
+
+    def summary(self):
+        counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        for job in self.jobs():
+            counts[job['status']] = counts.get(job['status'], 0) + 1
+        return counts
+
+
+def make_job_id(task, candidate, code, seed, episodes, hparams):
+    key = json.dumps([task, candidate, code_hash(code), seed, episodes, hparams], sort_keys=True)
+    return f"{task}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}"
+
+
+def _expand_hparams(grid):
+    """{ 'lr': [0.1, 0.2], 'gamma': 0.95 } -> [{'lr': 0.1, 'gamma': 0.95}, {'lr': 0.2, 'gamma': 0.95}]"""
+    if not grid:
+        return [{}]
+    keys = sorted(grid)
+    values = [v if isinstance(v, list) else [v] for v in (grid[k] for k in keys)]
+    return [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+
+
+def expand_jobs(config):
+    """設定からジョブのリストを作る（同じ組み合わせは同じ job_id になる）"""
+    jobs = []
+    for task_name, task_cfg in config['tasks'].items():
+        task_cfg = task_cfg or {}
+        task = get_task(task_name)
+        codes = task.load_reward_codes()
+        candidates = task_cfg.get('candidates') or list(codes)
+        # AST正規化して同じコードの候補は1つだけ学習する
+        duplicates = find_duplicates({c: codes[c] for c in candidates if c in codes})
+        for name, kept in duplicates.items():
+            print(f"[Sweep] {task_name}: candidate {name} is a duplicate of {kept}. Skipping.")
+        episodes = task_cfg.get('episodes', config.get('episodes', 1000))
+        seeds = task_cfg.get('seeds', config.get('seeds', [0]))
+        hparam_grid = task_cfg.get('hparams', config.get('hparams'))
+        hparam_sets = None if hparam_grid == "preset" else _expand_hparams(hparam_grid)
+
+        for candidate in candidates:
+            if candidate not in codes:
+                print(f"[Sweep] {task_name}: candidate {candidate} not in {task.cache_file}. Skipping.")
+                continue
+            if candidate in duplicates:
+                continue
+            code = codes[candidate]
+            candidate_sets = hparam_sets
+            if candidate_sets is None:
+                # 候補ごと（なければタスク全体）のプリセット。どちらもなければデフォルト
+                candidate_sets = [load_preset(task_name, candidate) or {}]
+            for seed, hparams in itertools.product(seeds, candidate_sets):
+                jobs.append({
+                    'job_id': make_job_id(task_name, candidate, code, seed, episodes, hparams),
+                    'task': task_name,
+                    'candidate': candidate,
+                    'code': code,
+                    'seed': seed,
+                    'episodes': episodes,
+                    'hparams': hparams,
+                    'status': PENDING,
+                    'attempts': 0,
+                })
+    return jobs
+
+
+def train_job(job, store_root=None):
+    """
+    ジョブ仕様 (task, code, seed, episodes, hparams) どおりに1回学習する。
+    job に 'warm_start': { 'run_id', ... } があれば、store_root のストアにあるその run の Qテーブルから始める。
+    Returns:
+        (history, train_info, wall_time)
+    """
+    task = get_task(job['task'])
+    q_init = None
+    if job.get('warm_start'):
+        if store_root is None:
+            raise ValueError("warm_start job needs the store that holds the source run")
+        q_init = ResultsStore(store_root).load_column(job['warm_start']['run_id'], 'q_table', mmap=False)
+    env = make_candidate_env(task.env_factory, job['code'])
+    if env is None:
+        raise ValueError("reward function compilation failed")
+
+    t_start = time.time()
+    try:
+        history, train_info = train_q_learning(
+            env,
+            task.discretizer,
+            episodes=job['episodes'],
+            metric_fn=task.metric_fn,
+            verbose=False,
+            seed=job['seed'],
+            return_info=True,
+            hparams=job['hparams'],
+            q_init=q_init
+        )
+    finally:
+        env.close()
+    return history, train_info, time.time() - t_start
+
+
+def save_job_result(store, job, history, train_info, wall_time):
+    """学習結果をストアに保存し、キューに書き戻す結果の辞書を返す"""
+    task = get_task(job['task'])
+    meta = {'warm_start': job['warm_start']} if job.get('warm_start') else {}
+    run_id = save_training_run(store, task.experiment_name, job['candidate'], job['code'],
+                               history, train_info, job['episodes'], job['seed'], wall_time, job_id=job['job_id'], **meta)
+    window = default_window(len(history))
+    return {
+        'status': DONE,
+        'run_id': run_id,
+        'final_score': float(np.mean(history[-window:])),
+        'wall_time': wall_time,
+        'error': None,
+    }
+
+
+def run_job(job, store_root):
+    """
+    1ジョブを実行して結果を ResultsStore に保存する（ワーカープロセス内で呼ばれる）。
+    Returns:
+        { 'status', 'run_id', 'final_score', 'wall_time', 'error' }
+    """
+    try:
+        history, train_info, wall_time = train_job(job, store_root)
+    except Exception:
+        return {'status': FAILED, 'error': traceback.format_exc()}
+    return save_job_result(ResultsStore(store_root), job, history, train_info, wall_time)
+
+
+def run_sweep(config, workers=None, retry_failed=False):
+    """
+    ジョブを展開してキューに登録し、未完了のものを並列に実行する。
+    前回途中で止まった running のジョブは再実行する。
+
+    プールには空いているワーカーの数だけジョブを渡すので、渡したジョブはすぐにワーカーが取り出す。
+    running にするのはそのときだけで、キューの状態は実際に動いているジョブと一致する
+    （途中で止めても、まだ始まっていないジョブは pending のまま残る）。
+    """
+    queue = JobQueue(config.get('queue', "sweep_queue"))
+    store_root = config.get('store', "results")
+    added = sum(queue.add(job) for job in expand_jobs(config))
+
+    todo = [j for j in queue.jobs() if j['status'] in (PENDING, RUNNING) or (retry_failed and j['status'] == FAILED)]
+    print(f"[Sweep] {added} new jobs, {len(todo)} to run ({queue.summary()})")
+    if not todo:
+        return queue
+
+    workers = workers or config.get('workers') or os.cpu_count()
+    t_start = time.time()
+    waiting = list(todo)
+    n_done = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        while waiting or futures:
+            while waiting and len(futures) < workers:
+                job = waiting.pop(0)
+                queue.update(job, status=RUNNING, attempts=job['attempts'] + 1, started_at=time.time())
+                futures[pool.submit(run_job, job, store_root)] = job
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = futures.pop(future)
+                try:
+                    result = future.result()
+                except Exception:
+                    result = {'status': FAILED, 'error': traceback.format_exc()}
+                queue.update(job, finished_at=time.time(), **result)
+
+                n_done += 1
+                label = f"{job['task']}/{job['candidate']} seed={job['seed']} {job['hparams'] or ''}"
+                if result['status'] == DONE:
+                    print(f"  [{n_done}/{len(todo)}] done   {label} -> {result['final_score']:.4f} ({result['wall_time']:.1f}s)")
+                else:
+                    print(f"  [{n_done}/{len(todo)}] FAILED {label}: {result['error'].strip().splitlines()[-1]}")
+
+    print(f"[Sweep] Finished in {time.time() - t_start:.1f}s ({queue.summary()})")
+    return queue
+
+
+def main():
+    parser = argparse.ArgumentParser(description="全タスクの報酬候補 × seed × ハイパーパラメータを一括で学習する")
+    parser.add_argument("config", help="スイープ設定(JSON)のパス")
+    parser.add_argument("--workers", type=int, default=None, help="並列プロセス数（省略時は全コア）")
+    parser.add_argument("--retry-failed", action="store_true", help="失敗したジョブも再実行する")
+    parser.add_argument("--status", action="store_true", help="キューの状態を表示して終了する")
+    args = parser.parse_args()
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    if args.status:
+        queue = JobQueue(config.get('queue', "sweep_queue"))
+        for job in queue.jobs():
+            print(f"{job['status']:8s} {job['job_id']}  {job['task']}/{job['candidate']} seed={job['seed']} {job['hparams']}")
+        print(queue.summary())
+        return
+
+    queue = run_sweep(config, workers=args.workers, retry_failed=args.retry_failed)
+    sys.exit(1 if queue.summary()[FAILED] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# tasks.py
+import os
+import json
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class Task:
+    """
+    タスク（環境 + 離散化 + 評価関数）の定義。
+    ワーカープロセスにはタスク名だけを渡し、get_task(name) で組み立て直す。
+    """
+    def __init__(self, name, experiment_name, env_factory, discretizer, metric_fn, metric_sign, cache_file, prompt):
+        self.name = name
+        self.experiment_name = experiment_name
+        self.env_factory = env_factory
+        self.discretizer = discretizer
+        self.metric_fn = metric_fn
+        self.metric_sign = metric_sign # +1: 高いほど良い, -1: 低いほど良い
+        self.cache_file = cache_file
+        self.prompt = prompt
+
+    def load_reward_codes(self):
+        """キャッシュファイルの報酬候補 { name: code } を読み込む"""
+        if not os.path.exists(self.cache_file):
+            return {}
+        with open(self.cache_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def make_runner(self, **kwargs):
+        from experiment_runner import ExperimentRunner
+        return ExperimentRunner(
+            env_factory=self.env_factory,
+            discretizer=self.discretizer,
+            metric_fn=self.metric_fn,
+            experiment_name=self.experiment_name,
+            cache_file=self.cache_file,
+            **kwargs
+        )
+
+
+def _cooling():
+    import run_cooling
+    return Task(
+        name="cooling",
+        experiment_name="Server Cooling Task",
+        env_factory=run_cooling.ServerCoolingEnv,
+        discretizer=run_cooling.CoolingDiscretizer(),
+        metric_fn=run_cooling.calculate_temp_error,
+        metric_sign=-1,
+        cache_file=os.path.join(_HERE, "cache_cooling.json"),
+        prompt=run_cooling.COOLING_PROMPT,
+    )
+
+
+def _gridworld():
+    import run_gridworld
+    return Task(
+        name="gridworld",
+        experiment_name="GridWorld Navigation",
+        env_factory=run_gridworld.AbstractSensorGridWorld,
+        discretizer=run_gridworld.GridWorldDiscretizer(),
+        metric_fn=run_gridworld.calculate_success,
+        metric_sign=1,
+        cache_file=os.path.join(_HERE, "cache_gridworld.json"),
+        prompt=run_gridworld.GRID_PROMPT,
+    )
+
+
+def _cartpole():
+    import run_cartpole
+    return Task(
+        name="cartpole",
+        experiment_name="CartPole Tracking",
+        env_factory=run_cartpole.make_env,
+        discretizer=run_cartpole.CartPoleDiscretizer(),
+        metric_fn=run_cartpole.calculate_tracking_error,
+        metric_sign=-1,
+        cache_file=os.path.join(_HERE, "cache_cartpole.json"),
+        prompt=run_cartpole.CARTPOLE_PROMPT,
+    )
+
+
+TASKS = {
+    'cooling': _cooling,
+    'gridworld': _gridworld,
+    'cartpole': _cartpole,
+}
+
+_loaded = {}
+
+
+def get_task(name):
+    """タスク名から Task を返す（プロセスごとに1回だけ組み立てる）"""
+    if name not in TASKS:
+        raise KeyError(f"Unknown task: {name} (available: {', '.join(TASKS)})")
+    if name not in _loaded:
+        _loaded[name] = TASKS[name]()
+    return _loaded[name]
@@ -0,0 +1,5 @@
+# テストはモジュールを IP2 直下から import する（スクリプトと同じく cwd = IP2 の前提）
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
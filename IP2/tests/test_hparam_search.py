@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from hparam_search import (_pick_best, load_preset, population_based_training, random_search,
+                           save_preset, train_segment)
+from training.q_learning import epsilon_at, resolve_hparams
+
+HPARAMS = {'lr': 0.1, 'gamma': 0.95, 'eps_decay': 0.97, 'min_eps': 0.01}
+
+
+def test_random_search_rejects_budget_smaller_than_trials():
+    with pytest.raises(ValueError, match="too small"):
+        random_search("cooling", budget=4, trials=8, workers=1)
+
+
+def test_random_search_small_budget():
+    result = random_search("cooling", budget=16, trials=2, workers=1)
+    assert result['episodes_used'] == 16
+    assert len(result['trials']) == 2
+    assert np.isfinite(result['best']['score'])
+    assert result['best']['score'] == max(t['score'] for t in result['trials'])
+
+
+def test_pick_best_skips_nonfinite_scores():
+    trials = [{'hparams': {'lr': 0.1}, 'score': np.nan}, {'hparams': {'lr': 0.2}, 'score': -3.0},
+              {'hparams': {'lr': 0.3}, 'score': np.inf}]
+    assert _pick_best(trials)['hparams'] == {'lr': 0.2}
+    with pytest.raises(ValueError, match="finite"):
+        _pick_best([{'hparams': {}, 'score': np.nan}])
+
+
+def test_pbt_best_is_scored_over_the_whole_lineage():
+    with pytest.raises(ValueError, match="too small"):
+        population_based_training("cooling", budget=4, population=4, interval=2, workers=1)
+    result = population_based_training("cooling", budget=32, population=2, interval=4, workers=1)
+    assert result['episodes_used'] == 32
+    assert len(result['events']) == 3
+    assert result['best']['score'] == max(t['score'] for t in result['trials'])
+
+
+def test_preset_round_trip(tmp_path):
+    path = str(tmp_path / "presets.json")
+    assert load_preset("cooling", path=path) is None
+    save_preset("cooling", {'method': 'random', 'budget': 16, 'best': {'hparams': HPARAMS, 'score': -1.0}},
+                path=path)
+    tuned = dict(HPARAMS, lr=0.3)
+    save_preset("cooling", {'method': 'pbt', 'budget': 16, 'best': {'hparams': tuned, 'score': -0.5}},
+                candidate="Simple", path=path)
+    assert load_preset("cooling", path=path) == HPARAMS
+    assert load_preset("cooling", candidate="Simple", path=path) == tuned
+    assert load_preset("cooling", candidate="Other", path=path) == HPARAMS
+
+
+def test_segments_carry_epsilon():
+    _, _, one_run = train_segment("cooling", None, HPARAMS, 6, seed=0)
+    assert one_run == pytest.approx(epsilon_at(resolve_hparams(HPARAMS), 6))
+
+    _, q_table, epsilon = train_segment("cooling", None, HPARAMS, 3, seed=0)
+    _, _, carried = train_segment("cooling", None, HPARAMS, 3, seed=1, q_init=q_table, epsilon=epsilon)
+    assert carried == pytest.approx(one_run)
+
+    # explore で eps_decay を変えると、引き継いだ epsilon から新しい減衰率で続く
+    slower = dict(HPARAMS, eps_decay=0.99)
+    _, _, after = train_segment("cooling", None, slower, 3, seed=1, q_init=q_table, epsilon=epsilon)
+    assert after == pytest.approx(epsilon * 0.99 ** 3)
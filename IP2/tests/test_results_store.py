@@ -0,0 +1,47 @@
+import numpy as np
+
+from results_store import ResultsStore, compare_runs
+
+
+def test_save_and_load_round_trip(tmp_path):
+    store = ResultsStore(str(tmp_path))
+    metric = np.linspace(0, 1, 100)
+    run_id = store.save_run("exp", "Default", {'metric': metric, 'length': np.arange(100)},
+                            {'status': 'ok', 'seed': 3, 'hparams': {'lr': np.float64(0.1)}})
+
+    run = store.get_run(run_id)
+    assert run.name == "Default"
+    assert run.meta['seed'] == 3
+    assert run.meta['hparams'] == {'lr': 0.1}
+    assert sorted(run.columns) == ['length', 'metric']
+    np.testing.assert_array_equal(run['metric'], metric)
+    assert not [e for e in tmp_path.iterdir() if e.name.startswith('.tmp-')]
+
+    store.add_columns(run_id, {'eval_metric': np.ones(5)}, {'evaluation': {'mean': 1.0}})
+    run = store.get_run(run_id)
+    assert 'eval_metric' in run.columns
+    assert run.meta['evaluation'] == {'mean': 1.0}
+
+
+def test_latest_runs_picks_newest_per_name(tmp_path):
+    store = ResultsStore(str(tmp_path))
+    store.save_run("exp", "A", {'metric': np.zeros(10)}, {'status': 'ok'})
+    newer = store.save_run("exp", "A", {'metric': np.ones(10)}, {'status': 'ok'})
+    other = store.save_run("exp", "B", {'metric': np.ones(10)}, {'status': 'ok'})
+    store.save_run("other", "A", {'metric': np.ones(10)}, {'status': 'ok'})
+
+    latest = store.latest_runs("exp")
+    assert set(latest) == {'A', 'B'}
+    assert latest['A'].run_id == newer
+    assert latest['B'].run_id == other
+
+
+def test_failed_run_does_not_hide_successful_run(tmp_path):
+    store = ResultsStore(str(tmp_path))
+    ok = store.save_run("exp", "A", {'metric': np.ones(10), 'q_table': np.zeros((2, 3))}, {'status': 'ok'})
+    failed = store.save_run("exp", "A", {}, {'status': 'failed', 'error': "RewardFunctionError"})
+
+    assert store.latest_runs("exp")['A'].run_id == ok
+    assert store.latest_runs("exp", status=None)['A'].run_id == failed
+    assert store.latest_runs("exp", status='failed')['A'].run_id == failed
+    assert [row['name'] for row in compare_runs(store, "exp")] == ['A']
@@ -0,0 +1,131 @@
+import pytest
+
+import llm_calllog
+import LLMapi_openrouter
+from experiment_runner import ExperimentRunner, batch_prompt, extract_code_blocks, validate_reward_code
+from tasks import get_task
+
+SAME_A = "```python\ndef compute_reward(obs, terminated, truncated, info):\n    target = 55.0\n    return -abs(info['temp'] - target)\n```"
+SAME_B = "```python\ndef compute_reward(o, te, tr, info):\n    # same as A\n    t = 55.0\n\n    return -abs(info['temp'] - t)\n```"
+
+
+class FakeLLM:
+    """call_llm_samples の代わりに決まった応答を返し、呼び出し回数を数える"""
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = []
+
+    def __call__(self, prompt, n=1, **kwargs):
+        self.calls.append({'prompt': prompt, 'n': n, **kwargs})
+        return [self.responses[i % len(self.responses)] for i in range(n)]
+
+
+@pytest.fixture
+def fake_llm(monkeypatch, tmp_path):
+    def install(responses):
+        fake = FakeLLM(responses)
+        monkeypatch.setattr(LLMapi_openrouter, "call_llm_samples", fake)
+        return fake
+    monkeypatch.setattr(llm_calllog, "DEFAULT_LOG_PATH", str(tmp_path / "calls.jsonl"))
+    monkeypatch.setattr("time.sleep", lambda sec: None)
+    return install
+
+
+def _runner(cache_file):
+    task = get_task('cooling')
+    return ExperimentRunner(task.env_factory, task.discretizer, task.metric_fn, cache_file=str(cache_file), store=None)
+
+
+def test_all_duplicate_model_is_not_queried_again(fake_llm, tmp_path):
+    fake = fake_llm([SAME_B])
+    cache = tmp_path / "cache.json"
+    runner = _runner(cache)
+    runner.add_manual_reward("Manual", SAME_A.strip('`').removeprefix('python\n'))
+    runner.generate_llm_rewards("prompt", ["x/m1"], n_samples=2)
+    assert runner.duplicates == {'LLM_m1#1': 'Manual', 'LLM_m1#2': 'Manual'}
+    assert len(fake.calls) == 1
+
+    rerun = _runner(cache)
+    assert rerun.duplicates == runner.duplicates
+    rerun.generate_llm_rewards("prompt", ["x/m1"], n_samples=2)
+    assert len(fake.calls) == 1
+
+    rerun.generate_llm_rewards("prompt", ["x/m1"], n_samples=2, force_regenerate=True)
+    assert len(fake.calls) == 2
+
+
+def _block(body):
+    return f"```python\n{body}\n```"
+
+
+VARIANT_1 = "def compute_reward(obs, terminated, truncated, info):\n    return -abs(info['temp'] - 55.0)"
+VARIANT_2 = "def compute_reward(o, t, tr, i):\n    # same as variant 1\n    return -abs(i['temp'] - 55.0)"
+VARIANT_3 = "def compute_reward(obs, terminated, truncated):\n    return 0.0"
+VARIANT_4 = "def compute_reward(obs, terminated, truncated, info):\n    return -(info['temp'] - 55.0) ** 2"
+BATCH_RESPONSE = "\n".join([
+    "Here are the variants.",
+    "Variant 1:", _block(VARIANT_1),
+    "Variant 2:", _block(VARIANT_2),
+    "Variant 3:", _block(VARIANT_3),
+    "Variant 4:", _block(VARIANT_4),
+    "Extra:", _block("def compute_reward(obs, terminated, truncated, info):\n    return 0.5"),
+])
+
+
+def test_extract_code_blocks_keeps_order():
+    blocks = extract_code_blocks(BATCH_RESPONSE)
+    assert blocks[:4] == [VARIANT_1, VARIANT_2, VARIANT_3, VARIANT_4]
+    assert len(blocks) == 5
+    assert extract_code_blocks("no code here") == []
+
+
+@pytest.mark.parametrize("code, expected", [
+    (VARIANT_1, None),
+    (VARIANT_3, "compute_reward takes 3 arguments (expected 4)"),
+    ("def compute_reward(obs, terminated, truncated, info):\n    return (", "syntax error"),
+    ("def reward(obs, terminated, truncated, info):\n    return 0", "'def compute_reward' not found"),
+])
+def test_validate_reward_code(code, expected):
+    error = validate_reward_code(code)
+    if expected is None:
+        assert error is None
+    else:
+        assert error.startswith(expected)
+
+
+def test_batched_variants_are_split_validated_and_deduplicated(fake_llm, tmp_path):
+    fake = fake_llm([BATCH_RESPONSE])
+    runner = _runner(tmp_path / "cache.json")
+    runner.generate_llm_rewards("prompt", ["x/m1"], variants_per_call=4)
+
+    assert len(fake.calls) == 1
+    assert fake.calls[0]['n'] == 1
+    assert fake.calls[0]['prompt'] == batch_prompt("prompt", 4)
+    assert runner.reward_codes == {'LLM_m1_v1': VARIANT_1, 'LLM_m1_v4': VARIANT_4}
+    assert runner.duplicates == {'LLM_m1_v2': 'LLM_m1_v1'}
+
+    runner.generate_llm_rewards("prompt", ["x/m1"], variants_per_call=4)
+    assert len(fake.calls) == 1
+
+
+def test_batched_variants_with_several_samples(fake_llm, tmp_path):
+    fake_llm([BATCH_RESPONSE])
+    runner = _runner(tmp_path / "cache.json")
+    runner.generate_llm_rewards("prompt", ["x/m1"], n_samples=2, variants_per_call=2)
+    # 2つ目のサンプルは1つ目と同じコードなので全部重複になる
+    assert runner.reward_codes == {'LLM_m1#1_v1': VARIANT_1}
+    assert runner.duplicates == {'LLM_m1#1_v2': 'LLM_m1#1_v1', 'LLM_m1#2_v1': 'LLM_m1#1_v1',
+                                 'LLM_m1#2_v2': 'LLM_m1#1_v1'}
+
+
+def test_force_regenerate_drops_stale_variants(fake_llm, tmp_path):
+    fake = fake_llm([BATCH_RESPONSE])
+    runner = _runner(tmp_path / "cache.json")
+    runner.generate_llm_rewards("prompt", ["x/m1"], variants_per_call=4)
+    assert set(runner.reward_codes) == {'LLM_m1_v1', 'LLM_m1_v4'}
+
+    # 2回目は1つしか返さない: 前回の v2〜v4 は残らず、v1 は自分自身の重複扱いにならない
+    fake.responses = [_block(VARIANT_4)]
+    runner.generate_llm_rewards("prompt", ["x/m1"], variants_per_call=4, force_regenerate=True)
+    assert runner.reward_codes == {'LLM_m1_v1': VARIANT_4}
+    assert runner.duplicates == {}
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from reward_screening import TrajectorySet, load_or_record_trajectories, screen_reward
+from run_cooling import ServerCoolingEnv
+
+
+def _trajectories(steps=200, episode_len=50, seed=0):
+    """obs[0] が温度 (20..80) の合成データ。各エピソードの最後のステップが terminated"""
+    rng = np.random.default_rng(seed)
+    obs = rng.uniform(20, 80, size=(steps, 2))
+    next_obs = rng.uniform(20, 80, size=(steps, 2))
+    episode_ids = np.arange(steps) // episode_len
+    terminated = np.zeros(steps, dtype=bool)
+    terminated[episode_len - 1::episode_len] = True
+    return TrajectorySet(obs, rng.integers(0, 3, steps), next_obs, np.zeros(steps), terminated,
+                         np.zeros(steps, dtype=bool), [{} for _ in range(steps)], episode_ids)
+
+
+GOOD = """
+def compute_reward(obs, terminated, truncated, info):
+    return -abs(obs[0] - 50) - (10.0 if terminated else 0.0)
+"""
+
+
+def test_good_reward_passes():
+    report = screen_reward(GOOD, _trajectories())
+    assert report['passed'], report['reasons']
+    assert report['stats']['nonfinite'] == 0
+
+
+@pytest.mark.parametrize("value", ["float('nan')", "float('inf')", "-float('inf')"])
+def test_nonfinite_reward_is_rejected(value):
+    code = f"""
+def compute_reward(obs, terminated, truncated, info):
+    if obs[0] > 60:
+        return {value}
+    return -abs(obs[0] - 50) - (10.0 if terminated else 0.0)
+"""
+    trajectories = _trajectories()
+    report = screen_reward(code, trajectories)
+    assert not report['passed']
+    assert report['stats']['nonfinite'] == int(np.count_nonzero(trajectories.next_obs[:, 0] > 60))
+    assert any(r.startswith("nonfinite") for r in report['reasons'])
+
+
+def test_exception_rows_are_not_counted_as_nonfinite():
+    code = """
+def compute_reward(obs, terminated, truncated, info):
+    if obs[0] > 79:
+        raise ValueError("boom")
+    return -abs(obs[0] - 50) - (10.0 if terminated else 0.0)
+"""
+    report = screen_reward(code, _trajectories(), max_error_rate=0.5)
+    assert report['stats']['error_rate'] > 0
+    assert report['stats']['nonfinite'] == 0
+    assert report['first_traceback'] is not None
+
+
+def test_constant_reward_is_rejected():
+    code = """
+def compute_reward(obs, terminated, truncated, info):
+    return 1.0
+"""
+    report = screen_reward(code, _trajectories())
+    assert not report['passed']
+    assert any(r.startswith("constant") for r in report['reasons'])
+
+
+def test_reward_ignoring_terminated_is_not_rejected():
+    # 温度だけで決まる報酬（run_cooling.py の Baseline(Simple) と同じ形）
+    code = """
+def compute_reward(obs, terminated, truncated, info):
+    if 50 <= obs[0] <= 60: return 1.0
+    return -1.0
+"""
+    report = screen_reward(code, _trajectories())
+    assert report['passed'], report['reasons']
+    assert report['stats']['terminated_sensitive'] is False
+    assert screen_reward(GOOD, _trajectories())['stats']['terminated_sensitive'] is True
+
+
+def test_terminal_sign_is_still_checked():
+    code = """
+def compute_reward(obs, terminated, truncated, info):
+    return -abs(obs[0] - 50) + (100.0 if terminated else 0.0)
+"""
+    report = screen_reward(code, _trajectories(), terminal_sign=-1)
+    assert not report['passed']
+    assert any(r.startswith("terminal sign") for r in report['reasons'])
+
+
+def test_saved_trajectories_are_rerecorded_when_settings_change(tmp_path):
+    path = str(tmp_path / "trajectories.pkl")
+    first = load_or_record_trajectories(path, ServerCoolingEnv, episodes=2, seed=0)
+    assert (first.num_episodes, first.episodes, first.seed) == (2, 2, 0)
+
+    cached = load_or_record_trajectories(path, ServerCoolingEnv, episodes=2, seed=0)
+    assert len(cached) == len(first)
+
+    more = load_or_record_trajectories(path, ServerCoolingEnv, episodes=3, seed=0)
+    assert more.num_episodes == 3
+    assert load_or_record_trajectories(path, ServerCoolingEnv, episodes=3, seed=1).seed == 1
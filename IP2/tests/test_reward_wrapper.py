@@ -0,0 +1,101 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from envs.wrappers import RewardFunctionError
+from experiment_runner import ExperimentRunner, make_candidate_env
+from run_cooling import CoolingDiscretizer, ServerCoolingEnv, calculate_temp_error
+
+ALWAYS_FAILS = """
+def compute_reward(obs, terminated, truncated, info):
+    raise ValueError("boom")
+"""
+
+# 5ステップに1回だけ失敗する（エラー率 20%）
+SOMETIMES_FAILS = """
+def compute_reward(obs, terminated, truncated, info, calls=[0]):
+    calls[0] += 1
+    if calls[0] % 5 == 0:
+        raise KeyError("temp")
+    return -abs(info['temp'] - 55.0)
+"""
+
+
+def _step_until_error(env, steps):
+    env.reset(seed=0)
+    for i in range(steps):
+        _, _, terminated, truncated, _ = env.step(env.action_space.sample())
+        if terminated or truncated:
+            env.reset()
+    return i + 1
+
+
+def test_trips_after_max_errors():
+    env = make_candidate_env(ServerCoolingEnv, ALWAYS_FAILS, max_reward_errors=7)
+    with pytest.raises(RewardFunctionError) as excinfo:
+        _step_until_error(env, 100)
+    assert excinfo.value.errors == 7
+    assert excinfo.value.calls == 7
+    assert "ValueError: boom" in excinfo.value.first_traceback
+
+
+def test_trips_on_error_rate_after_min_calls():
+    env = make_candidate_env(ServerCoolingEnv, SOMETIMES_FAILS, max_reward_errors=None, max_reward_error_rate=0.1)
+    with pytest.raises(RewardFunctionError) as excinfo:
+        _step_until_error(env, 1000)
+    assert excinfo.value.calls == 100  # min_calls に達した時点で打ち切る
+    assert excinfo.value.errors == 20
+
+
+def test_disabled_budget_falls_back_to_default_reward():
+    env = make_candidate_env(ServerCoolingEnv, ALWAYS_FAILS, max_reward_errors=None, max_reward_error_rate=None)
+    assert _step_until_error(env, 300) == 300
+    assert env.errors == 300
+
+
+def test_error_survives_pickle():
+    error = RewardFunctionError("failed", first_traceback="tb", errors=3, calls=9)
+    restored = pickle.loads(pickle.dumps(error))
+    assert (str(restored), restored.first_traceback, restored.errors, restored.calls) == ("failed", "tb", 3, 9)
+    # AsyncVectorEnv は exctype(value) で作り直す
+    rebuilt = RewardFunctionError(error)
+    assert (rebuilt.first_traceback, rebuilt.errors) == ("tb", 3)
+
+
+def test_runner_records_failure_with_budget(tmp_path):
+    runner = ExperimentRunner(ServerCoolingEnv, CoolingDiscretizer(), calculate_temp_error,
+                              cache_file=str(tmp_path / "cache.json"), store=str(tmp_path / "results"))
+    runner.add_manual_reward("Default", None)
+    runner.add_manual_reward("Broken", ALWAYS_FAILS)
+    runner.run_experiments(episodes=5, max_reward_errors=3)
+
+    assert set(runner.failures) == {'Broken'}
+    assert "failed 3 times" in runner.failures['Broken']['error']
+    failed = runner.store.latest_runs(runner.name, status='failed')['Broken']
+    assert failed.meta['max_reward_errors'] == 3
+    assert set(runner.store.latest_runs(runner.name)) == {'Default'}
+    assert np.isfinite(runner.store.latest_runs(runner.name)['Default']['metric']).all()
+
+
+def test_evaluate_greedy_ignores_training_error_budget(tmp_path):
+    runner = ExperimentRunner(ServerCoolingEnv, CoolingDiscretizer(), calculate_temp_error,
+                              cache_file=str(tmp_path / "cache.json"), store=str(tmp_path / "results"))
+    runner.add_manual_reward("Flaky", SOMETIMES_FAILS)
+    runner.run_experiments(episodes=5, max_reward_errors=None, max_reward_error_rate=None)
+    assert 'Flaky' in runner.results
+
+    evaluations = runner.evaluate_greedy(episodes=4, num_envs=2)
+    assert np.isfinite(evaluations['Flaky']['summary']['mean'])
+
+
+def test_successful_retrain_clears_failure(tmp_path):
+    runner = ExperimentRunner(ServerCoolingEnv, CoolingDiscretizer(), calculate_temp_error,
+                              cache_file=str(tmp_path / "cache.json"), store=None)
+    runner.add_manual_reward("Flaky", SOMETIMES_FAILS)
+    runner.run_experiments(episodes=5, max_reward_error_rate=0.1)
+    assert set(runner.failures) == {'Flaky'} and 'Flaky' not in runner.results
+
+    runner.run_experiments(episodes=5, max_reward_errors=None, max_reward_error_rate=None)
+    assert 'Flaky' in runner.results
+    assert runner.failures == {}
@@ -0,0 +1,51 @@
+import pytest
+
+import sweep
+from sweep import JobQueue, run_sweep, PENDING, RUNNING, DONE
+
+
+@pytest.fixture
+def config(tmp_path):
+    return {
+        'store': str(tmp_path / "results"),
+        'queue': str(tmp_path / "queue"),
+        'episodes': 5,
+        'seeds': [0, 1, 2],
+        'hparams': {},
+        'tasks': {'cooling': {'candidates': ["Default"]}},
+    }
+
+
+def test_resume_skips_done_jobs(config):
+    queue = run_sweep(config, workers=1)
+    jobs = queue.jobs()
+    assert len(jobs) == 3
+    assert all(j['status'] == DONE and j['attempts'] == 1 for j in jobs)
+    run_ids = {j['job_id']: j['run_id'] for j in jobs}
+
+    # 途中で止まった状態を作る: 1つは実行中のまま、1つは未着手
+    interrupted, untouched = jobs[0], jobs[1]
+    queue.update(interrupted, status=RUNNING)
+    queue.update(untouched, status=PENDING, attempts=0)
+
+    queue = run_sweep(config, workers=1)
+    by_id = {j['job_id']: j for j in queue.jobs()}
+    assert all(j['status'] == DONE for j in by_id.values())
+    assert by_id[interrupted['job_id']]['attempts'] == 2
+    assert by_id[untouched['job_id']]['attempts'] == 1
+    assert by_id[jobs[2]['job_id']]['run_id'] == run_ids[jobs[2]['job_id']]
+    assert by_id[interrupted['job_id']]['run_id'] != run_ids[interrupted['job_id']]
+
+
+def test_only_picked_up_jobs_are_marked_running(config, monkeypatch):
+    running_counts = []
+    update = JobQueue.update
+
+    def recording_update(self, job, **fields):
+        update(self, job, **fields)
+        running_counts.append(self.summary()[RUNNING])
+
+    monkeypatch.setattr(sweep.JobQueue, "update", recording_update)
+    run_sweep(config, workers=1)
+    assert max(running_counts) == 1
+    assert running_counts[-1] == 0
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from experiment_runner import ExperimentRunner
+from run_cooling import CoolingDiscretizer, ServerCoolingEnv, calculate_temp_error
+from training.q_learning import initial_q_table, train_q_learning
+
+
+class CoarseCoolingDiscretizer(CoolingDiscretizer):
+    """CoolingDiscretizer より温度のビンが少ない（Qテーブルの形が違う）"""
+    def __init__(self):
+        super().__init__()
+        self.bins_temp = np.linspace(20, 100, 4)
+        self.shape = (len(self.bins_temp), len(self.bins_load))
+
+
+def _runner(tmp_path, discretizer=None):
+    runner = ExperimentRunner(ServerCoolingEnv, discretizer or CoolingDiscretizer(), calculate_temp_error,
+                              experiment_name="Warm", cache_file=str(tmp_path / "cache.json"),
+                              store=str(tmp_path / "results"))
+    runner.add_manual_reward("Default", None)
+    runner.add_manual_reward("Simple", """
+def compute_reward(obs, terminated, truncated, info):
+    return 1.0 if 50 <= info['temp'] <= 60 else -1.0
+""")
+    return runner
+
+
+def test_initial_q_table_copies_and_checks_shape():
+    assert not initial_q_table((2, 3)).any()
+    source = np.arange(6, dtype=np.float64).reshape(2, 3)
+    table = initial_q_table((2, 3), source)
+    np.testing.assert_array_equal(table, source)
+    table[0, 0] = 99.0
+    assert source[0, 0] == 0.0
+    with pytest.raises(ValueError, match="does not match"):
+        initial_q_table((3, 2), source)
+
+
+def test_train_q_learning_rejects_mismatched_q_init():
+    env = ServerCoolingEnv()
+    with pytest.raises(ValueError, match="does not match"):
+        train_q_learning(env, CoolingDiscretizer(), episodes=1, verbose=False, seed=0, q_init=np.zeros((2, 2, 2)))
+
+
+def test_warm_start_from_stored_run(tmp_path):
+    first = _runner(tmp_path)
+    first.run_experiments(episodes=5, names=["Default"])
+    source_run = first.run_ids["Default"]
+
+    second = _runner(tmp_path)
+    second.run_experiments(episodes=5, names=["Simple"], warm_start="Default", warm_start_epsilon=0.3)
+    meta = second.store.get_run(second.run_ids["Simple"]).meta
+    assert meta['warm_start'] == {'source': "Default", 'run_id': source_run, 'epsilon': 0.3}
+    assert meta['hparams']['epsilon'] == 0.3
+
+
+def test_warm_start_with_different_shape_trains_from_scratch(tmp_path):
+    _runner(tmp_path).run_experiments(episodes=5, names=["Default"])
+
+    coarse = _runner(tmp_path, CoarseCoolingDiscretizer())
+    coarse.run_experiments(episodes=5, names=["Simple"], warm_start="Default")
+    meta = coarse.store.get_run(coarse.run_ids["Simple"]).meta
+    assert 'warm_start' not in meta
+    assert coarse.q_tables["Simple"].shape[:-1] == CoarseCoolingDiscretizer().shape
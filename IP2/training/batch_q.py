@@ -0,0 +1,48 @@
+import numpy as np
+
+
+def discretize_transitions(obs, discretizer):
+    """
+    観測の配列 (N, obs_dim) を discretizer で離散化し、(N, len(shape)) の int 配列を返す
+    """
+    return np.array([discretizer(o) for o in obs], dtype=np.int64).reshape(len(obs), -1)
+
+
+def batch_q_iteration(states, actions, next_states, rewards, terminated, shape, n_actions,
+                      gamma=0.95, iterations=200, tol=1e-6):
+    """
+    固定の遷移データに対するテーブル型のバッチQ反復（fitted Q iteration）。
+    各(s, a)のQ値を「その(s, a)から出た遷移の TD ターゲットの平均」で一括更新する。
+
+    Args:
+        states, next_states: (N, len(shape)) の離散状態インデックス
+        actions: (N,) 行動
+        rewards: (N,) 報酬（報酬候補ごとに差し替える列）
+        terminated: (N,) bool。truncated はブートストラップするので含めない
+        shape: discretizer.shape
+        n_actions: 行動数
+    Returns:
+        (q_table, counts) : q_table は shape + (n_actions,)、counts は (s, a) ごとの遷移数
+    """
+    n_states = int(np.prod(shape))
+    s = np.ravel_multi_index(tuple(np.asarray(states).T), shape)
+    ns = np.ravel_multi_index(tuple(np.asarray(next_states).T), shape)
+    sa = s * n_actions + np.asarray(actions, dtype=np.int64)
+
+    counts = np.bincount(sa, minlength=n_states * n_actions)
+    visited = counts > 0
+    not_done = 1.0 - np.asarray(terminated, dtype=np.float64)
+    rewards = np.asarray(rewards, dtype=np.float64)
+
+    q = np.zeros(n_states * n_actions)
+    for _ in range(iterations):
+        v_next = q.reshape(n_states, n_actions).max(axis=1)[ns]
+        target = rewards + gamma * not_done * v_next
+        new_q = np.zeros_like(q)
+        new_q[visited] = np.bincount(sa, weights=target, minlength=len(q))[visited] / counts[visited]
+        delta = np.max(np.abs(new_q - q))
+        q = new_q
+        if delta < tol:
+            break
+
+    return q.reshape(tuple(shape) + (n_actions,)), counts.reshape(tuple(shape) + (n_actions,))
@@ -0,0 +1,138 @@
+import numpy as np
+from envs.records import InfoRecord, InfoLog
+from training.q_learning import flat_states, split_vector_info, append_infos, vector_step_counts
+
+
+def greedy_policy(q_table, discretizer):
+    """Qテーブルから貪欲方策 policy(obs) -> action を作る"""
+    def policy(obs):
+        return int(np.argmax(q_table[discretizer(obs)]))
+    return policy
+
+
+def run_policy_episodes(env_factory, policy, episodes=20, metric_fn=None, seed=None):
+    """
+    方策を固定したまま（学習なし）エピソードを実行する。
+    policy が bind(env) を持つ場合（環境の真の状態を参照する参照解など）は環境に結びつけてから使う。
+
+    Returns:
+        エピソードごとの metric_fn の値（metric_fn がなければ合計報酬）のリスト
+    """
+    env = env_factory()
+    if hasattr(policy, 'bind'):
+        policy = policy.bind(env)
+    history = []
+    info_log = None
+    for ep in range(episodes):
+        obs, _ = env.reset(seed=seed if (seed is not None and ep == 0) else None)
+        done = False
+        total_reward = 0
+        episode_infos = info_log.clear() if info_log is not None else []
+        while not done:
+            obs, reward, terminated, truncated, info = env.step(policy(obs))
+            done = terminated or truncated
+            total_reward += reward
+            if info_log is None and isinstance(info, InfoRecord):
+                info_log = episode_infos = InfoLog(info.fields)
+            append_infos(episode_infos, info)
+        history.append(metric_fn(episode_infos) if metric_fn else total_reward)
+    env.close()
+    return history
+
+
+def summarize_metric(values):
+    """
+    評価値の分布を要約する。値がすべて 0/1 なら成功率として 'rate' も入れる。
+    Returns:
+        { 'episodes', 'mean', 'std', 'ci95', 'min', 'p05', 'p25', 'median', 'p75', 'p95', 'max' (, 'rate') }
+    """
+    values = np.asarray(values, dtype=np.float64)
+    p05, p25, median, p75, p95 = np.percentile(values, [5, 25, 50, 75, 95])
+    summary = {
+        'episodes': int(len(values)),
+        'mean': float(np.mean(values)),
+        'std': float(np.std(values)),
+        'ci95': float(1.96 * np.std(values, ddof=1) / np.sqrt(len(values))) if len(values) > 1 else 0.0,
+        'min': float(np.min(values)),
+        'p05': float(p05),
+        'p25': float(p25),
+        'median': float(median),
+        'p75': float(p75),
+        'p95': float(p95),
+        'max': float(np.max(values)),
+    }
+    if np.all((values == 0) | (values == 1)):
+        summary['rate'] = summary['mean']
+    return summary
+
+
+def evaluate_q_table(env_factory, q_table, discretizer, episodes=1000, metric_fn=None, seed=0, num_envs=16,
+                     asynchronous=False):
+    """
+    Qテーブルの貪欲方策（探索なし・学習なし）をシード固定のベクトル環境でまとめて評価する。
+    学習中の history は探索(epsilon)込みの値なので、最終スコアの比較にはこちらを使う。
+
+    エピソードはサブ環境ごとに episodes / num_envs 回ずつ割り当てる
+    （先に終わったエピソードから数えると短いエピソードに偏るため）。
+
+    Args:
+        env_factory: () -> gym.Env（報酬ラッパー込みでもよい）
+        seed: サブ環境 i は seed + i でリセットされ、同じ seed なら同じエピソード列になる
+        num_envs: サブ環境の数
+        asynchronous: True ならサブプロセスの AsyncVectorEnv で動かす
+    Returns:
+        { 'metric', 'total_reward', 'length' (エピソードごとの配列), 'summary': summarize_metric(metric) }
+    """
+    import gymnasium as gym
+
+    num_envs = max(1, min(num_envs, episodes))
+    quota = np.full(num_envs, episodes // num_envs)
+    quota[:episodes % num_envs] += 1
+
+    env_fns = [env_factory] * num_envs
+    env = gym.vector.AsyncVectorEnv(env_fns) if asynchronous else gym.vector.SyncVectorEnv(env_fns)
+    q_flat = q_table.reshape(-1, q_table.shape[-1])
+
+    results = [[] for _ in range(num_envs)] # サブ環境ごとの (metric, total_reward, length)
+    ep_reward = np.zeros(num_envs)
+    ep_length = np.zeros(num_envs, dtype=np.int64)
+    ep_infos = [[] for _ in range(num_envs)]
+    finished = np.zeros(num_envs, dtype=np.int64)
+    resetting = np.zeros(num_envs, dtype=bool) # NEXT_STEP の自動リセット: 終了の次の step はリセットだけ
+
+    obs, _ = env.reset(seed=seed)
+    states = flat_states(discretizer, obs)
+    try:
+        while np.any(finished < quota):
+            actions = np.argmax(q_flat[states], axis=1)
+            obs, rewards, terminated, truncated, info = env.step(actions)
+            done = terminated | truncated
+            active = ~resetting & (finished < quota)
+
+            ep_reward[active] += rewards[active]
+            ep_length[active] += vector_step_counts(info, num_envs)[active]
+            if metric_fn:
+                for i in np.flatnonzero(active):
+                    append_infos(ep_infos[i], split_vector_info(info, i))
+
+            for i in np.flatnonzero(done & active):
+                value = metric_fn(ep_infos[i]) if metric_fn else float(ep_reward[i])
+                results[i].append((float(value), float(ep_reward[i]), int(ep_length[i])))
+                finished[i] += 1
+                ep_reward[i] = 0.0
+                ep_length[i] = 0
+                ep_infos[i] = []
+
+            states = flat_states(discretizer, obs)
+            resetting = done
+    finally:
+        env.close()
+
+    rows = [row for env_rows in results for row in env_rows]
+    metric = np.array([r[0] for r in rows], dtype=np.float64)
+    return {
+        'metric': metric,
+        'total_reward': np.array([r[1] for r in rows], dtype=np.float64),
+        'length': np.array([r[2] for r in rows], dtype=np.int32),
+        'summary': summarize_metric(metric),
+    }
@@ -0,0 +1,178 @@
+import time
+import queue
+import traceback
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import cloudpickle
+import numpy as np
+from training.q_learning import resolve_hparams, epsilon_at, run_q_episode, initial_q_table
+from training.seeding import spawn_seeds, make_rngs
+from envs.records import InfoLog
+from envs.wrappers import ActionRepeatWrapper, RewardFunctionError
+
+
+def _hogwild_worker(worker_id, task_payload, hparams, action_repeat, seed, shm_name, shape, counter, episodes, results):
+    """
+    ワーカープロセス: 共有のQテーブルにロックなしで書き込みながらエピソードを回す。
+    エピソード番号は共有カウンタから1つずつ取り、その番号に対応する epsilon を使う
+    （全ワーカー合計のエピソード数で単一プロセスと同じ減衰になる）。
+    task_payload は cloudpickle した (env_factory, discretizer, metric_fn)。
+    """
+    shm = None
+    q_table = None
+    try:
+        env_factory, discretizer, metric_fn = cloudpickle.loads(task_payload)
+        shm = shared_memory.SharedMemory(name=shm_name)
+        q_table = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        rng, env_seed, action_seed = make_rngs(seed)
+        env = env_factory()
+        if action_repeat > 1 and not hasattr(env, 'repeat'):
+            env = ActionRepeatWrapper(env, action_repeat)
+        if action_seed is not None:
+            env.action_space.seed(action_seed)
+        env.reset(seed=env_seed)
+        gamma = hparams['gamma'] ** action_repeat
+
+        rows = [] # (エピソード番号, metric, total_reward, length, episode_time)
+        info_log = None
+        while True:
+            with counter.get_lock():
+                episode = counter.value
+                if episode >= episodes:
+                    break
+                counter.value += 1
+
+            t_start = time.perf_counter()
+            episode_infos = info_log.clear() if info_log is not None else []
+            total_reward, episode_infos = run_q_episode(env, discretizer, q_table, epsilon_at(hparams, episode),
+                                                        hparams['lr'], gamma, rng, episode_infos)
+            if isinstance(episode_infos, InfoLog):
+                info_log = episode_infos
+            value = metric_fn(episode_infos) if metric_fn else total_reward
+            rows.append((episode, float(value), float(total_reward), len(episode_infos),
+                         time.perf_counter() - t_start))
+        env.close()
+        results.put(('ok', worker_id, rows))
+    except RewardFunctionError as e:
+        # 報酬関数の打ち切りは呼び出し側で候補の失敗として扱えるよう、例外のまま返す
+        _stop_others(counter, episodes)
+        results.put(('error', worker_id, e))
+    except Exception:
+        _stop_others(counter, episodes)
+        results.put(('error', worker_id, traceback.format_exc()))
+    finally:
+        q_table = None # 共有メモリを参照する配列を先に手放さないと close できない
+        if shm is not None:
+            shm.close()
+
+
+def _stop_others(counter, episodes):
+    """カウンタを使い切らせて、他のワーカーを今のエピソードの終わりで止める"""
+    with counter.get_lock():
+        counter.value = max(counter.value, episodes)
+
+
+def train_q_learning_hogwild(env_factory, discretizer, episodes=2000, workers=None, verbose=True, metric_fn=None,
+                             seed=None, return_info=False, hparams=None, action_repeat=1, q_init=None,
+                             start_method=None):
+    """
+    1つの報酬候補のQテーブルを複数プロセスで学習する（Hogwild: ロックなしの共有メモリ更新）。
+    各ワーカーは自分の環境のコピーでエピソードを回し、multiprocessing.shared_memory 上の
+    1つのQテーブルに直接TD更新を書き込む。
+
+    Args:
+        env_factory: () -> gym.Env。ワーカーごとに1つ作る。discretizer・metric_fn と一緒に cloudpickle で
+            ワーカーに送るので、spawn / forkserver でもラムダやクロージャを渡せる
+        discretizer: .shape を持つ離散化関数
+        episodes: 全ワーカー合計のエピソード数
+        workers: プロセス数（省略時は全コア）
+        seed: ワーカーごとの乱数は SeedSequence で seed から分ける
+        hparams, action_repeat, q_init: train_q_learning と同じ
+        start_method: multiprocessing の開始方法（'fork' / 'spawn' / 'forkserver'。省略時はOSのデフォルト）
+    Returns:
+        train_q_learning と同じ。history はエピソード番号（epsilon の順）に並べ直した全ワーカー分の値で、
+        return_info=True なら info に 'worker'（各エピソードを回したワーカー番号）と 'workers' も入る。
+        同時書き込みで一部の更新が失われうるので、同じ seed でも結果は完全には再現しない。
+        どれかのワーカーが失敗（RewardFunctionError など）すると、他のワーカーも今のエピソードの終わりで止めて例外を送出する。
+    """
+    hparams = resolve_hparams(hparams)
+    workers = workers or mp.cpu_count()
+    if not hasattr(discretizer, 'shape'):
+        raise ValueError("discretizer function must have a 'shape' attribute (tuple of bin sizes).")
+
+    env = env_factory()
+    shape = discretizer.shape + (env.action_space.n,)
+    env.close()
+
+    ctx = mp.get_context(start_method)
+    shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * np.dtype(np.float64).itemsize)
+    q_table = None
+    procs = []
+    try:
+        q_table = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        q_table[...] = initial_q_table(shape, q_init)
+        counter = ctx.Value('l', 0)
+        results = ctx.Queue()
+        task_payload = cloudpickle.dumps((env_factory, discretizer, metric_fn))
+        seeds = spawn_seeds(seed, workers) if seed is not None else [None] * workers
+
+        t_start = time.time()
+        procs = [
+            ctx.Process(target=_hogwild_worker,
+                        args=(i, task_payload, hparams, action_repeat, seeds[i], shm.name, shape, counter, episodes,
+                              results),
+                        daemon=True)
+            for i in range(workers)
+        ]
+        for p in procs:
+            p.start()
+
+        # 結果はプロセス終了前に受け取る（キューが詰まって join が返らなくなるのを避ける）
+        rows, errors = [], []
+        remaining = workers
+        while remaining:
+            try:
+                status, worker_id, payload = results.get(timeout=1.0)
+            except queue.Empty:
+                if not any(p.is_alive() for p in procs) and results.empty():
+                    raise RuntimeError("Hogwild worker exited without reporting results")
+                continue
+            remaining -= 1
+            if status == 'ok':
+                rows.extend((episode, worker_id) + tuple(r) for episode, *r in payload)
+            else:
+                errors.append(payload)
+        for p in procs:
+            p.join()
+        if errors:
+            if isinstance(errors[0], RewardFunctionError):
+                raise errors[0]
+            raise RuntimeError(f"Hogwild worker failed:\n{errors[0]}")
+
+        rows.sort()
+        history = [r[2] for r in rows]
+        if verbose:
+            window = min(200, len(history))
+            print(f"[Hogwild] {episodes} episodes with {workers} workers in {time.time() - t_start:.1f}s, "
+                  f"Avg Metric (last {window}): {np.mean(history[-window:]):.2f}")
+
+        if return_info:
+            info = {
+                'total_reward': np.asarray([r[3] for r in rows], dtype=np.float64),
+                'length': np.asarray([r[4] for r in rows], dtype=np.int32),
+                'episode_time': np.asarray([r[5] for r in rows], dtype=np.float64),
+                'worker': np.asarray([r[1] for r in rows], dtype=np.int16),
+                'hparams': hparams,
+                'workers': workers,
+                'q_table': q_table.copy(),
+            }
+            return history, info
+        return history
+    finally:
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+        q_table = None # 共有メモリを参照する配列を先に手放さないと close できない
+        shm.close()
+        shm.unlink()
@@ -1,6 +1,140 @@
+import time
 import numpy as np
+from training.seeding import make_rngs
+from envs.records import InfoRecord, InfoLog
 
-def train_q_learning(env, discretizer, episodes=2000, verbose=True, metric_fn=None):
+# 学習ハイパーパラメータ（結果ストアにもこの値が記録される）
+DEFAULT_HPARAMS = {
+    'lr': 0.1,
+    'gamma': 0.95,
+    'epsilon': 1.0,
+    'eps_decay': 0.995,
+    'min_eps': 0.01,
+}
+
+def resolve_hparams(hparams=None):
+    """DEFAULT_HPARAMS に上書き分をマージする（未知のキーはエラー）"""
+    merged = dict(DEFAULT_HPARAMS)
+    if hparams:
+        unknown = set(hparams) - set(DEFAULT_HPARAMS)
+        if unknown:
+            raise ValueError(f"Unknown hyperparameters: {sorted(unknown)}")
+        merged.update(hparams)
+    return merged
+
+def is_vector_env(env):
+    """gymnasium.vector の環境かどうか（gymnasium.vector をimportせずに属性で判定する）"""
+    return hasattr(env, 'num_envs') and hasattr(env, 'single_action_space')
+
+def split_vector_info(info, index):
+    """
+    ベクトル環境の info（キーごとの配列 + '_key' の有効マスク）から index 番目のサブ環境の dict を取り出す。
+    SAME_STEP モードの final_obs / final_info は含めない。
+    """
+    env_info = {}
+    for key, value in info.items():
+        if key.startswith('_') or key in ('final_obs', 'final_info'):
+            continue
+        mask = info.get('_' + key)
+        if mask is not None and not mask[index]:
+            continue
+        env_info[key] = split_vector_info(value, index) if isinstance(value, dict) else value[index]
+    return env_info
+
+def flat_states(discretizer, obs_batch):
+    """ベクトル環境の観測バッチを、Qテーブルを (状態数, 行動数) に reshape したときの行番号に変換する"""
+    if hasattr(discretizer, 'batch'):
+        # まとめて変換できる離散化器（AdaptiveDiscretizer など）は観測ごとに呼ばない
+        return np.ravel_multi_index(discretizer.batch(obs_batch).T, discretizer.shape)
+    return np.ravel_multi_index(np.array([discretizer(o) for o in obs_batch]).T, discretizer.shape)
+
+def append_infos(episode_infos, info):
+    """
+    エピソードのログに info を追加する。
+    ActionRepeatWrapper の info なら、内側の各ステップの info をすべて追加する。
+    """
+    inner = info.get('repeat_infos') if type(info) is dict else None
+    if inner is None:
+        episode_infos.append(info)
+    else:
+        episode_infos.extend(inner)
+
+def vector_step_counts(info, num_envs):
+    """
+    ベクトル環境の1回の step で各サブ環境が進めた実ステップ数
+    （ActionRepeatWrapper の 'repeat_steps'。なければ 1）
+    """
+    steps = np.ones(num_envs, dtype=np.int64)
+    if 'repeat_steps' in info:
+        mask = info.get('_repeat_steps', np.ones(num_envs, dtype=bool))
+        steps[mask] = info['repeat_steps'][mask]
+    return steps
+
+def epsilon_at(hparams, episode):
+    """
+    episode 回のエピソードが終わった時点の epsilon。
+    train_q_learning の「min_eps を超えている間だけ eps_decay を掛ける」減衰と同じ値になる。
+    """
+    epsilon = hparams['epsilon']
+    eps_decay = hparams['eps_decay']
+    min_eps = hparams['min_eps']
+    if epsilon <= min_eps or eps_decay >= 1.0:
+        return epsilon
+    # min_eps 以下になる最初の回数までで減衰が止まる
+    stop = int(np.ceil(np.log(min_eps / epsilon) / np.log(eps_decay)))
+    return epsilon * eps_decay ** min(episode, max(stop, 0))
+
+def run_q_episode(env, discretizer, q_table, epsilon, lr, gamma, rng, episode_infos):
+    """
+    1エピソード分 epsilon-greedy で行動し、q_table をその場で更新する。
+    env が InfoRecord を返す場合は episode_infos を InfoLog に置き換える。
+
+    Returns:
+        (total_reward, episode_infos)
+    """
+    obs, _ = env.reset()
+    # 状態に対応するQ値の行(ビュー)を持ち回り、(state + (action,)) のタプルを毎ステップ作らない
+    q_row = q_table[discretizer(obs)]
+    total_reward = 0
+    done = False
+
+    while not done:
+        if rng.random() < epsilon:
+            action = env.action_space.sample()
+        else:
+            action = np.argmax(q_row)
+
+        next_obs, reward, terminated, truncated, info = env.step(action)
+        done = terminated or truncated
+
+        next_row = q_table[discretizer(next_obs)]
+        
+        # Q値更新
+        old_value = q_row[action]
+        next_max = np.max(next_row)
+        q_row[action] = (1 - lr) * old_value + lr * (reward + gamma * next_max)
+
+        q_row = next_row
+        total_reward += reward
+        if not isinstance(episode_infos, InfoLog) and isinstance(info, InfoRecord):
+            # 再利用される info は参照を溜められないので、事前確保したログに値を書き写す
+            episode_infos = InfoLog(info.fields)
+        append_infos(episode_infos, info)
+    return total_reward, episode_infos
+
+def initial_q_table(shape, q_init=None):
+    """
+    学習開始時のQテーブル。q_init（別の run の学習済みQテーブル）があればそのコピーから始める（ウォームスタート）。
+    """
+    if q_init is None:
+        return np.zeros(shape)
+    q_init = np.asarray(q_init, dtype=np.float64)
+    if q_init.shape != tuple(shape):
+        raise ValueError(f"q_init shape {q_init.shape} does not match the Q-table shape {tuple(shape)}")
+    return q_init.copy()
+
+def train_q_learning(env, discretizer, episodes=2000, verbose=True, metric_fn=None, seed=None, return_info=False,
+                     hparams=None, action_repeat=1, q_init=None):
     """
     汎用Q学習関数
     
@@ -8,9 +142,44 @@ def train_q_learning(env, discretizer, episodes=2000, verbose=True, metric_fn=No
         env: Gymnasium環境
         discretizer: 観測(obs)を受け取り、タプルのインデックスを返す関数
         metric_fn: (オプション) 報酬以外に記録したい指標を計算する関数 func(info_history) -> float
+        seed: (オプション) 乱数シード。SeedSequence で学習・環境・行動サンプリング用の独立なストリームに分ける
+        return_info: Trueなら (history, info) を返す。
+            info は エピソードごとの生データ(total_reward, length, episode_time)、hparams、
+            学習後のQテーブル(q_table)を持つ辞書
+        hparams: (オプション) DEFAULT_HPARAMS の一部を上書きする辞書 (lr, gamma, epsilon, eps_decay, min_eps)
+        action_repeat: (オプション) 2以上なら同じ行動を action_repeat ステップ続けるマクロステップで学習する。
+            単一環境は ActionRepeatWrapper で包み、割引率は gamma ** action_repeat を使う。
+            ベクトル環境はサブ環境を包んでおくこと（make_candidate_env(action_repeat=...)）
+        q_init: (オプション) 初期Qテーブル（同じ離散化・行動数で学習した別の run のもの）。
+            ウォームスタートでは探索をやり直さないよう hparams の epsilon も下げておく
+
+    env に gymnasium.vector の SyncVectorEnv / AsyncVectorEnv を渡すと、全サブ環境の行動をまとめて選び、
+    共有のQテーブルをバッチで更新する。episodes は全サブ環境で終了したエピソードの合計数で、
+    history は終了した順に並ぶ。
+
+    報酬関数のエラーが LLMRewardWrapper の許容範囲を超えると、env.step が投げる RewardFunctionError で
+    学習はその場で止まる（捕まえずに呼び出し側へ伝える）。
     """
+    hparams = resolve_hparams(hparams)
+
+    # グローバルな np.random は使わない（並列ワーカー間で相関・非決定性が出ないように）
+    rng, env_seed, action_seed = make_rngs(seed)
+    if action_seed is not None:
+        env.action_space.seed(action_seed)
+
+    # マクロステップ1回で action_repeat ステップ進むので、その分割り引く
+    gamma = hparams['gamma'] ** action_repeat
+
+    if is_vector_env(env):
+        return _train_q_learning_vector(env, discretizer, episodes, verbose, metric_fn, return_info,
+                                        hparams, gamma, rng, env_seed, q_init)
+
+    if action_repeat > 1 and not hasattr(env, 'repeat'):
+        from envs.wrappers import ActionRepeatWrapper # 学習経路のimportを軽くするため使うときだけ読み込む
+        env = ActionRepeatWrapper(env, action_repeat)
+
     # Qテーブルのサイズを自動特定するために一度ダミー実行してshapeを取得
-    obs_dummy, _ = env.reset()
+    obs_dummy, _ = env.reset(seed=env_seed)
     state_dummy = discretizer(obs_dummy)
     
     # 状態のビン数(tupleの要素ごとの最大値+1)を知る必要があるが、
@@ -20,45 +189,26 @@ def train_q_learning(env, discretizer, episodes=2000, verbose=True, metric_fn=No
         raise ValueError("discretizer function must have a 'shape' attribute (tuple of bin sizes).")
         
     q_table_shape = discretizer.shape + (env.action_space.n,)
-    q_table = np.zeros(q_table_shape)
+    q_table = initial_q_table(q_table_shape, q_init)
 
-    lr = 0.1
-    gamma = 0.95
-    epsilon = 1.0
-    eps_decay = 0.995
-    min_eps = 0.01
+    lr = hparams['lr']
+    epsilon = hparams['epsilon']
+    eps_decay = hparams['eps_decay']
+    min_eps = hparams['min_eps']
 
     history = [] # 報酬またはメトリクスの履歴
+    total_rewards = []
+    lengths = []
+    episode_times = []
+    info_log = None # env が InfoRecord を返す場合に使い回すログ
 
     for episode in range(episodes):
-        obs, _ = env.reset()
-        state = discretizer(obs)
-        total_reward = 0
-        done = False
-        
+        t_start = time.perf_counter()
         # メトリクス計算用のログ
-        episode_infos = []
-
-        while not done:
-            if np.random.uniform(0, 1) < epsilon:
-                action = env.action_space.sample()
-            else:
-                action = np.argmax(q_table[state])
-
-            next_obs, reward, terminated, truncated, info = env.step(action)
-            done = terminated or truncated
-
-            next_state = discretizer(next_obs)
-            
-            # Q値更新
-            old_value = q_table[state + (action,)]
-            next_max = np.max(q_table[next_state])
-            new_value = (1 - lr) * old_value + lr * (reward + gamma * next_max)
-            q_table[state + (action,)] = new_value
-
-            state = next_state
-            total_reward += reward
-            episode_infos.append(info)
+        episode_infos = info_log.clear() if info_log is not None else []
+        total_reward, episode_infos = run_q_episode(env, discretizer, q_table, epsilon, lr, gamma, rng, episode_infos)
+        if isinstance(episode_infos, InfoLog):
+            info_log = episode_infos
 
         if epsilon > min_eps:
             epsilon *= eps_decay
@@ -70,8 +220,139 @@ def train_q_learning(env, discretizer, episodes=2000, verbose=True, metric_fn=No
         else:
             history.append(total_reward)
 
+        total_rewards.append(total_reward)
+        lengths.append(len(episode_infos))
+        episode_times.append(time.perf_counter() - t_start)
+
         if verbose and (episode + 1) % 200 == 0:
             avg_val = np.mean(history[-200:])
             print(f"Episode {episode+1}/{episodes}, Avg Metric: {avg_val:.2f}, Epsilon: {epsilon:.3f}")
 
-    return history
\ No newline at end of file
+    if return_info:
+        info = {
+            'total_reward': np.asarray(total_rewards, dtype=np.float64),
+            'length': np.asarray(lengths, dtype=np.int32),
+            'episode_time': np.asarray(episode_times, dtype=np.float64),
+            'hparams': hparams,
+            'q_table': q_table,
+        }
+        return history, info
+    return history
+
+
+def _train_q_learning_vector(env, discretizer, episodes, verbose, metric_fn, return_info, hparams, gamma, rng,
+                             env_seed, q_init=None):
+    """
+    train_q_learning のベクトル環境版。
+    自動リセットは NEXT_STEP（終了の次の step はリセットだけで、その遷移は学習に使わない）と
+    SAME_STEP（終了時の観測・info は final_obs / final_info に入る）の両方に対応する。
+    """
+    mode = env.metadata.get('autoreset_mode')
+    mode = getattr(mode, 'value', mode) or "NextStep" # 古い gymnasium は NEXT_STEP 固定
+    if mode not in ("NextStep", "SameStep"):
+        raise ValueError(f"Unsupported autoreset mode for vector training: {mode}")
+    same_step = mode == "SameStep"
+
+    if not hasattr(discretizer, 'shape'):
+        raise ValueError("discretizer function must have a 'shape' attribute (tuple of bin sizes).")
+
+    num_envs = env.num_envs
+    n_actions = env.single_action_space.n
+    q_table = initial_q_table(discretizer.shape + (n_actions,), q_init)
+    q_flat = q_table.reshape(-1, n_actions) # 状態をフラットな番号にしたビュー
+
+    lr = hparams['lr']
+    epsilon = hparams['epsilon']
+    eps_decay = hparams['eps_decay']
+    min_eps = hparams['min_eps']
+
+    history = []
+    total_rewards = []
+    lengths = []
+    episode_times = []
+
+    # サブ環境ごとの実行中エピソードの集計
+    ep_reward = np.zeros(num_envs)
+    ep_length = np.zeros(num_envs, dtype=np.int64)
+    ep_infos = [[] for _ in range(num_envs)]
+    ep_start = [time.perf_counter()] * num_envs
+    resetting = np.zeros(num_envs, dtype=bool) # NEXT_STEP: この step はリセットだけのサブ環境
+
+    obs, _ = env.reset(seed=env_seed)
+    states = flat_states(discretizer, obs)
+
+    while len(history) < episodes:
+        actions = np.argmax(q_flat[states], axis=1)
+        explore = rng.random(num_envs) < epsilon
+        if explore.any():
+            actions[explore] = rng.integers(n_actions, size=int(explore.sum()))
+
+        next_obs, rewards, terminated, truncated, info = env.step(actions)
+        done = terminated | truncated
+
+        # 終了したサブ環境の遷移先は、リセット後ではなく終了時の観測
+        final_obs = next_obs
+        if same_step and done.any():
+            final_obs = next_obs.copy()
+            for i in np.flatnonzero(done):
+                final_obs[i] = info['final_obs'][i]
+        next_states = flat_states(discretizer, final_obs)
+
+        # Q値更新（同じ (state, action) がバッチ内に複数あれば差分を足し合わせる）
+        active = ~resetting
+        s, a = states[active], actions[active]
+        target = rewards[active] + gamma * q_flat[next_states[active]].max(axis=1)
+        np.add.at(q_flat, (s, a), lr * (target - q_flat[s, a]))
+
+        steps = vector_step_counts(info, num_envs)
+        if same_step and done.any() and 'final_info' in info:
+            final_steps = vector_step_counts(info['final_info'], num_envs)
+            steps[done] = final_steps[done]
+        ep_reward[active] += rewards[active]
+        ep_length[active] += steps[active]
+        if metric_fn:
+            for i in np.flatnonzero(active):
+                src = info['final_info'] if same_step and done[i] else info
+                append_infos(ep_infos[i], split_vector_info(src, i))
+
+        for i in np.flatnonzero(done & active):
+            if metric_fn:
+                history.append(metric_fn(ep_infos[i]))
+            else:
+                history.append(float(ep_reward[i]))
+            total_rewards.append(float(ep_reward[i]))
+            lengths.append(int(ep_length[i]))
+            now = time.perf_counter()
+            episode_times.append(now - ep_start[i])
+
+            ep_reward[i] = 0.0
+            ep_length[i] = 0
+            ep_infos[i] = []
+            ep_start[i] = now
+
+            if epsilon > min_eps:
+                epsilon *= eps_decay
+            if verbose and len(history) % 200 == 0:
+                avg_val = np.mean(history[-200:])
+                print(f"Episode {len(history)}/{episodes}, Avg Metric: {avg_val:.2f}, Epsilon: {epsilon:.3f}")
+            if len(history) >= episodes:
+                break
+
+        if same_step and done.any():
+            states = flat_states(discretizer, next_obs)
+        else:
+            states = next_states
+        if not same_step:
+            resetting = done
+
+    if return_info:
+        info = {
+            'total_reward': np.asarray(total_rewards, dtype=np.float64),
+            'length': np.asarray(lengths, dtype=np.int32),
+            'episode_time': np.asarray(episode_times, dtype=np.float64),
+            'hparams': hparams,
+            'num_envs': num_envs,
+            'q_table': q_table,
+        }
+        return history, info
+    return history
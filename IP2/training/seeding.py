@@ -0,0 +1,24 @@
+import numpy as np
+
+
+def spawn_seeds(root_seed, n):
+    """
+    ルートシードから SeedSequence で互いに独立な n 個のシード(int)を作る。
+    並列ワーカーや複数seedの実行に1つずつ渡せば、グローバルRNGを共有せずに再現性が保てる。
+    root_seed=None ならOSのエントロピーから作る。
+    """
+    children = np.random.SeedSequence(root_seed).spawn(n)
+    return [int(c.generate_state(1, dtype=np.uint64)[0]) for c in children]
+
+
+def make_rngs(seed):
+    """
+    学習1回分の乱数ストリームを作る。
+    Returns:
+        (rng, env_seed, action_seed) : rng は学習側の np.random.Generator、
+        env_seed / action_seed は env.reset / action_space.seed に渡すシード
+    """
+    if seed is None:
+        return np.random.default_rng(), None, None
+    trainer_seed, env_seed, action_seed = spawn_seeds(seed, 3)
+    return np.random.default_rng(trainer_seed), env_seed, action_seed
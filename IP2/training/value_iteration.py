@@ -0,0 +1,195 @@
+import numpy as np
+
+
+def value_iteration(P, R, gamma=0.95, tol=1e-8, max_iter=10000):
+    """
+    ベクトル化した価値反復。
+
+    Args:
+        P: (S, A, S) 遷移確率。終了遷移の確率は行から除いておく（行和 < 1 で吸収状態を表す）
+        R: (S, A) 期待即時報酬
+    Returns:
+        (policy, V, Q) : policy は (S,) の最適行動
+    """
+    n_states, n_actions = R.shape
+    V = np.zeros(n_states)
+    for _ in range(max_iter):
+        Q = R + gamma * np.einsum('sat,t->sa', P, V)
+        new_V = Q.max(axis=1)
+        if np.max(np.abs(new_V - V)) < tol:
+            V = new_V
+            break
+        V = new_V
+    Q = R + gamma * np.einsum('sat,t->sa', P, V)
+    return Q.argmax(axis=1), V, Q
+
+
+class StatePolicy:
+    """
+    状態インデックスの表で表された方策。
+    state_fn(env, obs) -> 表のインデックス で状態を求める（観測ではなく環境の真の状態を使う場合もある）。
+    """
+    def __init__(self, table, state_fn):
+        self.table = table
+        self.state_fn = state_fn
+
+    def bind(self, env):
+        """環境に結びつけて policy(obs) -> action を返す"""
+        return lambda obs: int(self.table[self.state_fn(env, obs)])
+
+
+def _digitize(values, bins):
+    """Discretizer と同じ規則 (digitize - 1 を [0, len(bins)-1] にクリップ)"""
+    return np.clip(np.digitize(values, bins) - 1, 0, len(bins) - 1)
+
+
+def _bin_points(bins, low, high, resolution):
+    """各ビンに落ちる代表点（[low, high] の細かい格子を各ビンに振り分ける）"""
+    grid = np.linspace(low, high, resolution)
+    idx = _digitize(grid, bins)
+    return [grid[idx == i] for i in range(len(bins))]
+
+
+def _cooling_default_reward(env, next_temp, action, terminated):
+    in_band = (next_temp >= env.target_temp_low) & (next_temp <= env.target_temp_high)
+    reward = np.where(in_band, 1.0 - 0.1 * action, -0.1 * np.abs(next_temp - 55.0))
+    return np.where(terminated, -100.0, reward)
+
+
+def _cooling_metric_reward(env, next_temp, action, terminated):
+    # calculate_temp_error（55度からの誤差）をそのまま最小化する
+    return np.where(terminated, -100.0, -np.abs(next_temp - 55.0))
+
+
+def build_cooling_mdp(env, discretizer, reward="default", resolution=161, noise_points=9):
+    """
+    ServerCoolingEnv のダイナミクスと CoolingDiscretizer のビンから離散MDPを作る。
+
+    各離散状態 (温度ビン, 負荷ビン) の中の代表点について、発熱ノイズ（Gauss-Hermite求積）と
+    負荷変動（一様整数）のすべての組み合わせを一括で計算し、次状態のビンに集計する。
+
+    Args:
+        env: ServerCoolingEnv（パラメータの参照のみ）
+        discretizer: bins_temp, bins_load を持つ離散化器
+        reward: "default"（環境のデフォルト報酬）, "metric"（温度誤差）, または
+                callable(env, next_temp, action, terminated) -> 配列
+    Returns:
+        (P, R) : P は (S, A, S)、R は (S, A)。S = prod(discretizer.shape)
+    """
+    reward_fn = {'default': _cooling_default_reward, 'metric': _cooling_metric_reward}.get(reward, reward)
+    bins_t, bins_l = discretizer.bins_temp, discretizer.bins_load
+    low, high = env.observation_space.low, env.observation_space.high
+    temp_points = _bin_points(bins_t, low[0], high[0], resolution)
+    load_points = _bin_points(bins_l, low[1], high[1], resolution)
+
+    z, w = np.polynomial.hermite_e.hermegauss(noise_points)
+    noise = z * env.heat_noise_std
+    noise_w = w / w.sum()
+    load_changes = np.arange(-env.max_load_change, env.max_load_change + 1)
+
+    n_t, n_l = len(bins_t), len(bins_l)
+    n_states = n_t * n_l
+    n_actions = env.action_space.n
+    P = np.zeros((n_states, n_actions, n_states))
+    R = np.zeros((n_states, n_actions))
+
+    for i in range(n_t):
+        for j in range(n_l):
+            t, l = temp_points[i], load_points[j]
+            if len(t) == 0 or len(l) == 0:
+                continue
+            s = i * n_l + j
+            # 軸: (温度点, 負荷点, ノイズ, 負荷変動)
+            T = t[:, None, None, None]
+            L = l[None, :, None, None]
+            N = noise[None, None, :, None]
+            D = load_changes[None, None, None, :]
+            shape = (len(t), len(l), len(noise), len(load_changes))
+            weight = np.broadcast_to(noise_w[None, None, :, None], shape).ravel()
+            weight = weight / weight.sum()
+
+            next_load = np.clip(L + D, low[1], high[1])
+            next_l_idx = np.broadcast_to(_digitize(next_load, bins_l), shape).ravel()
+
+            for a in range(n_actions):
+                next_temp = np.clip(T + env.heat_coef * L + N - env.cooling_coef * a
+                                    - env.decay_coef * (T - env.ambient_temp), low[0], high[0])
+                next_temp = np.broadcast_to(next_temp, shape).ravel()
+                terminated = (next_temp >= env.fail_temp_high) | (next_temp <= env.fail_temp_low)
+
+                R[s, a] = np.sum(weight * reward_fn(env, next_temp, a, terminated))
+                alive = ~terminated
+                next_s = _digitize(next_temp[alive], bins_t) * n_l + next_l_idx[alive]
+                P[s, a] = np.bincount(next_s, weights=weight[alive], minlength=n_states)
+
+    return P, R
+
+
+def solve_server_cooling(env, discretizer, gamma=0.95, reward="default"):
+    """
+    ServerCoolingEnv の最適表形式方策を価値反復で求める。
+    Returns:
+        StatePolicy（離散化した観測で行動を選ぶ）
+    """
+    P, R = build_cooling_mdp(env, discretizer, reward=reward)
+    policy, _, _ = value_iteration(P, R, gamma=gamma)
+    table = policy.reshape(discretizer.shape)
+    return StatePolicy(table, lambda env, obs: discretizer(obs))
+
+
+def build_gridworld_mdp(env, reward="default"):
+    """
+    AbstractSensorGridWorld の既知のレイアウトから位置を状態とする決定的MDPを作る。
+    （エージェントはノイズ付きセンサーしか見ないので、これは完全観測の上界になる）
+
+    Args:
+        reward: "default"（環境のデフォルト報酬）または "metric"（ゴール到達で+1）
+    Returns:
+        (P, R) : 状態は r * grid_size + c
+    """
+    size = env.grid_size
+    n_states = size * size
+    n_actions = env.action_space.n
+    moves = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+    P = np.zeros((n_states, n_actions, n_states))
+    R = np.zeros((n_states, n_actions))
+
+    for r in range(size):
+        for c in range(size):
+            if env.grid[r, c] != 0:
+                continue # 壁・トラップ・ゴールには行動の起点として立たない
+            s = r * size + c
+            old_dist = abs(r - env.goal[0]) + abs(c - env.goal[1])
+            for a, (dr, dc) in enumerate(moves):
+                nr, nc = r + dr, c + dc
+                cell = env.grid[nr, nc] if (0 <= nr < size and 0 <= nc < size) else 1
+                terminal = cell in (2, 3)
+                if cell == 1:
+                    nr, nc = r, c
+                    step_reward = -0.5
+                elif cell == 2:
+                    step_reward = -10.0
+                elif cell == 3:
+                    step_reward = 10.0
+                else:
+                    new_dist = abs(nr - env.goal[0]) + abs(nc - env.goal[1])
+                    step_reward = -0.1 + (0.2 if new_dist < old_dist else -0.1 if new_dist > old_dist else 0.0)
+                if reward == "metric":
+                    step_reward = 1.0 if cell == 3 else 0.0
+                R[s, a] = step_reward
+                if not terminal:
+                    P[s, a, nr * size + nc] = 1.0
+
+    return P, R
+
+
+def solve_gridworld(env, gamma=0.95, reward="default"):
+    """
+    AbstractSensorGridWorld の最適方策を価値反復で求める。
+    Returns:
+        StatePolicy（環境の agent_pos で行動を選ぶ）
+    """
+    P, R = build_gridworld_mdp(env, reward=reward)
+    policy, _, _ = value_iteration(P, R, gamma=gamma)
+    table = policy.reshape(env.grid_size, env.grid_size)
+    return StatePolicy(table, lambda env, obs: env.unwrapped.agent_pos)